@@ -0,0 +1,254 @@
+# allocator.py
+
+import argparse
+import ast
+import json
+import time
+
+import numpy as np
+
+from backend.match_events import ASSIGNED
+from backend.matcher import life_path
+from backend.room_index import LOGISTICS_FIELDS, RoomIndex
+from backend.synthetic import generate
+
+EPSILON = 0.01  # bid increment; the result is within len(people) * EPSILON of the best total
+
+
+def occupant_record(email, user):
+    """What gets stored in a room's `occupants` list (no password hash)."""
+    record = {key: user.get(key) for key in ("name", "dob", "vibe", "traits", "room_preferences")}
+    record["email"] = email
+    record["life_path"] = life_path(user)
+    return record
+
+def free_capacity(room):
+    return room.get("capacity", 1) - len(room.get("occupants", []))
+
+
+def _room_signature(room):
+    # Rooms with the same occupants and logistics score identically for everyone
+    occupants = tuple(sorted(
+        (json.dumps(o.get("traits", {}), sort_keys=True), "dob" in o, o.get("dob"))
+        for o in room.get("occupants", [])
+    ))
+    return occupants, tuple(json.dumps(room.get(field)) for field in LOGISTICS_FIELDS)
+
+
+def group_rooms(rooms):
+    """Group rooms by scoring signature. Returns (representative rooms, room indices per group)."""
+    groups = {}
+    for i, room in enumerate(rooms):
+        groups.setdefault(_room_signature(room), []).append(i)
+    members = list(groups.values())
+    return [rooms[m[0]] for m in members], members
+
+
+def auction(benefit, bidder_class, capacity, eps=EPSILON):
+    """Forward auction for a capacitated assignment.
+
+    Bidder i gains `benefit[bidder_class[i], j]` from object j, which holds at
+    most `capacity[j]` bidders; there must be room for every bidder. Returns the
+    object of each bidder, within len(bidder_class) * eps of the best total
+    benefit.
+
+    Prices start at zero and there is a single phase. Epsilon scaling would
+    carry prices from one phase into the next, and with more slots than
+    bidders an object could end the last phase unbid and empty at an old
+    price, which loses optimality. Starting from zero, an object nobody bids
+    on keeps price 0, which is what optimality needs.
+    """
+    n_bidders, n_objects = len(bidder_class), benefit.shape[1]
+    capacity = np.asarray(capacity, dtype=np.int64)
+    prices = np.zeros(n_objects)
+    owner = np.full(n_bidders, -1)
+    bids = np.zeros(n_bidders)
+    bidders = np.arange(n_bidders)
+    while len(bidders):
+        # Bidders of one class see the same net values, so each class is scored once
+        classes, inverse, counts = np.unique(bidder_class[bidders], return_inverse=True, return_counts=True)
+        net = benefit[classes] - prices
+        rows = np.arange(len(classes))
+        if n_objects > 1:
+            top_two = np.argpartition(-net, 1, axis=1)[:, :2]
+            best = top_two[rows, 0]
+            gap = net[rows, best] - net[rows, top_two[:, 1]]
+        else:
+            best, gap = np.zeros(len(classes), dtype=np.int64), np.zeros(len(classes))
+        best, gap = best[inverse], gap[inverse]
+
+        # m identical bidders take the m best slots at once instead of
+        # fighting over the same one for m rounds; each bids against the
+        # (m+1)-th best slot. An object offers capacity[j] slots, so several
+        # of them can land on one object, as they would bidding one by one.
+        for row in np.flatnonzero(counts > 1):
+            m = counts[row]
+            same = np.flatnonzero(inverse == row)
+            order = np.argsort(-net[row], kind="stable")
+            needed = np.searchsorted(np.cumsum(capacity[order]), m + 1) + 1
+            slots = np.repeat(order[:needed], capacity[order[:needed]])[:m + 1]
+            best[same] = slots[:m]
+            gap[same] = net[row, slots[:m]] - net[row, slots[min(m, len(slots) - 1)]]
+
+        owner[bidders] = best
+        bids[bidders] = prices[best] + gap + eps
+
+        # Each object that got bids keeps its highest bids up to capacity
+        contested = np.zeros(n_objects, dtype=bool)
+        contested[best] = True
+        holders = np.flatnonzero((owner >= 0) & contested[owner])
+        holders = holders[np.lexsort((-bids[holders], owner[holders]))]
+        objects = owner[holders]
+        starts = np.flatnonzero(np.r_[True, objects[1:] != objects[:-1]])
+        rank = np.arange(len(objects)) - np.repeat(starts, np.diff(np.r_[starts, len(objects)]))
+        losing = rank >= capacity[objects]
+        owner[holders[losing]] = -1
+
+        # A full object's price is its lowest winning bid
+        last_kept = holders[rank == capacity[objects] - 1]
+        prices[owner[last_kept]] = bids[last_kept]
+        bidders = holders[losing]
+    return owner
+
+
+def assign(benefit, person_class, capacity):
+    """Group for each person maximizing total benefit under group capacities (-1 if no bed is left).
+
+    Whichever side is smaller bids: people bid for groups when there are enough
+    beds, otherwise each free bed bids for a person, which avoids long price
+    wars over scarce beds.
+    """
+    capacity = np.asarray(capacity, dtype=np.int64)
+    result = np.full(len(person_class), -1)
+    open_groups = np.flatnonzero(capacity > 0)
+    if not len(open_groups) or not len(person_class):
+        return result
+    benefit, capacity = benefit[:, open_groups], capacity[open_groups]
+
+    if len(person_class) <= capacity.sum():
+        return open_groups[auction(benefit, person_class, capacity)]
+
+    bed_group = np.repeat(np.arange(len(open_groups)), capacity)
+    chosen = auction(benefit[person_class].T, bed_group, np.ones(len(person_class), dtype=np.int64))
+    result[chosen] = open_groups[bed_group]
+    return result
+
+
+def allocate(users, rooms, pairs=()):
+    """Place matched pairs and then single users into rooms in one global pass.
+
+    `users` maps email -> user record, `pairs` is a list of (email, email).
+    Rooms are scored against the occupants they had before this run, with the
+    same 0.7/0.2/0.1 objective as match_user_to_rooms; a pair scores the sum of
+    both members. Returns {email: room_id} for everyone who got a room.
+    """
+    paired = {email for pair in pairs for email in pair}
+    singles = [email for email in users if email not in paired]
+    groups, members = group_rooms(rooms)
+    free = np.array([max(free_capacity(room), 0) for room in rooms])
+    assignment = {}
+    if not groups:
+        return assignment
+
+    emails = list(users)
+    row_of = {email: i for i, email in enumerate(emails)}
+    # Scored against the occupants rooms had before this run
+    scores = RoomIndex(groups).score_matrix([users[email] for email in emails])
+
+    # Pairs first, each needing two beds in the same room
+    if pairs:
+        pair_benefit = np.array([scores[row_of[a]] + scores[row_of[b]] for a, b in pairs])
+        pair_capacity = [int(sum(free[i] // 2 for i in m)) for m in members]
+        placed = assign(pair_benefit, np.arange(len(pairs)), pair_capacity)
+        for (a, b), g in zip(pairs, placed):
+            if g < 0:
+                continue
+            room_index = next(i for i in members[g] if free[i] >= 2)
+            free[room_index] -= 2
+            assignment[a] = assignment[b] = rooms[room_index]["room_id"]
+
+    if singles:
+        single_capacity = [int(sum(free[i] for i in m)) for m in members]
+        placed = assign(scores, np.array([row_of[email] for email in singles]), single_capacity)
+        for email, g in zip(singles, placed):
+            if g < 0:
+                continue
+            room_index = next(i for i in members[g] if free[i] >= 1)
+            free[room_index] -= 1
+            assignment[email] = rooms[room_index]["room_id"]
+    return assignment
+
+
+def pending_units(storage):
+    """Unassigned users and matched pairs whose members are both still unassigned."""
+    users = {email: user for email, user in storage.all_users().items() if not user.get("assigned_room")}
+    pairs = []
+    for match_key, match in storage.all_matches().items():
+        a, b = ast.literal_eval(match_key)
+        if a in users and b in users and not match.get("room"):
+            pairs.append((a, b))
+    return users, pairs
+
+
+def apply_allocation(storage, rooms, pairs, assignment):
+    """Save an allocation with one write per table."""
+    rooms_by_id = {room["room_id"]: room for room in rooms}
+    with storage.transaction():
+        # Re-read the users inside the transaction so a trait update from an app worker isn't overwritten
+        users = storage.get_users(assignment)
+        for email, user in users.items():
+            user["assigned_room"] = assignment[email]
+            rooms_by_id[assignment[email]].setdefault("occupants", []).append(occupant_record(email, user))
+        storage.put_users(users)
+        storage.put_rooms([rooms_by_id[room_id] for room_id in {assignment[email] for email in users}])
+        placed = {str(tuple(sorted((a, b)))): assignment[a] for a, b in pairs if a in users and b in users}
+        matches = storage.get_matches(placed)
+        for match_key, room_id in placed.items():
+            match = matches.setdefault(match_key, {})
+            match["room"] = room_id
+            match["status"] = ASSIGNED
+        storage.put_matches(matches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Assign all unassigned users and matched pairs to rooms in one batch.")
+    parser.add_argument("--write", action="store_true", help="save assignments (default is a dry run)")
+    parser.add_argument("--benchmark", nargs=2, type=int, metavar=("USERS", "ROOMS"), help="time the allocator on synthetic data instead")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        dataset = generate(*args.benchmark)
+        users, rooms, pairs = dataset["users"], dataset["rooms"], dataset["pairs"]
+    else:
+        from backend.storage import get_storage
+        storage = get_storage()
+        if args.write:
+            # Keep running app workers from assigning rooms until this allocation is saved
+            storage.lock("rooms").acquire()
+
+    try:
+        if not args.benchmark:
+            users, pairs = pending_units(storage)
+            rooms = storage.get_rooms()
+
+        start = time.perf_counter()
+        assignment = allocate(users, rooms, pairs)
+        elapsed = time.perf_counter() - start
+        print(json.dumps({
+            "users": len(users),
+            "pairs": len(pairs),
+            "rooms": len(rooms),
+            "free_beds": int(sum(max(free_capacity(room), 0) for room in rooms)),
+            "placed": len(assignment),
+            "seconds": round(elapsed, 3),
+        }))
+
+        if args.write and not args.benchmark:
+            apply_allocation(storage, rooms, pairs, assignment)
+    finally:
+        if args.write and not args.benchmark:
+            storage.lock("rooms").release()
+
+
+if __name__ == "__main__":
+    main()
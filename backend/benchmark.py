@@ -0,0 +1,386 @@
+# benchmark.py
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from backend.matcher import (
+    NUMEROLOGY_SCORES, calculate_life_path_number, chart_numerology_score, compatibility_from_codes, compute_compatibility,
+    encode_traits, life_path, match_user_to_rooms, rank_rooms_for_user,
+)
+from backend import reciprocal
+from backend.reciprocal import ReciprocalIndex
+from backend.room_index import RoomIndex
+from backend.scoring import CandidateMatrix, SignatureBuckets, rank_profiles
+from backend.session_deck import DeckCache
+from backend.synthetic import PASSWORD, generate, transcript, write_dataset
+from backend.trait_classifier import TraitClassifier
+
+BASELINE_FILE = "backend/benchmark_baseline.json"
+# How much worse than the baseline a metric has to be to count as a regression. Set above
+# what two runs of an unchanged tree differ by on a busy single-core machine: micro timings
+# are the median of REPEATS interleaved loops, endpoint metrics the median of ENDPOINT_REPEATS load runs.
+REGRESSION_THRESHOLDS = {"micro": 1.5, "endpoints": 2.0, "memory": 1.25}
+MIN_TIME = 0.05  # seconds each timed loop of a micro-benchmark runs for
+REPEATS = 7
+ENDPOINT_REPEATS = 3
+
+
+def profile_records(dataset):
+    """Personas and users as the id-carrying dicts the scalar reference ranking takes."""
+    return dataset["personas"] + [{**user, "id": email} for email, user in dataset["users"].items()]
+
+
+def loop_count(func, min_time=MIN_TIME):
+    """Calls per timed loop: doubled until a loop runs for `min_time`."""
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        if time.perf_counter() - start >= min_time:
+            return loops
+        loops *= 2
+
+
+def time_calls(cases, min_time=MIN_TIME, repeats=REPEATS):
+    """Seconds per call of each function in `cases`: the median of `repeats` timed loops.
+
+    The repeats go round all the cases in turn rather than one case at a
+    time, so a stretch where the machine is busy with something else slows
+    one loop of every case instead of every loop of a few cases.
+    """
+    loops = {name: loop_count(func, min_time) for name, func in cases.items()}
+    timings = {name: [] for name in cases}
+    for _ in range(repeats):
+        for name, func in cases.items():
+            start = time.perf_counter()
+            for _ in range(loops[name]):
+                func()
+            timings[name].append((time.perf_counter() - start) / loops[name])
+    return {name: float(np.median(seconds)) for name, seconds in timings.items()}
+
+
+def keyword_spans(questions, text):
+    """Reference for KeywordAutomaton.find: one regex scan per keyword, as sorted (start, end, keyword)."""
+    text = text.lower()
+    keywords = {word.lower() for question in questions for words in question["keywords"].values() for word in words}
+    return sorted(
+        (m.start(), m.end(), keyword)
+        for keyword in keywords
+        for m in re.finditer(r"(?<![^\W_])" + re.escape(keyword) + r"(?![^\W_])", text)
+    )
+
+
+def micro_benchmarks(dataset):
+    users = list(dataset["users"].values())
+    rooms = dataset["rooms"]
+    user, other = users[0], users[1]
+    email = next(iter(dataset["users"]))
+    matrix = CandidateMatrix.from_sources(dataset["personas"], dataset["users"])
+    buckets = SignatureBuckets(matrix)
+    buckets.sync()
+    deck_cache = DeckCache(matrix)
+    rank = lambda exclude, k, after: matrix.top_k(user["traits"], user["dob"], exclude=exclude, k=k, after=after)
+    room_index = RoomIndex(rooms)
+    candidates = profile_records(dataset)
+    classifier = TraitClassifier.from_file()
+    call = transcript(random.Random(0), user["traits"], classifier.questions)
+    build_dir = tempfile.mkdtemp(prefix="reciprocal-")
+    reciprocal.build(matrix, dataset["users"], directory=build_dir, processes=1)
+    reciprocal_index = ReciprocalIndex.load(build_dir)
+
+    def pair_score_chart():
+        # What scoring one pair cost before the lookup tables: parse both dobs, walk the chart, compare trait dicts
+        compatibility = compute_compatibility(user["traits"], other["traits"])
+        numerology = chart_numerology_score(calculate_life_path_number.__wrapped__(user["dob"]), calculate_life_path_number.__wrapped__(other["dob"]))
+        return compatibility, numerology
+
+    user_codes, other_codes = encode_traits(user["traits"]), encode_traits(other["traits"])
+
+    def pair_score_tables():
+        return compatibility_from_codes(user_codes, other_codes), NUMEROLOGY_SCORES[life_path(user)][life_path(other)]
+
+    cases = {
+        "compute_compatibility": lambda: compute_compatibility(user["traits"], other["traits"]),
+        "calculate_life_path_number": lambda: calculate_life_path_number(user["dob"]),
+        "pair_score.chart": pair_score_chart,
+        "pair_score.tables": pair_score_tables,
+        "rank_profiles": lambda: rank_profiles(user, candidates, set()),
+        "candidate_matrix.top_k": lambda: matrix.top_k(user["traits"], user["dob"], k=20),
+        "signature_buckets.top_k": lambda: buckets.top_k(user["traits"], user["dob"], k=20),
+        "deck_cache.page": lambda: deck_cache.page(email, user["traits"], user["dob"], {email}, 20, None, rank),
+        "reciprocal.top_k.live": lambda: reciprocal.top_k(matrix, None, email, user, {email}, 20),
+        "reciprocal.top_k.precomputed": lambda: reciprocal.top_k(matrix, reciprocal_index, email, user, {email}, 20),
+        "reciprocal.build": lambda: reciprocal.build(matrix, dataset["users"], directory=build_dir, processes=1),
+        "match_user_to_rooms": lambda: match_user_to_rooms(user, rooms),
+        "room_index.best_room": lambda: room_index.best_room(user, min_free=2),
+        "rank_rooms_for_user": lambda: rank_rooms_for_user(user, rooms),
+        "room_index.rank": lambda: room_index.rank(user),
+        "trait_classifier.classify": lambda: classifier.classify(call),
+    }
+    results = {name: {"us_per_op": round(seconds * 1e6, 3)} for name, seconds in time_calls(cases).items()}
+    shutil.rmtree(build_dir)
+    return results
+
+
+def equivalence_checks(dataset, samples=20, seed=0):
+    """The vectorized paths must give the same answers as the scalar reference on this data."""
+    rng = random.Random(seed)
+    matrix = CandidateMatrix.from_sources(dataset["personas"], dataset["users"])
+    deck_cache = DeckCache(matrix, deck_size=50)
+    candidates = profile_records(dataset)
+    classifier = TraitClassifier.from_file()
+    checks = {"ranked_matches": True, "deck_pages": True, "reciprocal_scores": True, "reciprocal_pages": True,
+              "reciprocal_changed_pages": True, "keyword_spans": True}
+    # A short list, so paging runs past it into the live continuation
+    build_dir = tempfile.mkdtemp(prefix="reciprocal-")
+    reciprocal.build(matrix, dataset["users"], k=50, directory=build_dir, processes=1)
+    reciprocal_index = ReciprocalIndex.load(build_dir)
+    # The same build served to a matrix whose candidates change after it ran
+    changed, changed_index = CandidateMatrix.from_sources(dataset["personas"], dataset["users"]), ReciprocalIndex.load(build_dir)
+
+    for email in rng.sample(list(dataset["users"]), min(samples, len(dataset["users"]))):
+        user = dataset["users"][email]
+        expected = [(p["id"], p["score"]) for p in rank_profiles(user, candidates, {email})]
+        got = [(matrix.ids[row], score) for row, score in matrix.top_k(user["traits"], user["dob"], exclude={email})]
+        checks["ranked_matches"] &= expected == got
+
+        # Page through the deck with a cursor, swiping the first card of every page
+        seen, after = {email}, None
+        rank = lambda exclude, k, after: matrix.top_k(user["traits"], user["dob"], exclude=exclude, k=k, after=after)
+        for _ in range(8):
+            page = deck_cache.page(email, user["traits"], user["dob"], seen, 20, after, rank)
+            checks["deck_pages"] &= page == rank(seen, 20, after)
+            if not page:
+                break
+            seen.add(matrix.ids[page[0][0]])
+            deck_cache.discard(email, matrix.ids[page[0][0]])
+            after = (page[-1][1], page[-1][0])
+
+        # Both directions through the matcher functions, combined as a harmonic mean
+        user_codes = encode_traits(user["traits"])
+        raw = matrix.reciprocal_scores(user["traits"], user["dob"])
+        for other in rng.sample(candidates, 50):
+            other_codes = encode_traits(other.get("traits", {}))
+            forward = (0.8 * compatibility_from_codes(user_codes, other_codes) + 0.2 * NUMEROLOGY_SCORES[life_path(user)][life_path(other)] * 2) * 10
+            reverse = (0.8 * compatibility_from_codes(other_codes, user_codes) + 0.2 * NUMEROLOGY_SCORES[life_path(other)][life_path(user)] * 2) * 10
+            expected_score = 2 * forward * reverse / (forward + reverse) if forward + reverse else 0
+            checks["reciprocal_scores"] &= bool(abs(raw[matrix.rows[other["id"]]] - expected_score) < 1e-9)
+
+        # Precomputed pages, past the end of the stored list, against live reciprocal ranking
+        seen, after = {email} | set(rng.sample(list(dataset["users"]), 20)), None
+        live = matrix.top_k(user["traits"], user["dob"], exclude=seen, k=100, raw=raw)
+        paged = []
+        for _ in range(5):
+            paged += reciprocal.top_k(matrix, reciprocal_index, email, user, seen, 20, after)
+            after = (paged[-1][1], paged[-1][0])
+        checks["reciprocal_pages"] &= paged == live
+
+        # Give the best stored candidate other traits and the worst one this user's, then page again
+        ranking = changed.top_k(user["traits"], user["dob"], exclude=seen, raw=changed.reciprocal_scores(user["traits"], user["dob"]))
+        for row, traits in ((ranking[0][0], {trait: "changed" for trait in user["traits"]}), (ranking[-1][0], dict(user["traits"]))):
+            candidate_id = changed.ids[row]
+            profile = dataset["users"].get(candidate_id) or next(p for p in dataset["personas"] if p["id"] == candidate_id)
+            changed.upsert(candidate_id, {**profile, "traits": traits})
+        live = changed.top_k(user["traits"], user["dob"], exclude=seen, k=100, raw=changed.reciprocal_scores(user["traits"], user["dob"]))
+        paged, after = [], None
+        for _ in range(5):
+            paged += reciprocal.top_k(changed, changed_index, email, user, seen, 20, after)
+            after = (paged[-1][1], paged[-1][0])
+        checks["reciprocal_changed_pages"] &= paged == live
+
+        call = transcript(rng, user["traits"], classifier.questions)
+        found = [(start, end, call.lower()[start:end]) for start, end, _ in classifier.automaton.find(call)]
+        checks["keyword_spans"] &= sorted(found) == keyword_spans(classifier.questions, call)
+    shutil.rmtree(build_dir)
+    return checks
+
+
+def memory_footprint(n_profiles, seed=0):
+    """tracemalloc view of the candidate matrix over `n_profiles` users, and of serving pages from it.
+
+    The dataset is generated while tracing and dropped once the matrix is
+    built, so `retained_mb` is everything the matrix keeps alive.
+    """
+    tracemalloc.start()
+    try:
+        dataset = generate(n_profiles, 0, swipes_per_user=0, seed=seed)
+        matrix = CandidateMatrix.from_sources(dataset["personas"], dataset["users"])
+        email, user = next(iter(dataset["users"].items()))
+        del dataset
+        retained = tracemalloc.get_traced_memory()[0]
+
+        deck_cache = DeckCache(matrix)
+        rank = lambda exclude, k, after: matrix.top_k(user["traits"], user["dob"], exclude=exclude, k=k, after=after)
+        peaks = {}
+        after = None
+        for name in ("first_page_peak_kb", "next_page_peak_kb"):
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+            page = deck_cache.page(email, user["traits"], user["dob"], {email}, 20, after, rank)
+            cards = [matrix.cards[row].to_json(score) for row, score in page]
+            peaks[name] = round((tracemalloc.get_traced_memory()[1] - start) / 1024, 1)
+            after = (page[-1][1], page[-1][0])
+    finally:
+        tracemalloc.stop()
+    return {"retained_mb": round(retained / 1e6, 1), **peaks}
+
+
+def latency_summary(samples, elapsed):
+    samples = np.array(samples) * 1000
+    return {
+        "requests_per_s": round(len(samples) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples, 95)), 3),
+        "p99_ms": round(float(np.percentile(samples, 99)), 3),
+    }
+
+
+async def endpoint_load(clients, requests_per_client, seed=0):
+    """Log in `clients` users and have each page /ranked-matches and /swipe through the ASGI app in-process.
+
+    Reads its data from DATA_DIR / STORAGE_BACKEND, so run it in a process started with those set.
+    """
+    import httpx
+    from backend.main import app, storage
+
+    rng = random.Random(seed)
+    emails = rng.sample(list(storage.all_users()), clients)
+    latencies = {"/ranked-matches": [], "/swipe": []}
+
+    async def session(client, email):
+        await client.post("/login", data={"email": email, "password": PASSWORD})
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            response = await client.get("/ranked-matches", params={"limit": 20})
+            latencies["/ranked-matches"].append(time.perf_counter() - start)
+            profiles = response.json()["profiles"]
+            if not profiles:
+                break
+            start = time.perf_counter()
+            await client.post("/swipe", json={"target": profiles[0]["id"], "direction": rng.choice(["left", "right"])})
+            latencies["/swipe"].append(time.perf_counter() - start)
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        http_clients = [httpx.AsyncClient(transport=transport, base_url="http://benchmark") for _ in emails]
+        start = time.perf_counter()
+        await asyncio.gather(*(session(client, email) for client, email in zip(http_clients, emails)))
+        elapsed = time.perf_counter() - start
+        for client in http_clients:
+            await client.aclose()
+    return {route: latency_summary(samples, elapsed) for route, samples in latencies.items() if samples}
+
+
+def run_endpoint_load(dataset, backend, ranking_mode, clients, requests_per_client, repeats=ENDPOINT_REPEATS):
+    """Median of each metric over `repeats` load runs, each on a fresh copy of the dataset."""
+    runs = [endpoint_run(dataset, backend, ranking_mode, clients, requests_per_client) for _ in range(repeats)]
+    return {
+        route: {metric: round(float(np.median([run[route][metric] for run in runs])), 3) for metric in metrics}
+        for route, metrics in runs[0].items()
+    }
+
+
+def endpoint_run(dataset, backend, ranking_mode, clients, requests_per_client):
+    # The app reads DATA_DIR and STORAGE_BACKEND at import time, so the load runs in a fresh process
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_dataset(data_dir, dataset)
+        # LOG_LEVEL=WARNING keeps httpx from logging every in-process request inside the timings
+        env = dict(os.environ, DATA_DIR=data_dir, STORAGE_BACKEND=backend, RANKING_MODE=ranking_mode, LOG_LEVEL="WARNING",
+                   SQLITE_PATH=os.path.join(data_dir, "matchmyvibe.db"), TRAIT_QUEUE_PATH=os.path.join(data_dir, "trait_queue.db"))
+        if backend == "sqlite":
+            subprocess.run([sys.executable, "-m", "backend.storage", "migrate", data_dir, env["SQLITE_PATH"]], env=env, check=True, stdout=subprocess.DEVNULL)
+        output = subprocess.run(
+            [sys.executable, "-m", "backend.benchmark", "--endpoint-load", str(clients), str(requests_per_client)],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(results, baseline, thresholds=REGRESSION_THRESHOLDS):
+    """Metrics more than their section's threshold times worse than the baseline, as readable strings."""
+    regressions = []
+    for section, threshold in thresholds.items():
+        for name, metrics in results.get(section, {}).items():
+            for metric, value in metrics.items():
+                before = baseline.get(section, {}).get(name, {}).get(metric)
+                if not before or not value:
+                    continue
+                # Throughput is better when higher, everything else when lower
+                ratio = before / value if metric == "requests_per_s" else value / before
+                if ratio > threshold:
+                    regressions.append(f"{section}/{name} {metric}: {before} -> {value} ({ratio:.2f}x worse)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the matcher functions and the API hot paths on synthetic data.")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--rooms", type=int, default=500)
+    parser.add_argument("--personas", type=int, default=10)
+    parser.add_argument("--swipes", type=int, default=20, help="swipes per user in the generated history")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--clients", type=int, default=20, help="concurrent users in the endpoint load")
+    parser.add_argument("--requests", type=int, default=20, help="ranked-matches + swipe rounds per client")
+    parser.add_argument("--endpoint-repeats", type=int, default=ENDPOINT_REPEATS, help="load runs to take the median of")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="sqlite")
+    parser.add_argument("--ranking-mode", choices=["exact", "bucketed"], default="exact")
+    parser.add_argument("--skip-endpoints", action="store_true")
+    parser.add_argument("--memory-profiles", type=int, default=100_000, help="users in the tracemalloc footprint run; 0 skips it")
+    parser.add_argument("--out", help="also write the results to this file")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="overwrite the baseline with these results")
+    parser.add_argument("--endpoint-load", nargs=2, type=int, metavar=("CLIENTS", "REQUESTS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.endpoint_load:
+        print(json.dumps(asyncio.run(endpoint_load(*args.endpoint_load))))
+        return
+
+    dataset = generate(args.users, args.rooms, args.personas, args.swipes, args.seed)
+    results = {
+        "params": {key: getattr(args, key) for key in ("users", "rooms", "personas", "swipes", "seed", "clients", "requests", "backend", "ranking_mode")},
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(), "cpus": os.cpu_count()},
+        "checks": equivalence_checks(dataset, seed=args.seed),
+        "micro": micro_benchmarks(dataset),
+    }
+    if args.memory_profiles:
+        results["memory"] = {f"candidate_matrix@{args.memory_profiles}": memory_footprint(args.memory_profiles, args.seed)}
+    if not args.skip_endpoints:
+        results["endpoints"] = run_endpoint_load(dataset, args.backend, args.ranking_mode, args.clients, args.requests, args.endpoint_repeats)
+
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("params") != results["params"]:
+            print(f"warning: {args.baseline} was recorded with different params", file=sys.stderr)
+        results["regressions"] = compare(results, baseline)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            f.write(output + "\n")
+
+    if not all(results["checks"].values()) or results.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
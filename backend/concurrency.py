@@ -0,0 +1,109 @@
+# concurrency.py
+
+import asyncio
+import fcntl
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+# Blocking storage calls (file reads/writes, SQLite) run on a bounded pool so a
+# slow disk never stalls the event loop
+IO_THREADS = int(os.getenv("IO_THREADS", "8"))
+_io_pool = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="storage-io")
+
+# The in-memory indexes (candidate matrix, score cache, room index) are not
+# thread-safe, so ranking and index updates share one worker: off the loop,
+# but never concurrent with each other
+_index_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="index")
+
+
+async def run_io(func, *args, **kwargs):
+    """Run a blocking storage call on the I/O pool."""
+    return await asyncio.get_running_loop().run_in_executor(_io_pool, functools.partial(func, *args, **kwargs))
+
+async def run_index(func, *args, **kwargs):
+    """Run ranking or an index update on the single index worker."""
+    return await asyncio.get_running_loop().run_in_executor(_index_pool, functools.partial(func, *args, **kwargs))
+
+
+class KeyedLocks:
+    """One asyncio.Lock per key, created on demand and dropped when unused.
+
+    hold() takes several keys in sorted order, so two requests locking the
+    same pair of users can never deadlock.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._waiters = {}
+
+    @asynccontextmanager
+    async def hold(self, *keys):
+        keys = sorted(set(keys))
+        for key in keys:
+            self._waiters[key] = self._waiters.get(key, 0) + 1
+        acquired = []
+        try:
+            for key in keys:
+                lock = self._locks.setdefault(key, asyncio.Lock())
+                await lock.acquire()
+                acquired.append(lock)
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+            for key in keys:
+                self._waiters[key] -= 1
+                if not self._waiters[key]:
+                    del self._waiters[key]
+                    self._locks.pop(key, None)
+
+
+class FileLock:
+    """Exclusive lock shared by every worker process on the machine (flock on `path`) and every thread in this one.
+
+    Not reentrant, and not tied to a thread: hold() acquires it on the I/O pool
+    and releases it from the event loop.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._fd = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except BaseException:
+                os.close(fd)
+                raise
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        self._fd = fd
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    @asynccontextmanager
+    async def hold(self):
+        await run_io(self.acquire)
+        try:
+            yield
+        finally:
+            self.release()
@@ -0,0 +1,77 @@
+# loadtest.py
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import httpx
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+async def signup(base_url, email):
+    client = httpx.AsyncClient(base_url=base_url, timeout=60)
+    await client.post("/signup", data={"name": email.split("@")[0], "email": email, "password": "loadtest", "dob": "2002-05-17"})
+    return client
+
+
+async def swipe_worker(client, email, targets, swipes, latencies, errors):
+    for target in random.sample(targets, min(swipes, len(targets))):
+        direction = "right" if random.random() < 0.7 else "left"
+        start = time.perf_counter()
+        try:
+            response = await client.post("/swipe", json={"target": target, "direction": direction})
+            response.raise_for_status()
+        except httpx.HTTPError:
+            errors.append(email)
+            continue
+        latencies["swipe"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        response = await client.get("/ranked-matches", params={"limit": 10})
+        if response.status_code == 200:
+            latencies["ranked-matches"].append(time.perf_counter() - start)
+        else:
+            errors.append(email)
+
+
+async def run(base_url, users, swipes):
+    run_id = uuid.uuid4().hex[:8]
+    emails = [f"load-{run_id}-{i}@example.com" for i in range(users)]
+    clients = await asyncio.gather(*(signup(base_url, email) for email in emails))
+    latencies = {"swipe": [], "ranked-matches": []}
+    errors = []
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        swipe_worker(client, email, [e for e in emails if e != email], swipes, latencies, errors)
+        for client, email in zip(clients, emails)
+    ))
+    elapsed = time.perf_counter() - start
+    await asyncio.gather(*(client.aclose() for client in clients))
+
+    report = {"users": users, "requests": sum(len(v) for v in latencies.values()), "errors": len(errors), "seconds": round(elapsed, 3)}
+    for route, samples in latencies.items():
+        report[route] = {f"p{q}_ms": round(percentile(samples, q) * 1000, 1) for q in (50, 95, 99)} if samples else {}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent swipe load test against a running server; reports p50/p95/p99 latency.")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=50, help="simulated users, each swiping concurrently")
+    parser.add_argument("--swipes", type=int, default=20, help="swipes per user")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.base_url, args.users, args.swipes))))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,254 @@
 from fastapi import FastAPI, Request, Form
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi.responses import RedirectResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
-from backend.matcher import match_user_to_rooms, rank_rooms_for_user, compute_compatibility, calculate_life_path_number, numerology_score
-import json
+from backend.matcher import calculate_life_path_number, rank_rooms_for_user
+from backend.allocator import occupant_record
+from backend.room_index import RoomIndex
+from backend.scoring import CandidateMatrix, ScoreCache, SignatureBuckets
+from backend import reciprocal
+from backend.reciprocal import ReciprocalIndex
+from backend.session_deck import DeckCache
+from backend.swipe_index import SwipeIndex
+from backend.storage import get_storage
+from backend.concurrency import KeyedLocks, run_io, run_index
+from backend.trait_queue import TraitQueue, call_id, coalesce, delivery_id, normalize_call_code
+from backend.trait_classifier import TraitClassifier
+from backend.match_events import ASSIGNED, NO_ROOM, PENDING, AssignmentFeed, match_key, next_batch, pending_events, sse
+from backend.metrics import COUNT_BUCKETS, REGISTRY, RequestMetrics
+from backend.profiling import ProfileRequests
+from contextlib import asynccontextmanager
 import os
+import asyncio
+import logging
 from dotenv import load_dotenv
 import hashlib
+import json
 import re
+import time
 from datetime import datetime
 
 load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY", "your-default-secret-key")
 
-app = FastAPI()
+# LOG_LEVEL=DEBUG also logs the per-room scores from the matcher
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Build the in-memory indexes before serving, off the event loop
+    await run_index(get_signature_buckets if RANKING_MODE == "bucketed" else get_candidates)
+    await run_index(get_deck_cache)
+    await run_index(get_room_index)
+    await run_io(get_swipe_index)
+    # Every worker queues the pending matches; the first to take the rooms lock assigns them
+    for event in pending_events(await run_io(storage.all_matches)):
+        match_events.put_nowait(event)
+    workers = [asyncio.create_task(apply_queued_traits()), asyncio.create_task(assign_matched_pairs())]
+    yield
+    for worker in workers:
+        worker.cancel()
+
+REQUEST_SECONDS = REGISTRY.histogram("http_request_duration_seconds", "HTTP request latency.", ("method", "route", "status"))
+CANDIDATES_SCORED = REGISTRY.histogram("ranking_candidates_scored", "Candidate scores computed per /ranked-matches request.", ("mode",), COUNT_BUCKETS)
+CACHE_HITS = REGISTRY.counter("cache_hits_total", "Lookups answered from a cache.", ("cache",))
+CACHE_MISSES = REGISTRY.counter("cache_misses_total", "Lookups that had to be computed from scratch.", ("cache",))
+CACHE_HIT_RATIO = REGISTRY.gauge("cache_hit_ratio", "Hits over lookups since startup.", ("cache",))
+CACHE_ENTRIES = REGISTRY.gauge("cache_entries", "Entries currently cached.", ("cache",))
+TRAIT_QUEUE_DEPTH = REGISTRY.gauge("trait_queue_depth", "Trait webhooks waiting to be applied.")
+MATCH_QUEUE_DEPTH = REGISTRY.gauge("match_queue_depth", "Mutual matches waiting for a room.")
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(SessionMiddleware, secret_key=SECRET_KEY)
+app.add_middleware(RequestMetrics, histogram=REQUEST_SECONDS)
+if os.getenv("PROFILING") == "1":
+    # Add ?profile=1 to any request to get its sampled stacks back
+    app.add_middleware(ProfileRequests)
 
 templates = Jinja2Templates(directory="templates")
-USERS_FILE = "backend/data/users.json"
-PERSONAS_FILE = "backend/data/personas.json"
-ROOMS_FILE = "backend/data/rooms.json"
-SWIPES_FILE = "backend/data/swipes.json"
-CURRENT_USER_FILE = "backend/data/current_user.json"
-# --- UPDATE: New file to store confirmed matches ---
-MATCHES_FILE = "backend/data/matches.json"
-# --- END UPDATE ---
+
+# Users, swipes, matches and rooms go through the storage layer (STORAGE_BACKEND=sqlite|json)
+storage = get_storage()
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+TRAIT_BATCH_SIZE = 500
+TRAIT_BATCH_DELAY = 0.05  # seconds to let a burst of webhooks pile up before applying them
+MATCH_BATCH_SIZE = 200
+MATCH_BATCH_DELAY = 0.02  # seconds to let nearby mutual matches join one assignment batch
+EVENT_KEEPALIVE = 15  # seconds between SSE comments that keep idle /match-events streams open
+SCORE_CACHE_SIZE = int(os.getenv("SCORE_CACHE_SIZE", "128"))
+DECK_CACHE_SIZE = int(os.getenv("DECK_CACHE_SIZE", "1024"))  # ranked decks kept, one per logged-in user; 0 disables
+DECK_TTL = float(os.getenv("DECK_TTL", "900"))  # seconds an idle deck is kept
+MAX_CLASSIFY_BATCH = 10_000  # transcripts per /classify-traits request
+CALL_CODE_VARIABLE = "call_code"  # extracted variable carrying the code shown on /traits (see webhook.py)
+CATCH_UP_INTERVAL = float(os.getenv("CATCH_UP_INTERVAL", "0.05"))  # seconds /ranked-matches may lag other workers' writes
+RECIPROCAL_RELOAD_INTERVAL = 30.0  # seconds between checks for a new build of the reciprocal batch job
+# "exact" scores every candidate (through the score cache); "bucketed" scores one
+# representative per (traits, life path) bucket and gives the same pages in sublinear time;
+# "reciprocal" ranks by how well both sides suit each other, from the batch job's build when fresh
+RANKING_MODES = ("exact", "bucketed", "reciprocal")
+RANKING_MODE = os.getenv("RANKING_MODE", "exact")
+
+# In-memory candidate matrix for /ranked-matches, built on first use and caught up with the users
+# written since `_users_version` (by any worker process) before each ranking, plus an LRU of
+# per-user score vectors that only rescores candidates whose traits/dob changed and the
+# ranked deck of each session, served from its head and patched on swipes and updates
+_candidates = None
+_users_version = None
+_score_cache = None
+_signature_buckets = None
+_deck_cache = None
+
+def get_candidates() -> CandidateMatrix:
+    global _candidates, _users_version
+    if _candidates is None:
+        users, _users_version = storage.users_since(None)
+        _candidates = CandidateMatrix.from_sources(storage.get_personas(), users)
+    return _candidates
+
+def get_score_cache() -> ScoreCache:
+    global _score_cache
+    if _score_cache is None:
+        _score_cache = ScoreCache(get_candidates(), maxsize=SCORE_CACHE_SIZE)
+    return _score_cache
+
+def get_deck_cache() -> DeckCache:
+    global _deck_cache
+    if _deck_cache is None:
+        _deck_cache = DeckCache(get_candidates(), maxsize=DECK_CACHE_SIZE, ttl=DECK_TTL)
+    return _deck_cache
+
+def get_signature_buckets() -> SignatureBuckets:
+    global _signature_buckets
+    if _signature_buckets is None:
+        _signature_buckets = SignatureBuckets(get_candidates())
+        _signature_buckets.sync()
+    return _signature_buckets
+
+# The latest build of `python -m backend.reciprocal`, memory-mapped and shared with the other
+# workers through the page cache; None until the job has run
+_reciprocal_index = None
+_reciprocal_checked = None
+
+def get_reciprocal_index() -> ReciprocalIndex | None:
+    global _reciprocal_index, _reciprocal_checked
+    now = time.monotonic()
+    if _reciprocal_checked is None or now - _reciprocal_checked >= RECIPROCAL_RELOAD_INTERVAL:
+        _reciprocal_checked = now
+        _reciprocal_index = ReciprocalIndex.load(loaded=_reciprocal_index)
+    return _reciprocal_index
+
+# Liked/disliked sets and the reverse "who liked me" index, replayed from the swipe log on first use
+# and caught up from `_swipe_cursor` with swipes stored by other worker processes
+_swipe_index = None
+_swipe_cursor = None
+
+def get_swipe_index() -> SwipeIndex:
+    global _swipe_index, _swipe_cursor
+    if _swipe_index is None:
+        swipes, _swipe_cursor = storage.swipes_since(None)
+        _swipe_index = SwipeIndex.replay(swipes)
+    return _swipe_index
+
+# Per-room occupant aggregates for picking a room on a mutual match, built on first use and
+# rebuilt when the stored rooms are past `_rooms_version` (another worker or the allocator saved them)
+_room_index = None
+_rooms_version = None
+
+def get_room_index() -> RoomIndex:
+    global _room_index, _rooms_version
+    if _room_index is None:
+        _rooms_version = storage.rooms_version()
+        _room_index = RoomIndex(storage.get_rooms())
+    return _room_index
+
+def load_room_index(rooms, version) -> RoomIndex:
+    global _room_index, _rooms_version
+    _room_index, _rooms_version = RoomIndex(rooms), version
+    return _room_index
+
+# Keyword automaton over backend/data/questions.json, built on first use
+_trait_classifier = None
+
+def get_trait_classifier() -> TraitClassifier:
+    global _trait_classifier
+    if _trait_classifier is None:
+        _trait_classifier = TraitClassifier.from_file()
+    return _trait_classifier
+
+# Read-modify-write sections on a user record hold these ("user:<email>").
+# They only order coroutines in this process; storage transactions and storage.lock() cover the others
+record_locks = KeyedLocks()
+
+def index_users(users, version):
+    """Upsert users read by storage.users_since, unless a newer read was indexed first. Runs on the index worker."""
+    global _users_version
+    candidates = get_candidates()
+    if version <= _users_version:
+        return
+    # users_since lists them in signup order, so every worker numbers new candidates alike
+    # and a page cursor from one worker is valid on the next
+    for email, user in users.items():
+        candidates.upsert(email, user)
+    _users_version = version
+
+async def catch_up_users():
+    """Index the users any worker created or changed since this one last looked."""
+    users, version = await run_io(storage.users_since, _users_version)
+    if version != _users_version:
+        await run_index(index_users, users, version)
+
+async def catch_up_swipes():
+    """Record the swipes any worker stored since this one last looked."""
+    global _swipe_cursor
+    swipes, cursor = await run_io(storage.swipes_since, _swipe_cursor)
+    swipe_index = get_swipe_index()
+    for user, target, direction in swipes:
+        if swipe_index.record(user, target, direction):
+            get_deck_cache().discard(user, target)
+    _swipe_cursor = max(_swipe_cursor, cursor)
+
+_last_catch_up = 0.0
+
+async def catch_up():
+    global _last_catch_up
+    _last_catch_up = time.monotonic()
+    await asyncio.gather(catch_up_users(), catch_up_swipes())
+
+def rank_page(user_email, user_data, seen_profiles, limit, after, mode=RANKING_MODE):
+    """Cards for one page of /ranked-matches plus the cursor of the next page. Runs on the index worker."""
+    candidates = get_candidates()
+    scored = candidates.scored
+    traits, dob = user_data.get("traits", {}), user_data.get("dob", "")
+
+    def rank(exclude, k, after):
+        if mode == "bucketed":
+            return get_signature_buckets().top_k(traits, dob, exclude=exclude, k=k, after=after)
+        raw_scores = get_score_cache().scores(user_email, traits, dob)
+        return candidates.top_k(traits, dob, exclude=exclude, k=k, after=after, raw=raw_scores)
+
+    if mode == "reciprocal":
+        # The precomputed lists already are a deck per user; only what they miss is scored live
+        ranked = reciprocal.top_k(candidates, get_reciprocal_index(), user_email, user_data, seen_profiles, limit, after)
+    else:
+        ranked = get_deck_cache().page(user_email, traits, dob, seen_profiles, limit, after, rank)
+    CANDIDATES_SCORED.observe(candidates.scored - scored, mode=mode)
+    next_cursor = encode_cursor(ranked[-1][1], ranked[-1][0]) if len(ranked) == limit else None
+    # Only the returned page is turned into JSON-ready dicts
+    return [candidates.cards[row].to_json(score) for row, score in ranked], next_cursor
 
 
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
-def load_json_file(filepath: str):
-    if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
-        if 'users.json' in filepath or 'swipes.json' in filepath or 'matches.json' in filepath:
-            return {}
-        else:
-            return []
-    with open(filepath, "r") as f:
-        return json.load(f)
+def encode_cursor(score, row) -> str:
+    return f"{score}:{row}"
 
-def save_json_file(filepath: str, data):
-    with open(filepath, "w") as f:
-        json.dump(data, f, indent=2)
+def decode_cursor(cursor: str):
+    score, row = cursor.split(":")
+    return float(score), int(row)
 
 # --- Routes ---
 
@@ -55,34 +262,33 @@ def login_page(request: Request):
 
 @app.post("/signup")
 async def signup(request: Request, name: str = Form(...), email: str = Form(...), password: str = Form(...), dob: str = Form(...)):
-    users = load_json_file(USERS_FILE)
-    if email in users:
+    new_user = {"name": name, "password": hash_password(password), "dob": dob, "life_path": calculate_life_path_number(dob), "vibe": "", "traits": {}, "room_preferences": {}, "assigned_room": None}
+    if not await run_io(storage.create_user, email, new_user):
         return templates.TemplateResponse("login.html", {"request": request, "signup_error": "Email already registered"})
-    users[email] = {"name": name, "password": hash_password(password), "dob": dob, "vibe": "", "traits": {}, "room_preferences": {}, "assigned_room": None}
-    save_json_file(USERS_FILE, users)
+    await catch_up_users()
     request.session["email"] = email
     return RedirectResponse("/traits", status_code=302)
 
 @app.post("/login")
 async def login(request: Request, email: str = Form(...), password: str = Form(...)):
-    users = load_json_file(USERS_FILE)
-    user = users.get(email)
+    user = await run_io(storage.get_user, email)
     if not user or user["password"] != hash_password(password):
         return templates.TemplateResponse("login.html", {"request": request, "login_error": "Invalid email or password"})
     request.session["email"] = email
-    save_json_file(CURRENT_USER_FILE, [email])
     return RedirectResponse("/matching", status_code=302)
 
 @app.get("/logout")
 def logout(request: Request):
     request.session.clear()
-    save_json_file(CURRENT_USER_FILE, [])
     return RedirectResponse("/", status_code=302)
 
 @app.get("/traits")
-def traits_page(request: Request):
-    if not request.session.get("email"): return RedirectResponse("/login", status_code=302)
-    return templates.TemplateResponse("traits.html", {"request": request})
+async def traits_page(request: Request):
+    email = request.session.get("email")
+    if not email: return RedirectResponse("/login", status_code=302)
+    # The user reads the code out to the agent, which sends it back as the "call_code" variable
+    call_ref, call_code = await run_io(trait_queue.open_call, email)
+    return templates.TemplateResponse("traits.html", {"request": request, "call_ref": call_ref, "call_code": call_code})
 
 @app.get("/matching")
 def matching_page(request: Request):
@@ -92,50 +298,39 @@ def matching_page(request: Request):
 # --- API Routes ---
 
 @app.get("/ranked-matches")
-async def get_ranked_matches(request: Request):
+async def get_ranked_matches(request: Request, limit: int = DEFAULT_PAGE_SIZE, cursor: str | None = None, format: str = "json", mode: str = RANKING_MODE):
     user_email = request.session.get("email")
     if not user_email: return JSONResponse({"error": "Not logged in"}, status_code=401)
 
-    users = load_json_file(USERS_FILE)
-    current_user_data = users.get(user_email)
+    # Pick up signups, trait changes and swipes from the other workers while the user loads
+    reads = [run_io(storage.get_user, user_email)]
+    if time.monotonic() - _last_catch_up >= CATCH_UP_INTERVAL:
+        reads.append(catch_up())
+    current_user_data, *_ = await asyncio.gather(*reads)
     if not current_user_data: return JSONResponse({"error": "User not found"}, status_code=404)
 
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return JSONResponse({"error": "Invalid cursor"}, status_code=400)
+    if mode not in RANKING_MODES:
+        return JSONResponse({"error": f"mode must be one of {', '.join(RANKING_MODES)}"}, status_code=400)
+
     # --- UPDATE: The pool of potential matches is now other people (users and personas) ---
-    potential_matches = []
-    personas = load_json_file(PERSONAS_FILE)
-    for i, p in enumerate(personas):
-        if "id" not in p: p["id"] = f"persona_{i}"
-        potential_matches.append(p)
-    
-    for email, user_data in users.items():
-        if email != user_email:
-            user_data_copy = user_data.copy()
-            user_data_copy["id"] = email # Use email as the unique ID for real users
-            potential_matches.append(user_data_copy)
+    seen_profiles = get_swipe_index().seen(user_email) | {user_email}
+    profiles, next_cursor = await run_index(rank_page, user_email, current_user_data, seen_profiles, limit, after, mode)
     # --- END UPDATE ---
 
-    swipes = load_json_file(SWIPES_FILE)
-    user_swipes = swipes.get(user_email, {})
-    seen_profiles = user_swipes.get("liked", []) + user_swipes.get("disliked", [])
-    
-    scored_profiles = []
-    user_life_path = calculate_life_path_number(current_user_data.get("dob", ""))
-
-    for profile in potential_matches:
-        if profile["id"] in seen_profiles:
-            continue
+    if format == "ndjson":
+        # One card per line, then a trailer line carrying the cursor for the next page
+        def stream_cards():
+            for card in profiles:
+                yield json.dumps(card) + "\n"
+            yield json.dumps({"next_cursor": next_cursor}) + "\n"
+        return StreamingResponse(stream_cards(), media_type="application/x-ndjson")
 
-        trait_score = compute_compatibility(current_user_data.get("traits", {}), profile.get("traits", {}))
-        profile_life_path = calculate_life_path_number(profile.get("dob", ""))
-        numerology_score_val = numerology_score(user_life_path, profile_life_path) * 2
-        final_score = (0.8 * trait_score) + (0.2 * numerology_score_val)
-        
-        profile_with_score = profile.copy()
-        profile_with_score["score"] = round(final_score * 10, 2)
-        scored_profiles.append(profile_with_score)
-
-    scored_profiles.sort(key=lambda x: x["score"], reverse=True)
-    return JSONResponse(scored_profiles)
+    return JSONResponse({"profiles": profiles, "next_cursor": next_cursor})
 
 @app.post("/swipe")
 async def handle_swipe(request: Request):
@@ -143,50 +338,33 @@ async def handle_swipe(request: Request):
     if not user_email: return JSONResponse({"error": "Not logged in"}, status_code=401)
 
     data = await request.json()
-    target_id = data.get("target")
-    direction = data.get("direction")
-
-    swipes = load_json_file(SWIPES_FILE)
-    if user_email not in swipes: swipes[user_email] = {"liked": [], "disliked": []}
-
-    if direction == "right" and target_id not in swipes[user_email]["liked"]:
-        swipes[user_email]["liked"].append(target_id)
-    elif direction == "left" and target_id not in swipes[user_email]["disliked"]:
-        swipes[user_email]["disliked"].append(target_id)
-    save_json_file(SWIPES_FILE, swipes)
+    target_id = data.get("target") if isinstance(data, dict) else None
+    direction = data.get("direction") if isinstance(data, dict) else None
+    # Checked before anything is recorded: a bad swipe must not reach the index or storage
+    if not isinstance(target_id, str) or not target_id:
+        return JSONResponse({"error": "expected {\"target\": profile id, \"direction\": \"left\" or \"right\"}"}, status_code=400)
+    if direction not in ("left", "right"):
+        return JSONResponse({"error": "direction must be \"left\" or \"right\""}, status_code=400)
+
+    swipe_index = get_swipe_index()
+    if swipe_index.record(user_email, target_id, direction):
+        await run_io(storage.add_swipe, user_email, target_id, direction)
+        get_deck_cache().discard(user_email, target_id)
     
     # --- UPDATE: Check for a mutual match if the user swiped right ---
     if direction == "right":
-        # Check if the other person has liked the current user
-        target_swipes = swipes.get(target_id, {})
-        if user_email in target_swipes.get("liked", []):
-            # IT'S A MUTUAL MATCH!
-            users = load_json_file(USERS_FILE)
-            rooms = load_json_file(ROOMS_FILE)
-            
-            user1_data = users[user_email]
-            user2_data = users.get(target_id) # This could be a real user
-            
-            # If the target is a persona, we can't allocate a room with them
-            if not user2_data:
-                 return JSONResponse({"status": "swipe recorded", "match": False})
-
-            # Find the best room for the matched pair
-            best_room_id, score = match_user_to_rooms(user1_data, rooms)
-
-            if best_room_id:
-                # Update user records with the assigned room
-                users[user_email]["assigned_room"] = best_room_id
-                users[target_id]["assigned_room"] = best_room_id
-                save_json_file(USERS_FILE, users)
-                
-                # Store the match
-                matches = load_json_file(MATCHES_FILE)
-                match_key = tuple(sorted((user_email, target_id)))
-                matches[str(match_key)] = {"room": best_room_id, "score": score}
-                save_json_file(MATCHES_FILE, matches)
-
-                return JSONResponse({"status": "swipe recorded", "match": True, "room": best_room_id})
+        # The other like may have gone to another worker. Both swipes are stored before
+        # either side catches up, so at least one of the two requests sees the match
+        await catch_up_swipes()
+        if swipe_index.is_mutual(user_email, target_id):
+            # IT'S A MUTUAL MATCH! Record it now; the room is picked by the background assigner
+            key = match_key(user_email, target_id)
+            if not await run_io(storage.create_match, key, {"room": None, "score": None, "status": PENDING}):
+                # Already recorded by a repeated right swipe or by the other side: don't queue the pair twice
+                existing_match = await run_io(storage.get_match, key)
+                return JSONResponse({"status": "swipe recorded", "match": True, "room": existing_match.get("room"), "assignment": existing_match.get("status", ASSIGNED)})
+            match_events.put_nowait((key, user_email, target_id))
+            return JSONResponse({"status": "swipe recorded", "match": True, "room": None, "assignment": PENDING})
 
     return JSONResponse({"status": "swipe recorded", "match": False})
     # --- END UPDATE ---
@@ -195,12 +373,219 @@ async def handle_swipe(request: Request):
 async def receive_traits(request: Request):
     data = await request.json()
     extracted = data.get("extracted_variables", [])
-    current_users = load_json_file(CURRENT_USER_FILE)
-    if not current_users: return JSONResponse({"status": "no user currently logged in"}, status_code=400)
-    email = current_users[0]
-    users = load_json_file(USERS_FILE)
-    if email not in users: return JSONResponse({"status": "user not found"}, status_code=404)
-    for trait in extracted:
-        users[email]["traits"][trait["key"]] = trait["value"]
-    save_json_file(USERS_FILE, users)
-    return JSONResponse({"status": "traits saved successfully"})
\ No newline at end of file
+    traits = {trait["key"]: trait["value"] for trait in extracted}
+    # The code the user read out identifies the call; it is not a trait
+    call_code = normalize_call_code(traits.pop(CALL_CODE_VARIABLE, None) or data.get("call_code"))
+    # Whose call was it: the user named in the payload, else the call the /traits page opened
+    # (its call_ref, or the code read out to the agent), else the only user with a call open right now
+    email = data.get("user_email") or data.get("email")
+    if not email:
+        # A redelivery after its call was closed can still be recognised by the agent's call id
+        if call_id(data) and await run_io(trait_queue.known, call_id(data)):
+            return JSONResponse({"status": "duplicate delivery ignored"})
+        if data.get("call_ref"):
+            email = await run_io(trait_queue.resolve_call, data["call_ref"])
+        if not email and call_code:
+            email = await run_io(trait_queue.resolve_code, call_code)
+        if not email:
+            email = await run_io(trait_queue.sole_open_call)
+        if not email: return JSONResponse({"status": "cannot tell whose call this was"}, status_code=400)
+
+    if not traits and isinstance(data.get("transcript"), str):
+        # The agent sent the call but extracted nothing: classify the answers locally
+        traits = get_trait_classifier().classify(data["transcript"])
+    if not await run_io(trait_queue.enqueue, delivery_id(data, email), email, traits):
+        return JSONResponse({"status": "duplicate delivery ignored"})
+    await run_io(trait_queue.close_calls, email)
+    traits_queued.set()
+    return JSONResponse({"status": "traits queued"}, status_code=202)
+
+@app.post("/classify-traits")
+async def classify_traits(request: Request):
+    """Trait values for a batch of transcripts, from the local keyword classifier.
+
+    Each transcript is a whole-call string or {trait or question id: answer}.
+    Nothing is stored; use it to backfill or re-classify without the voice agent.
+    """
+    data = await request.json()
+    transcripts = data.get("transcripts") if isinstance(data, dict) else None
+    if not isinstance(transcripts, list):
+        return JSONResponse({"error": "expected {\"transcripts\": [...]}"}, status_code=400)
+    if len(transcripts) > MAX_CLASSIFY_BATCH:
+        return JSONResponse({"error": f"at most {MAX_CLASSIFY_BATCH} transcripts per request"}, status_code=413)
+    try:
+        # A big batch is a few milliseconds of CPU; keep it off the event loop
+        traits = await run_io(get_trait_classifier().classify_batch, transcripts)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return JSONResponse({"traits": traits})
+
+# --- Trait ingestion worker ---
+
+# Webhooks are acked as soon as they are in the durable queue; this worker applies them in batches
+trait_queue = TraitQueue()
+traits_queued = asyncio.Event()
+
+def apply_trait_batch(deliveries):
+    """Write one batch of queued deliveries, coalesced per user. Returns {seq: outcome}."""
+    merged = coalesce(deliveries)
+    with storage.transaction():
+        users = storage.get_users(merged)
+        for email, user in users.items():
+            user["traits"].update(merged[email])
+        storage.put_users(users)
+    return {seq: "applied" if email in users else "user not found" for seq, email, _ in deliveries}
+
+async def apply_queued_traits():
+    traits_queued.set()  # drain anything left in the queue from before a restart
+    while True:
+        try:
+            await asyncio.wait_for(traits_queued.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            pass
+        traits_queued.clear()
+        await asyncio.sleep(TRAIT_BATCH_DELAY)
+        try:
+            # One worker process drains the queue at a time, so no batch is applied twice or out of order
+            async with trait_queue.lock.hold():
+                while deliveries := await run_io(trait_queue.pending, TRAIT_BATCH_SIZE):
+                    async with record_locks.hold(*{f"user:{email}" for _, email, _ in deliveries}):
+                        outcomes = await run_io(apply_trait_batch, deliveries)
+                    await run_io(trait_queue.mark_applied, outcomes)
+            await catch_up_users()
+        except Exception:
+            # Leave the batch queued and retry on the next wake-up
+            logger.exception("Trait queue batch failed")
+
+# --- Room assignment for mutual matches ---
+
+# /swipe publishes (match_key, email, email) here; one assigner per worker consumes it, holding
+# the rooms lock so beds are reserved without racing an assignment in another worker
+match_events = asyncio.Queue()
+assignment_feed = AssignmentFeed()
+
+def reserve_rooms(room_index, batch, users):
+    """Pick a room for each pair in arrival order and reserve both beds in the index.
+
+    Returns [(match_key, email, email, room_id or None, score)]. Runs on the index worker.
+    """
+    results = []
+    for key, email1, email2 in batch:
+        if email1 not in users or email2 not in users:
+            results.append((key, email1, email2, None, None))
+            continue
+        room_id, score = room_index.best_room(users[email1], min_free=2)
+        if room_id:
+            for email in (email1, email2):
+                room_index.add_occupant(room_id, occupant_record(email, users[email]))
+        results.append((key, email1, email2, room_id, score))
+    return results
+
+def release_rooms(room_index, results, users):
+    for _, email1, email2, room_id, _ in results:
+        if room_id:
+            for email in (email1, email2):
+                room_index.remove_occupant(room_id, occupant_record(email, users[email]))
+
+def save_assignments(room_index, results):
+    """Write one batch of assignments in a single transaction. Runs on the I/O pool."""
+    with storage.transaction():
+        # Re-read the users inside the transaction so a trait update from another worker isn't overwritten
+        assignments = {email: room_id for _, email1, email2, room_id, _ in results if room_id for email in (email1, email2)}
+        users = storage.get_users(assignments)
+        for email, user in users.items():
+            user["assigned_room"] = assignments[email]
+        storage.put_users(users)
+        for key, email1, email2, room_id, score in results:
+            storage.put_match(key, {"room": room_id, "score": score, "status": ASSIGNED if room_id else NO_ROOM})
+        # Move them into their rooms so the next allocation sees the occupancy
+        for room_id in set(assignments.values()):
+            storage.put_room(room_index.room(room_id))
+    return storage.rooms_version()
+
+async def current_room_index() -> RoomIndex:
+    """The room index, rebuilt first if the stored rooms changed since it was built. Call with the rooms lock held."""
+    room_index = await run_index(get_room_index)
+    version = await run_io(storage.rooms_version)
+    if version != _rooms_version:
+        room_index = await run_index(load_room_index, await run_io(storage.get_rooms), version)
+    return room_index
+
+async def assign_matched_pairs():
+    global _rooms_version
+    while True:
+        batch = await next_batch(match_events, MATCH_BATCH_SIZE, MATCH_BATCH_DELAY)
+        results = []
+        try:
+            async with storage.lock("rooms").hold():
+                # Every worker replays the pending matches at startup; skip pairs another worker already placed
+                matches = await run_io(storage.get_matches, [key for key, _, _ in batch])
+                batch = [event for event in batch if matches.get(event[0], {}).get("status") == PENDING]
+                emails = {email for _, email1, email2 in batch for email in (email1, email2)}
+                async with record_locks.hold(*(f"user:{email}" for email in emails)):
+                    users = await run_io(storage.get_users, emails)
+                    room_index = await current_room_index()
+                    results = await run_index(reserve_rooms, room_index, batch, users)
+                    try:
+                        _rooms_version = await run_io(save_assignments, room_index, results)
+                    except Exception:
+                        await run_index(release_rooms, room_index, results, users)
+                        raise
+            await catch_up_users()
+        except Exception:
+            # The matches stay "pending" in storage and are queued again on the next startup
+            logger.exception("Room assignment batch failed")
+            continue
+
+        for key, email1, email2, room_id, score in results:
+            event = {"match_key": key, "room": room_id, "score": score, "status": ASSIGNED if room_id else NO_ROOM}
+            assignment_feed.publish(email1, {**event, "with": email2})
+            assignment_feed.publish(email2, {**event, "with": email1})
+
+@app.get("/match-status/{target_id}")
+async def match_status(request: Request, target_id: str):
+    """Polling alternative to /match-events: the stored match with `target_id`, if any."""
+    user_email = request.session.get("email")
+    if not user_email: return JSONResponse({"error": "Not logged in"}, status_code=401)
+    match = await run_io(storage.get_match, match_key(user_email, target_id))
+    if not match: return JSONResponse({"match": False})
+    return JSONResponse({"match": True, "room": match.get("room"), "score": match.get("score"), "assignment": match.get("status", ASSIGNED)})
+
+@app.get("/match-events")
+async def match_event_stream(request: Request):
+    """Server-sent events: one "match" event per room assignment involving the logged-in user."""
+    user_email = request.session.get("email")
+    if not user_email: return JSONResponse({"error": "Not logged in"}, status_code=401)
+    listener = assignment_feed.subscribe(user_email)
+
+    async def stream_events():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    yield sse(await asyncio.wait_for(listener.get(), timeout=EVENT_KEEPALIVE))
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            assignment_feed.unsubscribe(user_email, listener)
+    return StreamingResponse(stream_events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+# --- Metrics ---
+
+def cache_stats():
+    stats = {"score": get_score_cache().stats(), "deck": get_deck_cache().stats()}
+    if _reciprocal_index is not None:
+        stats["reciprocal"] = _reciprocal_index.stats()
+    return stats
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text format: request latency, JSON file I/O, ranking work, cache hit rates and queue depths."""
+    for cache, stats in (await run_index(cache_stats)).items():
+        CACHE_HITS.set(stats["hits"], cache=cache)
+        CACHE_MISSES.set(stats["misses"], cache=cache)
+        CACHE_HIT_RATIO.set(stats["hit_rate"], cache=cache)
+        CACHE_ENTRIES.set(stats["entries"], cache=cache)
+    TRAIT_QUEUE_DEPTH.set(await run_io(trait_queue.depth))
+    MATCH_QUEUE_DEPTH.set(match_events.qsize())
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
@@ -0,0 +1,58 @@
+# match_events.py
+
+import asyncio
+import ast
+import json
+
+# Status of a stored match: waiting for the assigner, moved into a room, or no room had two free beds
+PENDING = "pending"
+ASSIGNED = "assigned"
+NO_ROOM = "no room"
+
+
+def match_key(a, b) -> str:
+    return str(tuple(sorted((a, b))))
+
+def match_emails(key):
+    return ast.literal_eval(key)
+
+def pending_events(matches):
+    """(match_key, email, email) for stored matches the assigner never got to, e.g. before a restart."""
+    for key, match in matches.items():
+        if match.get("status") == PENDING:
+            yield (key, *match_emails(key))
+
+
+async def next_batch(queue, max_size, delay):
+    """Wait for one event, then give nearby events `delay` seconds to arrive; at most `max_size`."""
+    batch = [await queue.get()]
+    await asyncio.sleep(delay)
+    while len(batch) < max_size and not queue.empty():
+        batch.append(queue.get_nowait())
+    return batch
+
+
+class AssignmentFeed:
+    """Fan-out of room assignment results to each user's open /match-events streams."""
+
+    def __init__(self):
+        self._listeners = {}
+
+    def subscribe(self, email):
+        listener = asyncio.Queue()
+        self._listeners.setdefault(email, set()).add(listener)
+        return listener
+
+    def unsubscribe(self, email, listener):
+        listeners = self._listeners.get(email, set())
+        listeners.discard(listener)
+        if not listeners:
+            self._listeners.pop(email, None)
+
+    def publish(self, email, event):
+        for listener in self._listeners.get(email, ()):
+            listener.put_nowait(event)
+
+
+def sse(event, name="match") -> str:
+    return f"event: {name}\ndata: {json.dumps(event)}\n\n"
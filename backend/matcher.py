@@ -1,7 +1,11 @@
 # matcher.py
 
+import functools
+import logging
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 TRAITS = [
     "daily_rhythm",
     "lifestyle",
@@ -41,8 +45,9 @@ numerology_chart = {
     9: {"same": [3, 6, 9], "neutral": [1, 2, 5, 7], "challenges": [4, 8]}
 }
 
+@functools.lru_cache(maxsize=65536)
 def calculate_life_path_number(dob: str) -> int:
-    """Calculate numerology life path number from DOB (yyyy-mm-dd)."""
+    """Calculate numerology life path number from DOB (yyyy-mm-dd). Memoized: there are only so many birthdays."""
     if not dob: return 0
     digits = [int(char) for char in dob if char.isdigit()]
     total = sum(digits)
@@ -52,8 +57,13 @@ def calculate_life_path_number(dob: str) -> int:
     
     return total
 
-def numerology_score(user_number: int, other_number: int) -> float:
-    """Returns compatibility score between two life path numbers (out of 5)."""
+def life_path(profile) -> int:
+    """The life path number stored on the record at signup, or computed from its dob."""
+    number = profile.get("life_path")
+    return number if number is not None else calculate_life_path_number(profile.get("dob", ""))
+
+def chart_numerology_score(user_number: int, other_number: int) -> float:
+    """Compatibility score between two life path numbers (out of 5), read off numerology_chart."""
     if user_number == 0 or other_number == 0: return 1.0 # Return a neutral score if DOB is missing
     
     same = numerology_chart.get(user_number, {}).get("same", [])
@@ -69,6 +79,49 @@ def numerology_score(user_number: int, other_number: int) -> float:
     else:
         return 1.0  # Unknown, fallback
 
+# NUMEROLOGY_SCORES[a][b] == chart_numerology_score(a, b) for every life path number 0-9
+NUMEROLOGY_SCORES = [[chart_numerology_score(a, b) for b in range(10)] for a in range(10)]
+
+def numerology_score(user_number: int, other_number: int) -> float:
+    """Returns compatibility score between two life path numbers (out of 5)."""
+    try:
+        if user_number >= 0 and other_number >= 0:
+            return NUMEROLOGY_SCORES[user_number][other_number]
+    except (IndexError, TypeError):
+        pass
+    return chart_numerology_score(user_number, other_number)
+
+# Interned integer code per (trait, value), so comparing two trait sets is a set intersection
+_trait_codes = {}
+
+def trait_code(trait, value) -> int:
+    try:
+        key = (trait, value)
+        hash(key)
+    except TypeError:
+        key = (trait, "unhashable", repr(value))
+    code = _trait_codes.get(key)
+    if code is None:
+        code = _trait_codes[key] = len(_trait_codes) + 1
+    return code
+
+@functools.lru_cache(maxsize=65536)
+def _encode_trait_items(items):
+    return frozenset(trait_code(trait, value) for trait, value in items)
+
+def encode_traits(traits) -> frozenset:
+    """Trait codes of a traits dict. Two dicts share a code exactly where compute_compatibility counts a match."""
+    try:
+        return _encode_trait_items(tuple(traits.items()))
+    except TypeError:
+        return frozenset(trait_code(trait, value) for trait, value in traits.items())
+
+def compatibility_from_codes(user_codes, other_codes) -> float:
+    """compute_compatibility on encoded traits: matching codes over the user's trait count, out of 10."""
+    if not user_codes or not other_codes:
+        return 0
+    return (len(user_codes & other_codes) / len(user_codes)) * 10
+
 def compute_compatibility(traits1, traits2):
     """Simple matching: +2 for full match, +1 for partial (same group), 0 otherwise."""
     if not traits1 or not traits2:
@@ -102,6 +155,8 @@ def compute_logistics_score(user_prefs, room):
 def match_user_to_rooms(new_user, rooms):
     best_room = None
     best_score = -1
+    user_codes = encode_traits(new_user["traits"])
+    user_life_path = life_path(new_user)
 
     for room in rooms:
         if len(room.get("occupants", [])) >= room["capacity"]:
@@ -112,7 +167,7 @@ def match_user_to_rooms(new_user, rooms):
         # Roommate compatibility
         if room.get("occupants"):
             for occupant in room["occupants"]:
-                compatibility_total += compute_compatibility(new_user["traits"], occupant["traits"])
+                compatibility_total += compatibility_from_codes(user_codes, encode_traits(occupant["traits"]))
             compatibility_score = compatibility_total / len(room["occupants"])
         else:
             # No roommate yet, assume neutral compatibility
@@ -122,13 +177,12 @@ def match_user_to_rooms(new_user, rooms):
         logistics_score = compute_logistics_score(new_user["room_preferences"], room)
 
         # Numerology for new user
-        user_life_path = calculate_life_path_number(new_user["dob"])
         numerology_scores = []
 
         # For each occupant, compare numerology
         for occupant in room["occupants"]:
             if "dob" in occupant:
-                occupant_path = calculate_life_path_number(occupant["dob"])
+                occupant_path = life_path(occupant)
                 score = numerology_score(user_life_path, occupant_path)
                 numerology_scores.append(score)
 
@@ -138,8 +192,9 @@ def match_user_to_rooms(new_user, rooms):
             if numerology_scores else 0
         )
 
-        # Debug print for individual scores
-        print(f"DEBUG | Room {room['room_id']} -> Compatibility Score: {compatibility_score}, Logistics Score: {logistics_score}, Numerology Score: {numerology_score_value}")
+        # Debug log for individual scores
+        logger.debug("Room %s -> Compatibility Score: %s, Logistics Score: %s, Numerology Score: %s",
+                     room["room_id"], compatibility_score, logistics_score, numerology_score_value)
 
         # Weighted hybrid score
         final_score = (0.7 * compatibility_score + 0.2 * logistics_score + 0.1 * numerology_score_value)
@@ -153,7 +208,8 @@ def match_user_to_rooms(new_user, rooms):
 def rank_rooms_for_user(new_user, rooms):
     scored_rooms = []
 
-    user_life_path = calculate_life_path_number(new_user.get("dob", ""))
+    user_life_path = life_path(new_user)
+    user_codes = encode_traits(new_user.get("traits", {}))
 
     for room in rooms:
         if len(room.get("occupants", [])) >= room.get("capacity", 1):
@@ -163,7 +219,7 @@ def rank_rooms_for_user(new_user, rooms):
         compatibility_total = 0
         if room.get("occupants"):
             for occupant in room["occupants"]:
-                compatibility_total += compute_compatibility(new_user.get("traits", {}), occupant.get("traits", {}))
+                compatibility_total += compatibility_from_codes(user_codes, encode_traits(occupant.get("traits", {})))
             compatibility_score = compatibility_total / len(room["occupants"])
         else:
             compatibility_score = 5
@@ -177,7 +233,7 @@ def rank_rooms_for_user(new_user, rooms):
         numerology_scores = []
         for occupant in room.get("occupants", []):
             if "dob" in occupant:
-                occupant_path = calculate_life_path_number(occupant.get("dob", ""))
+                occupant_path = life_path(occupant)
                 score = numerology_score(user_life_path, occupant_path)
                 numerology_scores.append(score)
         numerology_score_value = (
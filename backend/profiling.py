@@ -0,0 +1,123 @@
+# profiling.py
+
+import os
+import sys
+import threading
+from collections import Counter
+from urllib.parse import parse_qs
+
+PROFILE_INTERVAL = 0.001  # seconds between stack samples
+MAX_DEPTH = 64
+
+# Leaf frames of threads that are just waiting: an idle pool worker, the event loop's select()
+# (uvloop selects in C, so its idle loop stops at asyncio.run)
+IDLE_FRAMES = {("thread.py", "_worker"), ("selectors.py", "select"), ("threading.py", "wait"), ("runners.py", "run")}
+
+# The switch interval is process-wide and profiled requests overlap, so it is shared: the
+# first profiler to start saves it, each one keeps it at most half its own sampling interval,
+# and the last one to stop puts it back
+_switch_lock = threading.Lock()
+_active_intervals = Counter()
+_saved_switch_interval = None
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _set_switch_interval():
+    # Called with _switch_lock held
+    if _active_intervals:
+        sys.setswitchinterval(min(_saved_switch_interval, min(_active_intervals) / 2))
+    else:
+        sys.setswitchinterval(_saved_switch_interval)
+
+
+class SamplingProfiler:
+    """Samples the stacks of every busy thread on a timer while it runs.
+
+    A request touches the event loop, the I/O pool and the index worker, so
+    all threads are sampled and each stack starts with its thread name.
+    Output is in the folded format flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def __enter__(self):
+        # A busy thread only hands the GIL over every switch interval (5 ms by default),
+        # which would cap the sampling rate; shorten it while profiling
+        global _saved_switch_interval
+        with _switch_lock:
+            if not _active_intervals:
+                _saved_switch_interval = sys.getswitchinterval()
+            _active_intervals[self.interval] += 1
+            _set_switch_interval()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        with _switch_lock:
+            _active_intervals[self.interval] -= 1
+            if not _active_intervals[self.interval]:
+                del _active_intervals[self.interval]
+            _set_switch_interval()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    stack.append(frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)).replace(" ", "_"))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileRequests:
+    """ASGI middleware: a request with `?profile=1` is answered with its folded stacks instead of its response.
+
+    Only installed when PROFILING=1, since it lets any client pay for a profile.
+    """
+
+    def __init__(self, app, interval=PROFILE_INTERVAL):
+        self.app = app
+        self.interval = interval
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or parse_qs(scope["query_string"].decode()).get("profile") != ["1"]:
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def discard(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+        with SamplingProfiler(self.interval) as profiler:
+            await self.app(scope, receive, discard)
+        headers = [
+            (b"content-type", b"text/plain; charset=utf-8"),
+            (b"x-profile-samples", str(profiler.samples).encode()),
+            (b"x-profiled-status", str(status).encode()),
+        ]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": profiler.folded().encode()})
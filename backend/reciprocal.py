@@ -0,0 +1,365 @@
+# reciprocal.py
+
+import argparse
+import functools
+import heapq
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import time
+
+import numpy as np
+
+from backend.matcher import life_path
+from backend.scoring import MISSING, NUMEROLOGY_TABLE, CandidateMatrix, one_way_scores, reciprocal_score, round_scores, vocab_key
+from backend.storage import DATA_DIR, get_storage, load_json_file, save_json_file
+
+RECIPROCAL_DIR = os.getenv("RECIPROCAL_DIR", os.path.join(DATA_DIR, "reciprocal"))
+RECIPROCAL_MAX_AGE = float(os.getenv("RECIPROCAL_MAX_AGE", str(24 * 3600)))  # seconds a build is served after it ran
+TOP_K = 200  # candidates kept per user; pages past them are scored live
+BLOCK_CELLS = 4_000_000  # signature pairs x trait columns compared at once, ~4 MB of booleans per block
+CURRENT = "current.json"  # names the build to serve; replaced atomically once a build is complete
+BUILD_FORMAT = 2  # bumped when the files change shape; builds in another format are not served
+_build_numbers = itertools.count()  # tells apart builds one process writes within the same second
+
+
+MIX = 0x9E3779B97F4A7C15  # odd multiplier spreading each (trait, value) hash before they are summed
+MASK = (1 << 64) - 1
+
+
+def _digest(text) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+
+
+def fingerprint(traits, life_path_number) -> int:
+    """Hash of what a profile's scores depend on; row_fingerprints gives the same value for its matrix row."""
+    total = _digest(f"life_path:{int(life_path_number)}")
+    for trait, value in traits.items():
+        total += _term(trait, vocab_key(value))
+    return total & MASK
+
+
+@functools.lru_cache(maxsize=4096)
+def _term(trait, key) -> int:
+    # Few distinct (trait, value) pairs, and fingerprint runs on every precomputed page
+    return ((_digest(trait) ^ _digest(repr(key))) * MIX) & MASK
+
+
+def row_fingerprints(matrix, rows):
+    """fingerprint of each of `rows`, from its codes.
+
+    Summed per trait, so it does not depend on the order a process assigned
+    trait columns and codes in: the batch job and a worker that built its
+    matrix differently agree on every unchanged candidate.
+    """
+    value_hashes = np.zeros(len(matrix.trait_vocab) + 1, dtype=np.uint64)
+    for key, code in matrix.trait_vocab.items():
+        value_hashes[code] = _digest(repr(key))
+    life_path_hashes = np.array([_digest(f"life_path:{number}") for number in range(len(NUMEROLOGY_TABLE))], dtype=np.uint64)
+    codes = matrix._codes[rows]
+    # uint64 arrays wrap on overflow, like the masked sums in fingerprint
+    hashes = life_path_hashes[matrix._life_paths[rows]]
+    for trait, col in matrix.trait_columns.items():
+        mixed = (value_hashes[codes[:, col]] ^ np.uint64(_digest(trait))) * np.uint64(MIX)
+        hashes += np.where(codes[:, col] != MISSING, mixed, np.uint64(0))
+    return hashes
+
+
+def rank_key(entry):
+    row, score = entry
+    return -score, row
+
+
+def signatures(matrix):
+    """Distinct (trait codes, life path) combinations: their codes, life paths and sorted member rows, plus each row's signature."""
+    n = len(matrix)
+    keys = np.column_stack([matrix._codes[:n], matrix._life_paths[:n].astype(np.int32)])
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    order = np.argsort(inverse, kind="stable")
+    members = np.split(order, np.cumsum(np.bincount(inverse, minlength=len(unique)))[:-1])
+    return unique[:, :-1], unique[:, -1].astype(np.int8), [m.tolist() for m in members], inverse
+
+
+def block_scores(codes, life_paths, other_codes, other_life_paths):
+    """Unrounded reciprocal scores between every pair of two sets of signatures, as CandidateMatrix.reciprocal_scores computes them."""
+    shared = (codes[:, None, :] == other_codes[None, :, :]) & (codes[:, None, :] != MISSING)
+    matching = shared.sum(axis=2, dtype=np.int16)
+    counts = np.count_nonzero(codes != MISSING, axis=1)
+    other_counts = np.count_nonzero(other_codes != MISSING, axis=1)
+    forward = one_way_scores(matching, counts[:, None], life_paths[:, None], other_life_paths[None, :])
+    reverse = one_way_scores(matching, other_counts[None, :], other_life_paths[None, :], life_paths[:, None])
+    return reciprocal_score(forward, reverse)
+
+
+# Set once per pool process, so the signature arrays are not pickled with every block
+_shared = {}
+
+
+def _init_worker(codes, life_paths, members, k):
+    _shared.update(codes=codes, life_paths=life_paths, members=members, k=k)
+
+
+def rank_block(block):
+    """For each signature in `block`, its best `k` rows by reciprocal score as (rows, scores in hundredths)."""
+    codes, life_paths, members, k = _shared["codes"], _shared["life_paths"], _shared["members"], _shared["k"]
+    raw = block_scores(codes[block], life_paths[block], codes, life_paths)
+    rounded = round_scores(raw.ravel()).reshape(raw.shape)
+    ranked = []
+    for scores in rounded:
+        rows, hundredths = [], []
+        for score in np.unique(scores)[::-1]:
+            # Signatures with equal scores interleave by row, as in SignatureBuckets.top_k
+            for row in heapq.merge(*(members[i] for i in np.flatnonzero(scores == score))):
+                rows.append(row)
+                hundredths.append(round(score * 100))
+                if len(rows) == k:
+                    break
+            if len(rows) == k:
+                break
+        ranked.append((np.array(rows, dtype=np.int32), np.array(hundredths, dtype=np.int16)))
+    return ranked
+
+
+def build(matrix, users, k=TOP_K, processes=None, directory=RECIPROCAL_DIR, users_version=None):
+    """Write every user's top `k` candidates by reciprocal score as a new build and make it current.
+
+    Everyone with the same signature scores everyone else the same way, so
+    the pairs are scored between signatures (a few hundred) instead of
+    between candidates, in blocks spread over `processes` worker processes.
+    The result is exact: each user's list is what CandidateMatrix.top_k
+    would return over reciprocal_scores.
+    """
+    start = time.perf_counter()
+    codes, life_paths, members, inverse = signatures(matrix)
+    user_ids = list(users)
+    user_rows = np.array([matrix.rows[user_id] for user_id in user_ids], dtype=np.int64)
+    wanted = np.unique(inverse[user_rows])
+    size = max(1, BLOCK_CELLS // max(1, len(codes) * max(1, codes.shape[1])))
+    blocks = [wanted[i:i + size] for i in range(0, len(wanted), size)]
+
+    # One extra, since a user's own row is dropped from their list
+    initargs = (codes, life_paths, members, k + 1)
+    processes = processes or os.cpu_count() or 1
+    if processes > 1 and len(blocks) > 1:
+        with multiprocessing.Pool(min(processes, len(blocks)), initializer=_init_worker, initargs=initargs) as pool:
+            results = pool.map(rank_block, blocks)
+    else:
+        _init_worker(*initargs)
+        results = [rank_block(block) for block in blocks]
+    ranked = {}
+    for block, lists in zip(blocks, results):
+        ranked.update(zip(block.tolist(), lists))
+
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{next(_build_numbers)}"
+    path = os.path.join(directory, name)
+    os.makedirs(path)
+    rows_out = np.lib.format.open_memmap(os.path.join(path, "rows.npy"), mode="w+", dtype=np.int32, shape=(len(user_ids), k))
+    scores_out = np.lib.format.open_memmap(os.path.join(path, "scores.npy"), mode="w+", dtype=np.int16, shape=(len(user_ids), k))
+    rows_out[:] = -1  # unused slots: the user's list holds every candidate
+    for i, row in enumerate(user_rows.tolist()):
+        rows, hundredths = ranked[inverse[row]]
+        keep = rows != row
+        rows, hundredths = rows[keep][:k], hundredths[keep][:k]
+        rows_out[i, :len(rows)] = rows
+        scores_out[i, :len(rows)] = hundredths
+    rows_out.flush()
+    scores_out.flush()
+    del rows_out, scores_out
+    # What every candidate looked like, so serving can tell whose traits or dob changed since
+    np.save(os.path.join(path, "fingerprints.npy"), row_fingerprints(matrix, np.arange(len(matrix))))
+    meta = {
+        "format": BUILD_FORMAT,
+        "k": k,
+        "built_at": time.time(),
+        "users_version": users_version,
+        "signatures": len(codes),
+        "seconds": round(time.perf_counter() - start, 3),
+        "candidates": matrix.ids,
+        "users": user_ids,
+    }
+    save_json_file(os.path.join(path, "meta.json"), meta)
+
+    # Keep the build being replaced, which workers may still have mapped; drop anything older
+    current = os.path.join(directory, CURRENT)
+    previous = load_json_file(current).get("build") if os.path.exists(current) else None
+    save_json_file(current, {"build": name})
+    for entry in os.listdir(directory):
+        if entry not in (name, previous) and os.path.isdir(os.path.join(directory, entry)):
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+    return {key: value for key, value in meta.items() if key not in ("candidates", "users")} | {"build": name, "users": len(user_ids)}
+
+
+class ReciprocalIndex:
+    """One build of the batch job, memory-mapped: each user's top `k` candidates by reciprocal score.
+
+    `rows[i]` and `scores[i]` (hundredths) list user i's candidates best
+    first, padded with -1 when a user's list holds every candidate. Rows are
+    the matrix rows at build time; since rows are only appended, they stay
+    valid for any matrix whose first candidates are the build's.
+    `fingerprints[row]` is each candidate's row_fingerprints at build time;
+    rows whose fingerprint no longer matches are `stale` and scored live.
+    """
+
+    def __init__(self, path, meta):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.k = meta["k"]
+        self.built_at = meta["built_at"]
+        self.candidates = meta["candidates"]
+        self.users = {user_id: i for i, user_id in enumerate(meta["users"])}
+        self.rows = np.load(os.path.join(path, "rows.npy"), mmap_mode="r")
+        self.scores = np.load(os.path.join(path, "scores.npy"), mmap_mode="r")
+        self.fingerprints = np.load(os.path.join(path, "fingerprints.npy"), mmap_mode="r")
+        self.stale = set()
+        self._matrix = None
+        self._position = None
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def load(cls, directory=RECIPROCAL_DIR, loaded=None):
+        """The current build, or None if the job has not run since the format changed; `loaded` is returned as is if it still is the current one."""
+        current = os.path.join(directory, CURRENT)
+        if not os.path.exists(current):
+            return None
+        name = load_json_file(current)["build"]
+        if loaded is not None and loaded.name == name:
+            return loaded
+        path = os.path.join(directory, name)
+        meta = load_json_file(os.path.join(path, "meta.json"))
+        if meta.get("format") != BUILD_FORMAT:
+            return None
+        return cls(path, meta)
+
+    def fresh(self, matrix, now=None, max_age=RECIPROCAL_MAX_AGE) -> bool:
+        """Built less than `max_age` seconds ago, from the same candidates `matrix` starts with. Brings `stale` up to date."""
+        if (time.time() if now is None else now) - self.built_at > max_age:
+            return False
+        if self._matrix is not matrix:
+            if matrix.ids[:len(self.candidates)] != self.candidates:
+                return False
+            self._matrix = matrix  # rows are only appended, so this stays true
+            self._position = None
+        self._sync_stale()
+        return True
+
+    def _sync_stale(self):
+        """Re-check the rows the matrix re-encoded since the last call (every row on the first)."""
+        matrix, built = self._matrix, len(self.candidates)
+        changed = matrix.changes_since(self._position) if self._position is not None else None
+        if changed is None:
+            rows = np.arange(built)
+            self.stale = set()
+        else:
+            rows = np.array(sorted({row for row in changed if row < built}), dtype=np.int64)
+        self._position = matrix.change_position()
+        if len(rows):
+            differs = row_fingerprints(matrix, rows) != self.fingerprints[rows]
+            self.stale.difference_update(rows[~differs].tolist())
+            self.stale.update(rows[differs].tolist())
+
+    def lookup(self, user_id, traits, life_path_number):
+        """(rows, hundredths) for the user, or None if they signed up or changed traits since the build."""
+        i = self.users.get(user_id)
+        row = self._matrix.rows.get(user_id) if self._matrix is not None else None
+        if i is None or row is None or row in self.stale or int(self.fingerprints[row]) != fingerprint(traits, life_path_number):
+            return None
+        return self.rows[i], self.scores[i]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.users),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "stale_candidates": len(self.stale),
+            "age_seconds": time.time() - self.built_at,
+        }
+
+
+def _stored(rows, scores, start, stale, chunk=64):
+    """(row, score) from a stored list, skipping stale rows; converted a chunk at a time, as a page rarely reads far."""
+    for i in range(start, len(rows), chunk):
+        for row, score in zip(rows[i:i + chunk].tolist(), scores[i:i + chunk].tolist()):
+            if row not in stale:
+                yield row, score
+
+
+def top_k(matrix, index, user_id, user_data, exclude=(), k=None, after=None):
+    """Same contract and ordering as CandidateMatrix.top_k, over reciprocal scores.
+
+    Served from `index` when it is fresh and has the user. Candidates that
+    signed up or changed traits or dob since the build are scored live and
+    merged in, and once a page runs past the precomputed top k, the rest is
+    ranked live. Users the build does not cover, or who changed themselves,
+    are ranked live throughout.
+    """
+    traits, dob = user_data.get("traits", {}) or {}, user_data.get("dob", "")
+    entry = None
+    if index is not None and index.fresh(matrix):
+        entry = index.lookup(user_id, traits, life_path(user_data))
+        if entry is None:
+            index.misses += 1
+        else:
+            index.hits += 1
+    if entry is None:
+        return matrix.top_k(traits, dob, exclude=exclude, k=k, after=after, raw=matrix.reciprocal_scores(traits, dob))
+    if k is not None and k <= 0:
+        return []
+
+    rows, hundredths = entry
+    excluded = {matrix.rows[c] for c in exclude if c in matrix.rows}
+    n = int(np.count_nonzero(rows >= 0))  # padding is at the end
+    rows, scores = rows[:n], hundredths[:n] / 100
+    # A full list stops at its last entry; candidates ranked after it were not kept
+    boundary = (-float(scores[-1]), int(rows[-1])) if n == index.k else None
+    start = 0
+    if after is not None:
+        ranked_after = (scores < after[0]) | ((scores == after[0]) & (rows > after[1]))
+        start = int(np.argmax(ranked_after)) if ranked_after.any() else n
+    precomputed = _stored(rows, scores, start, index.stale)
+    rescored = []
+    live_rows = np.array(sorted(index.stale) + list(range(len(index.candidates), len(matrix))), dtype=np.int64)
+    if len(live_rows):
+        live_scores = round_scores(matrix.reciprocal_scores(traits, dob, rows=live_rows))
+        rescored = sorted(zip(live_rows.tolist(), live_scores.tolist()), key=rank_key)
+    after_key = (-after[0], after[1]) if after is not None else None
+
+    ranked = []
+    for row, score in heapq.merge(precomputed, rescored, key=rank_key):
+        key = (-score, row)
+        if boundary is not None and key > boundary:
+            break
+        if row in excluded or (after_key is not None and key <= after_key):
+            continue
+        ranked.append((row, score))
+        if k is not None and len(ranked) >= k:
+            return ranked
+    if boundary is None:
+        return ranked
+    resume = max(boundary, after_key) if after_key is not None else boundary
+    rest = matrix.top_k(traits, dob, exclude=exclude, k=None if k is None else k - len(ranked),
+                        after=(-resume[0], resume[1]), raw=matrix.reciprocal_scores(traits, dob))
+    return ranked + rest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute every user's top candidates by reciprocal compatibility for /ranked-matches?mode=reciprocal.")
+    parser.add_argument("--k", type=int, default=TOP_K, help="candidates kept per user")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--out", default=RECIPROCAL_DIR, help="directory holding the builds")
+    args = parser.parse_args()
+
+    storage = get_storage()
+    users, version = storage.users_since(None)
+    matrix = CandidateMatrix.from_sources(storage.get_personas(), users)
+    print(json.dumps(build(matrix, users, args.k, args.processes, args.out, version), indent=2))
+
+
+if __name__ == "__main__":
+    main()
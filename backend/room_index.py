@@ -0,0 +1,189 @@
+# room_index.py
+
+import numpy as np
+
+from backend.matcher import life_path
+from backend.scoring import NUMEROLOGY_TABLE, round_scores, vocab_key
+
+# Same weights as match_user_to_rooms / rank_rooms_for_user
+COMPATIBILITY_WEIGHT = 0.7
+LOGISTICS_WEIGHT = 0.2
+NUMEROLOGY_WEIGHT = 0.1
+EMPTY_ROOM_COMPATIBILITY = 5
+LOGISTICS_FIELDS = ("room_type", "floor", "has_window")
+
+
+class RoomIndex:
+    """Per-room occupant aggregates for scoring users against every room at once.
+
+    For each room it keeps how many occupants hold each (trait, value), the
+    multiset of occupant life-path numbers, and buckets by free capacity and by
+    room_type / floor / has_window. Aggregates are updated when occupants move
+    in or out, so scoring never walks the occupant lists again.
+    """
+
+    def __init__(self, rooms=()):
+        self.rooms = []
+        self.positions = {}
+        self.capacity = np.zeros(0, dtype=np.int64)
+        self.occupant_counts = np.zeros(0)
+        self.life_path_counts = np.zeros((0, 10))
+        # trait_counts[k, r]: occupants of room r holding (trait, value) number k;
+        # the last row stays zero and stands in for values no occupant has
+        self.trait_values = {}
+        self.trait_counts = np.zeros((1, 0))
+        self.free_buckets = {}
+        self.attribute_buckets = {field: {} for field in LOGISTICS_FIELDS}
+        for room in rooms:
+            self.add_room(room)
+
+    def __len__(self):
+        return len(self.rooms)
+
+    def room(self, room_id):
+        return self.rooms[self.positions[room_id]]
+
+    # --- Updates ---
+    def add_room(self, room):
+        r = len(self.rooms)
+        self.rooms.append(room)
+        self.positions[room["room_id"]] = r
+        self.capacity = np.append(self.capacity, room.get("capacity", 1))
+        self.occupant_counts = np.append(self.occupant_counts, 0)
+        self.life_path_counts = np.vstack([self.life_path_counts, np.zeros((1, 10))])
+        self.trait_counts = np.hstack([self.trait_counts, np.zeros((self.trait_counts.shape[0], 1))])
+        for field in LOGISTICS_FIELDS:
+            self.attribute_buckets[field].setdefault(vocab_key(room.get(field)), set()).add(r)
+        for occupant in room.get("occupants", []):
+            self._count_occupant(r, occupant, 1)
+        self._set_free(r, None)
+
+    def add_occupant(self, room_id, occupant):
+        r = self.positions[room_id]
+        before = self._free(r)
+        self.rooms[r].setdefault("occupants", []).append(occupant)
+        self._count_occupant(r, occupant, 1)
+        self._set_free(r, before)
+
+    def remove_occupant(self, room_id, occupant):
+        r = self.positions[room_id]
+        before = self._free(r)
+        self.rooms[r]["occupants"].remove(occupant)
+        self._count_occupant(r, occupant, -1)
+        self._set_free(r, before)
+
+    def _free(self, r):
+        return int(self.capacity[r] - self.occupant_counts[r])
+
+    def _set_free(self, r, previous):
+        if previous is not None:
+            self.free_buckets[previous].discard(r)
+        self.free_buckets.setdefault(self._free(r), set()).add(r)
+
+    def _trait_row(self, trait, value):
+        key = (trait, vocab_key(value))
+        k = self.trait_values.get(key)
+        if k is None:
+            k = len(self.trait_values)
+            self.trait_values[key] = k
+            # Insert before the trailing all-zero row
+            self.trait_counts = np.insert(self.trait_counts, k, 0, axis=0)
+        return k
+
+    def _count_occupant(self, r, occupant, delta):
+        self.occupant_counts[r] += delta
+        for trait, value in (occupant.get("traits", {}) or {}).items():
+            k = self._trait_row(trait, value)  # may reallocate trait_counts
+            self.trait_counts[k, r] += delta
+        if "dob" in occupant:
+            self.life_path_counts[r, life_path(occupant)] += delta
+
+    # --- Scoring ---
+    def available(self, min_free=1):
+        """Rows of rooms with at least `min_free` free beds, in room order."""
+        rows = [r for free, bucket in self.free_buckets.items() if free >= min_free for r in bucket]
+        return np.array(sorted(rows), dtype=np.int64)
+
+    def _user_rows(self, traits):
+        missing = len(self.trait_values)
+        return [self.trait_values.get((trait, vocab_key(value)), missing) for trait, value in traits.items()]
+
+    def scores(self, user, rows):
+        """0.7 compatibility + 0.2 logistics + 0.1 numerology against the rooms at `rows`."""
+        return self.score_matrix([user], rows)[0]
+
+    def score_matrix(self, users, rows=None):
+        """Scores of every user (rows of the result) against every room in `rows`."""
+        if rows is None:
+            rows = np.arange(len(self.rooms))
+        n_users = len(users)
+        occupant_counts = self.occupant_counts[rows]
+
+        # Compatibility: average over occupants of matches / len(user traits) * 10
+        trait_rows = [self._user_rows(user.get("traits", {}) or {}) for user in users]
+        width = max((len(t) for t in trait_rows), default=0)
+        padded = np.full((n_users, width), len(self.trait_values), dtype=np.int64)
+        for u, t in enumerate(trait_rows):
+            padded[u, :len(t)] = t
+        counts = self.trait_counts[:, rows]
+        matches = np.zeros((n_users, len(rows)))
+        for column in range(width):
+            matches += counts[padded[:, column]]
+        trait_totals = np.array([max(len(t), 1) for t in trait_rows], dtype=np.float64)
+        compatibility = (matches / trait_totals[:, None]) * 10 / np.maximum(occupant_counts, 1)[None, :]
+        compatibility[:, occupant_counts == 0] = EMPTY_ROOM_COMPATIBILITY
+
+        # Logistics: one point per matching preference, from the attribute buckets
+        position = np.full(len(self.rooms), -1, dtype=np.int64)
+        position[rows] = np.arange(len(rows))
+        logistics = np.zeros((n_users, len(rows)))
+        for field in LOGISTICS_FIELDS:
+            users_by_value = {}
+            for u, user in enumerate(users):
+                users_by_value.setdefault(vocab_key((user.get("room_preferences", {}) or {}).get(field)), []).append(u)
+            for value, user_rows in users_by_value.items():
+                bucket = self.attribute_buckets[field].get(value)
+                if bucket:
+                    hit = position[list(bucket)]
+                    logistics[np.ix_(user_rows, hit[hit >= 0])] += 1
+        logistics = logistics / 3 * 10
+
+        # Numerology: average over occupants with a DOB, 0 if nobody has one
+        life_path_counts = self.life_path_counts[rows]
+        user_life_paths = np.array([life_path(user) for user in users], dtype=np.int64)
+        with_dob = life_path_counts.sum(axis=1)
+        numerology = (NUMEROLOGY_TABLE[user_life_paths] @ life_path_counts.T) / np.maximum(with_dob, 1)[None, :]
+
+        return COMPATIBILITY_WEIGHT * compatibility + LOGISTICS_WEIGHT * logistics + NUMEROLOGY_WEIGHT * numerology
+
+    def best_room(self, user, min_free=1):
+        """Like match_user_to_rooms: (room_id, "NN.N%") of the best room with space, or (None, ...)."""
+        rows = self.available(min_free)
+        if not len(rows):
+            return None, f"{round(-1 * 10, 1)}%"
+        scores = self.scores(user, rows)
+        # Round away float noise so exact ties still go to the first room, as in the loop
+        best = int(np.argmax(np.round(scores, 9)))
+        return self.rooms[rows[best]]["room_id"], f"{round(float(scores[best]) * 10, 1)}%"
+
+    def rank(self, user):
+        """Like rank_rooms_for_user: cards for every room with space, best first."""
+        rows = self.available(1)
+        if not len(rows):
+            return []
+        rounded = round_scores(self.scores(user, rows) * 10)
+        order = np.lexsort((rows, -rounded))
+        ranked = []
+        for i in order:
+            room = self.rooms[rows[i]]
+            room_data_with_occupants = room.copy()
+            room_data_with_occupants["occupants_details"] = room.get("occupants", [])
+            ranked.append({
+                "id": room["room_id"],
+                "name": f"Room {room['room_id']}",
+                "vibe": f"{len(room.get('occupants', []))} / {room.get('capacity', 1)} occupants",
+                "avatar_color": "#A78BFA",
+                "room_data": room_data_with_occupants,
+                "score": float(rounded[i]),
+            })
+        return ranked
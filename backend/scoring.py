@@ -0,0 +1,442 @@
+# scoring.py
+
+import bisect
+import heapq
+from collections import OrderedDict
+
+import numpy as np
+
+from backend.matcher import NUMEROLOGY_SCORES, calculate_life_path_number, compute_compatibility, life_path, numerology_score
+
+# NUMEROLOGY_TABLE[a][b] == numerology_score(a, b); row/column 0 is "DOB missing"
+NUMEROLOGY_TABLE = np.array(NUMEROLOGY_SCORES, dtype=np.float64)
+
+MISSING = 0  # trait code for "candidate has no value for this trait"
+CHANGE_LOG_LIMIT = 100_000  # rows re-encoded since the oldest cache entry we can still patch
+# Fields sent to the swipe deck; everything else (password hash, dob, traits...) stays server-side
+CARD_FIELDS = ("id", "name", "vibe", "avatar_color")
+_UNSET = object()
+
+
+def vocab_key(value):
+    # Dict lookup follows ==, so 1, 1.0 and True share a code just like they compare equal
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return ("unhashable", repr(value))
+
+def rank_profiles(user_data, profiles, seen_profiles):
+    """Scalar reference ranking: 0.8 * trait score + 0.2 * numerology score."""
+    scored_profiles = []
+    user_life_path = calculate_life_path_number(user_data.get("dob", ""))
+
+    for profile in profiles:
+        if profile["id"] in seen_profiles:
+            continue
+
+        trait_score = compute_compatibility(user_data.get("traits", {}), profile.get("traits", {}))
+        profile_life_path = calculate_life_path_number(profile.get("dob", ""))
+        numerology_score_val = numerology_score(user_life_path, profile_life_path) * 2
+        final_score = (0.8 * trait_score) + (0.2 * numerology_score_val)
+
+        profile_with_score = profile.copy()
+        profile_with_score["score"] = round(final_score * 10, 2)
+        scored_profiles.append(profile_with_score)
+
+    scored_profiles.sort(key=lambda x: x["score"], reverse=True)
+    return scored_profiles
+
+
+class ProfileCard:
+    """The part of a candidate's profile shown on a swipe card.
+
+    Slotted instead of a copy of the profile dict: traits and dob already
+    live in the matrix's code arrays, and the rest (password hash, room
+    preferences...) is never sent, so it is not kept in memory either.
+    Fields missing from the profile stay unset and are left out of the card.
+    """
+
+    __slots__ = CARD_FIELDS
+
+    def __init__(self, candidate_id, profile):
+        self.id = candidate_id
+        for field in CARD_FIELDS[1:]:
+            if field in profile:
+                setattr(self, field, profile[field])
+
+    def to_json(self, score):
+        card = {}
+        for field in CARD_FIELDS:
+            value = getattr(self, field, _UNSET)
+            if value is not _UNSET:
+                card[field] = value
+        card["score"] = score
+        return card
+
+
+class CandidateMatrix:
+    """All match candidates kept in memory as integer trait codes plus life-path numbers.
+
+    Rows are append-only: personas first, then users in signup order, which is
+    the same order the scalar ranking walks them in. `cards[row]` holds what is
+    shown of each one; scores are arrays indexed by row, never attached to it.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.rows = {}
+        self.cards = []
+        self.trait_columns = {}
+        self.trait_vocab = {}
+        self._codes = np.zeros((16, 0), dtype=np.int32)
+        self._life_paths = np.zeros(16, dtype=np.int8)
+        # trait_versions[row] bumps whenever a candidate's traits or dob change;
+        # change_log lists those rows so caches can patch just them
+        self.trait_versions = []
+        self.change_log = []
+        self.change_log_start = 0
+        self.scored = 0  # candidate scores computed so far, for the per-request metric
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_sources(cls, personas, users):
+        matrix = cls()
+        for i, persona in enumerate(personas):
+            if "id" not in persona: persona["id"] = f"persona_{i}"
+            matrix.upsert(persona["id"], persona)
+        for email, user_data in users.items():
+            matrix.upsert(email, user_data)
+        return matrix
+
+    def _code(self, value):
+        key = vocab_key(value)
+        code = self.trait_vocab.get(key)
+        if code is None:
+            code = len(self.trait_vocab) + 1
+            self.trait_vocab[key] = code
+        return code
+
+    def _column(self, trait):
+        col = self.trait_columns.get(trait)
+        if col is None:
+            col = len(self.trait_columns)
+            self.trait_columns[trait] = col
+            self._codes = np.hstack([self._codes, np.full((self._codes.shape[0], 1), MISSING, dtype=np.int32)])
+        return col
+
+    def _grow(self, needed):
+        capacity = self._codes.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2)
+        codes = np.full((new_capacity, self._codes.shape[1]), MISSING, dtype=np.int32)
+        codes[:capacity] = self._codes
+        life_paths = np.zeros(new_capacity, dtype=np.int8)
+        life_paths[:capacity] = self._life_paths
+        self._codes, self._life_paths = codes, life_paths
+
+    def upsert(self, candidate_id, profile):
+        """Add a candidate, or re-encode it after its traits or dob changed."""
+        row = self.rows.get(candidate_id)
+        is_new = row is None
+        if is_new:
+            row = len(self.ids)
+            self._grow(row + 1)
+            self.ids.append(candidate_id)
+            self.rows[candidate_id] = row
+            self.cards.append(None)
+            self.trait_versions.append(0)
+
+        self.cards[row] = ProfileCard(candidate_id, profile)
+
+        traits = profile.get("traits", {}) or {}
+        columns = [self._column(trait) for trait in traits]
+        codes = np.full(self._codes.shape[1], MISSING, dtype=np.int32)
+        for col, value in zip(columns, traits.values()):
+            codes[col] = self._code(value)
+        life_path_number = life_path(profile)
+
+        if not is_new and np.array_equal(codes, self._codes[row]) and life_path_number == self._life_paths[row]:
+            return row  # e.g. only assigned_room changed; cached scores stay valid
+        self._codes[row] = codes
+        self._life_paths[row] = life_path_number
+        if not is_new:
+            self.trait_versions[row] += 1
+            self.change_log.append(row)
+            if len(self.change_log) > CHANGE_LOG_LIMIT:
+                dropped = len(self.change_log) // 2
+                del self.change_log[:dropped]
+                self.change_log_start += dropped
+        return row
+
+    def changes_since(self, position):
+        """Rows re-encoded after change-log position `position`, or None if already trimmed."""
+        if position < self.change_log_start:
+            return None
+        return self.change_log[position - self.change_log_start:]
+
+    def change_position(self):
+        return self.change_log_start + len(self.change_log)
+
+    def _matching(self, traits, rows, n):
+        """Traits each candidate shares with `traits`. The count is symmetric; only its normalization is not."""
+        matching = np.zeros(n, dtype=np.int16)
+        codes = self._codes[rows]
+        for trait, value in traits.items():
+            col = self.trait_columns.get(trait)
+            code = self.trait_vocab.get(vocab_key(value))
+            if col is None or code is None:
+                continue
+            matching += codes[:, col] == code
+        return matching
+
+    def scores(self, traits, dob, rows=None):
+        """Unrounded final score (x10) of every candidate (or just `rows`), same formula as rank_profiles."""
+        if rows is None:
+            rows = slice(0, len(self.ids))
+            n = len(self.ids)
+        else:
+            n = len(rows)
+        self.scored += n
+        # Same operations in the same order as rank_profiles, done in place so a
+        # request allocates two score-sized arrays instead of one per step
+        if traits:
+            final_scores = self._matching(traits, rows, n) / len(traits)
+            final_scores *= 10
+            final_scores *= 0.8
+        else:
+            final_scores = np.zeros(n)
+
+        user_life_path = life_path({"dob": dob})
+        numerology_score_val = NUMEROLOGY_TABLE[user_life_path][self._life_paths[rows]]
+        numerology_score_val *= 2
+        numerology_score_val *= 0.2
+        final_scores += numerology_score_val
+        final_scores *= 10
+        return final_scores
+
+    def reciprocal_scores(self, traits, dob, rows=None):
+        """Unrounded reciprocal score (x10) of every candidate (or just `rows`).
+
+        `scores` is how well each candidate suits the user; this also scores
+        the user from each candidate's side (shared traits over the candidate's
+        trait count, the candidate's row of the numerology table) and combines
+        the two with `reciprocal_score`.
+        """
+        forward = self.scores(traits, dob, rows)
+        if rows is None:
+            rows = slice(0, len(self.ids))
+        n = len(forward)
+        trait_counts = np.count_nonzero(self._codes[rows] != MISSING, axis=1)
+        reverse = one_way_scores(self._matching(traits, rows, n), trait_counts, self._life_paths[rows], life_path({"dob": dob}))
+        return reciprocal_score(forward, reverse)
+
+    def top_k(self, traits, dob, exclude=(), k=None, after=None, raw=None):
+        """Return [(row, score)] best first, ordered exactly like rank_profiles.
+
+        Ties on the rounded score keep row order, matching the stable sort of the
+        scalar path. `after` is a (score, row) keyset cursor: only candidates
+        ranked after it are returned. `raw` reuses scores from a ScoreCache.
+        """
+        if raw is None:
+            raw = self.scores(traits, dob)
+        allowed = np.ones(len(raw), dtype=bool)
+        excluded_rows = [self.rows[c] for c in exclude if c in self.rows]
+        allowed[excluded_rows] = False
+        rows = np.flatnonzero(allowed)
+        raw = raw[rows]
+
+        if after is not None:
+            after_score, after_row = after
+            # Scores more than 0.01 away from the cursor round to a different value,
+            # so only the band in between needs the exact rounded comparison.
+            keep = raw < after_score + 0.01
+            band = np.flatnonzero(keep & (raw > after_score - 0.01))
+            if len(band):
+                band_rounded = round_scores(raw[band])
+                keep[band] = (band_rounded < after_score) | ((band_rounded == after_score) & (rows[band] > after_row))
+            rows, raw = rows[keep], raw[keep]
+
+        if k is not None and k < len(rows):
+            if k <= 0:
+                return []
+            # Anything more than 0.01 below the k-th raw score rounds strictly lower,
+            # so the rounded ordering below only needs this shortlist.
+            kth = np.partition(raw, len(raw) - k)[len(raw) - k]
+            shortlist = np.flatnonzero(raw >= kth - 0.01)
+            rows, raw = rows[shortlist], raw[shortlist]
+
+        rounded = round_scores(raw)
+        order = np.lexsort((rows, -rounded))
+        if k is not None:
+            order = order[:k]
+        return [(int(rows[i]), float(rounded[i])) for i in order]
+
+
+class ScoreCache:
+    """LRU cache of each user's scores against every candidate.
+
+    An entry is keyed by (user_id, trait_version) and covers the pairs
+    (user_id, candidate_id, candidate trait_version) it was computed from. On a
+    hit, candidates whose traits or dob changed since then, and candidates that
+    signed up since, are rescored in place; nothing else is recomputed.
+    """
+
+    def __init__(self, matrix, maxsize=128):
+        self.matrix = matrix
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.patched = 0
+        self.evictions = 0
+
+    def scores(self, user_id, traits, dob):
+        matrix = self.matrix
+        row = matrix.rows.get(user_id)
+        if row is None:
+            self.misses += 1
+            return matrix.scores(traits, dob)
+
+        key = (user_id, matrix.trait_versions[row])
+        entry = self._entries.get(key)
+        changed = matrix.changes_since(entry[1]) if entry is not None else None
+        if changed is None:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            raw = matrix.scores(traits, dob)
+        else:
+            self.hits += 1
+            raw = entry[0]
+            stale = np.unique(np.array(changed, dtype=np.int64))
+            if len(raw) < len(matrix):
+                stale = np.union1d(stale, np.arange(len(raw), len(matrix)))
+                raw = np.concatenate([raw, np.zeros(len(matrix) - len(raw))])
+            if len(stale):
+                raw[stale] = matrix.scores(traits, dob, rows=stale)
+                self.patched += len(stale)
+            self._entries.move_to_end(key)
+
+        self._entries[key] = (raw, matrix.change_position())
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return raw
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "patched_pairs": self.patched,
+            "evictions": self.evictions,
+        }
+
+
+def one_way_scores(matching, trait_counts, life_paths, other_life_paths):
+    """Unrounded score (x10) a scorer gives another, same operations as CandidateMatrix.scores.
+
+    `matching` counts the traits the two share; `trait_counts` and
+    `life_paths` describe the scorers. Arguments broadcast, so this scores a
+    whole block of pairs at once.
+    """
+    scores = np.divide(matching, trait_counts, out=np.zeros(np.shape(matching)), where=trait_counts > 0)
+    scores *= 10
+    scores *= 0.8
+    numerology_score_val = NUMEROLOGY_TABLE[life_paths, other_life_paths]
+    numerology_score_val *= 2
+    numerology_score_val *= 0.2
+    scores += numerology_score_val
+    scores *= 10
+    return scores
+
+
+def reciprocal_score(forward, reverse):
+    """Harmonic mean of both directions' scores: high only when each side rates the other highly."""
+    total = forward + reverse
+    return np.divide(2 * forward * reverse, total, out=np.zeros(np.shape(total)), where=total > 0)
+
+
+def round_scores(raw):
+    # Round each distinct score once with Python's round() so ties match the scalar path
+    distinct, inverse = np.unique(raw, return_inverse=True)
+    return np.array([round(float(x), 2) for x in distinct])[inverse]
+
+
+class SignatureBuckets:
+    """Candidates grouped by (trait codes, life path) for sublinear top-k retrieval.
+
+    Everyone in a bucket gets the same score from a given user, and there are
+    only a few hundred distinct combinations, so ranking scores one
+    representative per bucket and only expands the buckets that can reach the
+    page. Rows inside a bucket stay sorted, which keeps ties in row order.
+    """
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.buckets = {}
+        self.signatures = []
+        self._width = None
+        self._position = None
+
+    def _signature(self, row):
+        return self.matrix._codes[row].tobytes(), int(self.matrix._life_paths[row])
+
+    def _move(self, row, signature):
+        old = self.signatures[row]
+        if old == signature:
+            return
+        if old is not None:
+            bucket = self.buckets[old]
+            del bucket[bisect.bisect_left(bucket, row)]
+            if not bucket:
+                del self.buckets[old]
+        bisect.insort(self.buckets.setdefault(signature, []), row)
+        self.signatures[row] = signature
+
+    def sync(self):
+        """Catch up with rows the matrix added or re-encoded since the last call."""
+        matrix = self.matrix
+        changed = matrix.changes_since(self._position) if self._position is not None else None
+        if changed is None or self._width != matrix._codes.shape[1]:
+            # First use, change log trimmed, or a new trait column: every signature moves
+            self.buckets, self.signatures = {}, []
+            changed = []
+        self._width = matrix._codes.shape[1]
+        self._position = matrix.change_position()
+        for row in range(len(self.signatures), len(matrix)):
+            self.signatures.append(None)
+            self._move(row, self._signature(row))
+        for row in set(changed):
+            self._move(row, self._signature(row))
+
+    def top_k(self, traits, dob, exclude=(), k=None, after=None):
+        """Same contract and ordering as CandidateMatrix.top_k."""
+        self.sync()
+        matrix = self.matrix
+        signatures = list(self.buckets)
+        if not signatures or (k is not None and k <= 0):
+            return []
+        representatives = np.array([self.buckets[s][0] for s in signatures], dtype=np.int64)
+        bucket_scores = round_scores(matrix.scores(traits, dob, rows=representatives))
+        excluded = {matrix.rows[c] for c in exclude if c in matrix.rows}
+
+        ranked = []
+        for score in sorted(set(bucket_scores.tolist()), reverse=True):
+            if after is not None and score > after[0]:
+                continue
+            # Buckets with equal scores interleave by row
+            rows = heapq.merge(*(self.buckets[signatures[i]] for i in np.flatnonzero(bucket_scores == score)))
+            for row in rows:
+                if row in excluded or (after is not None and score == after[0] and row <= after[1]):
+                    continue
+                ranked.append((row, score))
+                if k is not None and len(ranked) >= k:
+                    return ranked
+        return ranked
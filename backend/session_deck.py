@@ -0,0 +1,197 @@
+# session_deck.py
+
+import bisect
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from backend.scoring import round_scores
+
+DECK_SIZE = 200  # cards ranked per refill; a deck doubles on each refill after that
+
+
+class SessionDeck:
+    """One user's ranked deck: every unseen candidate that ranks up to `horizon`, best first.
+
+    Entries are (-score, row), so the deck sorts ascending in exactly the
+    order CandidateMatrix.top_k returns and a (score, row) cursor is a bisect.
+    `complete` means nobody ranks below the horizon and the deck holds
+    everyone that is left.
+    """
+
+    def __init__(self, owner_version, position, n_rows):
+        self.owner_version = owner_version
+        self.position = position  # matrix change-log position the deck is patched up to
+        self.n_rows = n_rows  # candidates that existed when the deck was last patched
+        self.entries = []
+        self.keys = {}
+        self.horizon = None
+        self.complete = False
+        self.last_used = 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def covers(self, key) -> bool:
+        return self.complete or (self.horizon is not None and key <= self.horizon)
+
+    def insert(self, row, score):
+        key = (-score, row)
+        bisect.insort(self.entries, key)
+        self.keys[row] = key
+
+    def discard(self, row):
+        key = self.keys.pop(row, None)
+        if key is not None:
+            del self.entries[bisect.bisect_left(self.entries, key)]
+
+    def extend(self, ranked, k):
+        """Append the next `k` cards from a ranking that continues after the horizon."""
+        for row, score in ranked:
+            self.insert(row, score)
+        if ranked:
+            self.horizon = (-ranked[-1][1], ranked[-1][0])
+        self.complete = len(ranked) < k
+
+    def page(self, seen_rows, limit, after=None):
+        """Up to `limit` (row, score) ranked after the `after` cursor, or None if the deck runs out first."""
+        start = bisect.bisect_right(self.entries, (-after[0], after[1])) if after is not None else 0
+        cards = []
+        for neg_score, row in self.entries[start:]:
+            if row in seen_rows:
+                continue
+            cards.append((row, -neg_score))
+            if len(cards) == limit:
+                return cards
+        return cards if self.complete else None
+
+
+class DeckCache:
+    """Per-session ranked decks for /ranked-matches, so a page is served off the head of the deck.
+
+    A deck is ranked once, then kept up to date instead of being re-ranked:
+    /swipe pops the swiped card, and candidates that signed up or whose
+    traits or dob changed are rescored and re-inserted from the matrix change
+    log on the deck's next use. Everything except `discard` runs on the index
+    worker. A deck is rebuilt when its owner's own traits
+    change, and dropped after `ttl` idle seconds or when more than `maxsize`
+    are cached (least recently used first).
+    """
+
+    def __init__(self, matrix, maxsize=1024, ttl=900.0, deck_size=DECK_SIZE, clock=time.monotonic):
+        self.matrix = matrix
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.deck_size = deck_size
+        self.clock = clock
+        self._decks = OrderedDict()
+        self._swiped = deque()
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.patched = 0
+        self.popped = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def page(self, user_id, traits, dob, seen, limit, after, rank):
+        """[(row, score)] for one page, identical to `rank(seen, limit, after)`.
+
+        `rank(exclude, k, after)` is the uncached ranking (CandidateMatrix or
+        SignatureBuckets top_k for this user); the deck only calls it to fill up.
+        """
+        self._pop_swiped()
+        matrix = self.matrix
+        row = matrix.rows.get(user_id)
+        if row is None or self.maxsize <= 0:
+            return rank(seen, limit, after)
+        seen_rows = {matrix.rows[c] for c in seen if c in matrix.rows}
+
+        now = self.clock()
+        self._expire(now)
+        deck = self._decks.get(user_id)
+        if deck is not None and deck.owner_version == matrix.trait_versions[row] and self._patch(deck, traits, dob, seen_rows):
+            self.hits += 1
+        else:
+            self.misses += 1
+            deck = SessionDeck(matrix.trait_versions[row], matrix.change_position(), len(matrix))
+            self._decks[user_id] = deck
+        self._decks.move_to_end(user_id)
+        deck.last_used = now
+
+        while (cards := deck.page(seen_rows, limit, after)) is None:
+            # Ran off the end of the deck: rank the next stretch after the horizon
+            k = max(self.deck_size, len(deck))
+            horizon = (-deck.horizon[0], deck.horizon[1]) if deck.horizon is not None else None
+            deck.extend(rank(seen, k, horizon), k)
+            self.refills += 1
+
+        while len(self._decks) > self.maxsize:
+            self._decks.popitem(last=False)
+            self.evictions += 1
+        return cards
+
+    def _patch(self, deck, traits, dob, seen_rows) -> bool:
+        """Rescore candidates added or re-encoded since the deck was last used. False if it has to be rebuilt."""
+        matrix = self.matrix
+        changed = matrix.changes_since(deck.position)
+        if changed is None:
+            return False
+        stale = set(changed) | set(range(deck.n_rows, len(matrix)))
+        stale -= seen_rows
+        if stale:
+            rows = np.array(sorted(stale), dtype=np.int64)
+            for row, score in zip(rows.tolist(), round_scores(matrix.scores(traits, dob, rows=rows)).tolist()):
+                deck.discard(row)
+                if deck.covers((-score, row)):
+                    deck.insert(row, score)
+            self.patched += len(stale)
+        deck.position = matrix.change_position()
+        deck.n_rows = len(matrix)
+        return True
+
+    def discard(self, user_id, candidate_id):
+        """Pop a swiped card from the user's deck.
+
+        Safe to call from the event loop: the pop is queued and applied before
+        the next page is served, so /swipe never waits on the index worker.
+        """
+        if user_id in self._decks:
+            self._swiped.append((user_id, candidate_id))
+
+    def _pop_swiped(self):
+        while self._swiped:
+            user_id, candidate_id = self._swiped.popleft()
+            deck = self._decks.get(user_id)
+            row = self.matrix.rows.get(candidate_id)
+            if deck is not None and row in deck.keys:
+                deck.discard(row)
+                self.popped += 1
+
+    def invalidate(self, user_id):
+        self._decks.pop(user_id, None)
+
+    def _expire(self, now):
+        # Decks are kept in last-used order, so idle ones sit at the front
+        while self._decks:
+            user_id, deck = next(iter(self._decks.items()))
+            if now - deck.last_used <= self.ttl:
+                break
+            del self._decks[user_id]
+            self.expired += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._decks),
+            "cards": sum(len(deck) for deck in self._decks.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "refills": self.refills,
+            "patched_cards": self.patched,
+            "popped_cards": self.popped,
+            "expired": self.expired,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,640 @@
+# storage.py
+
+import json
+import os
+import sqlite3
+import stat
+import sys
+import tempfile
+import threading
+import time
+from contextlib import closing, contextmanager
+
+from backend.concurrency import FileLock
+from backend.metrics import REGISTRY
+
+DATA_DIR = os.getenv("DATA_DIR", "backend/data")
+USERS_FILE = os.path.join(DATA_DIR, "users.json")
+PERSONAS_FILE = os.path.join(DATA_DIR, "personas.json")
+ROOMS_FILE = os.path.join(DATA_DIR, "rooms.json")
+SWIPES_FILE = os.path.join(DATA_DIR, "swipes.json")
+SWIPE_LOG_FILE = os.path.join(DATA_DIR, "swipes.log")
+MATCHES_FILE = os.path.join(DATA_DIR, "matches.json")
+SQLITE_FILE = os.path.join(DATA_DIR, "matchmyvibe.db")
+
+# "sqlite" uses the WAL database, "json" keeps the original whole-file store
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+SQLITE_PATH = os.getenv("SQLITE_PATH", SQLITE_FILE)
+
+# mkstemp creates files 0600; a new data file gets the mode open() would have given it
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+JSON_IO_SECONDS = REGISTRY.histogram("json_io_seconds", "Time to load or save a whole JSON file.", ("op", "file"))
+JSON_IO_BYTES = REGISTRY.counter("json_io_bytes_total", "Bytes of JSON files loaded or saved.", ("op", "file"))
+
+
+def load_json_file(filepath: str):
+    if not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
+        if 'users.json' in filepath or 'swipes.json' in filepath or 'matches.json' in filepath:
+            return {}
+        else:
+            return []
+    start = time.perf_counter()
+    with open(filepath, "r") as f:
+        data = json.load(f)
+        size = f.tell()
+    name = os.path.basename(filepath)
+    JSON_IO_SECONDS.observe(time.perf_counter() - start, op="load", file=name)
+    JSON_IO_BYTES.inc(size, op="load", file=name)
+    return data
+
+def save_json_file(filepath: str, data):
+    # Write to a temp file first so readers never see a half-written file; the name is
+    # unique so concurrent writers of the same file each replace it whole
+    start = time.perf_counter()
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filepath) or ".", prefix=os.path.basename(filepath) + ".", suffix=".tmp")
+    try:
+        # Keep the replaced file's permissions
+        mode = stat.S_IMODE(os.stat(filepath).st_mode) if os.path.exists(filepath) else 0o666 & ~_UMASK
+        os.fchmod(fd, mode)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+            size = f.tell()
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    name = os.path.basename(filepath)
+    JSON_IO_SECONDS.observe(time.perf_counter() - start, op="save", file=name)
+    JSON_IO_BYTES.inc(size, op="save", file=name)
+
+def _empty_swipes():
+    return {"liked": [], "disliked": []}
+
+def _fold_swipes(swipes, events):
+    # Apply (user, target, direction) events to a {user: {"liked": [], "disliked": []}} snapshot
+    for user, target, direction in events:
+        user_swipes = swipes.setdefault(user, _empty_swipes())
+        key = "liked" if direction == "right" else "disliked"
+        if target not in user_swipes[key]:
+            user_swipes[key].append(target)
+    return swipes
+
+def _snapshot_events(swipes):
+    for user, user_swipes in swipes.items():
+        for target in user_swipes.get("liked", []):
+            yield user, target, "right"
+        for target in user_swipes.get("disliked", []):
+            yield user, target, "left"
+
+
+class JsonStorage:
+    """The original JSON-file store. Every write rewrites the whole file, except
+    swipes, which are appended to swipes.log and folded into swipes.json by
+    compact_swipes().
+
+    Writes hold a lock file in the data directory, so several worker processes
+    can share the files. versions.json counts the writes to each file, which
+    tells a worker its in-memory copy is stale.
+    """
+
+    def __init__(self, data_dir: str = DATA_DIR):
+        self.data_dir = data_dir
+        self.users_file = os.path.join(data_dir, "users.json")
+        self.personas_file = os.path.join(data_dir, "personas.json")
+        self.rooms_file = os.path.join(data_dir, "rooms.json")
+        self.swipes_file = os.path.join(data_dir, "swipes.json")
+        self.swipe_log_file = os.path.join(data_dir, "swipes.log")
+        self.matches_file = os.path.join(data_dir, "matches.json")
+        self.versions_file = os.path.join(data_dir, "versions.json")
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(os.path.join(data_dir, "storage.lock"))
+        self._depth = 0
+        self._named_locks = {}
+
+    @contextmanager
+    def _locked(self):
+        # Reentrant within a thread; the lock file is taken once, by the outermost caller
+        with self._lock:
+            if self._depth == 0:
+                self._file_lock.acquire()
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._file_lock.release()
+
+    @contextmanager
+    def transaction(self):
+        with self._locked():
+            yield self
+
+    def lock(self, name) -> FileLock:
+        """A cross-process lock for a multi-step section, e.g. picking and saving rooms."""
+        return self._named_locks.setdefault(name, FileLock(os.path.join(self.data_dir, f"{name}.lock")))
+
+    def _versions(self):
+        return load_json_file(self.versions_file) or {}
+
+    def _bump(self, name):
+        # Called after the data file is replaced, so a reader that sees the new version also sees the data
+        versions = self._versions()
+        versions[name] = versions.get(name, 0) + 1
+        save_json_file(self.versions_file, versions)
+
+    # --- Users ---
+    def get_user(self, email):
+        return load_json_file(self.users_file).get(email)
+
+    def put_user(self, email, data):
+        with self._locked():
+            users = load_json_file(self.users_file)
+            users[email] = data
+            save_json_file(self.users_file, users)
+            self._bump("users")
+
+    def create_user(self, email, data) -> bool:
+        with self._locked():
+            users = load_json_file(self.users_file)
+            if email in users:
+                return False
+            users[email] = data
+            save_json_file(self.users_file, users)
+            self._bump("users")
+            return True
+
+    def get_users(self, emails):
+        users = load_json_file(self.users_file)
+        return {email: users[email] for email in emails if email in users}
+
+    def put_users(self, updates):
+        """Write several user records with one rewrite of users.json."""
+        with self._locked():
+            users = load_json_file(self.users_file)
+            users.update(updates)
+            save_json_file(self.users_file, users)
+            self._bump("users")
+
+    def all_users(self):
+        return load_json_file(self.users_file)
+
+    def users_since(self, version):
+        """(users written after `version`, current version). users.json is rewritten whole, so that is everyone."""
+        current = self._versions().get("users", 0)
+        if version is not None and version == current:
+            return {}, current
+        return load_json_file(self.users_file), current
+
+    # --- Personas (read-only seed data) ---
+    def get_personas(self):
+        return load_json_file(self.personas_file)
+
+    # --- Swipes ---
+    def _log_events(self):
+        if not os.path.exists(self.swipe_log_file):
+            return
+        with open(self.swipe_log_file, "r") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line from a crash mid-append
+                yield event["user"], event["target"], event["direction"]
+
+    def iter_swipes(self):
+        """Every swipe in the order it happened: the swipes.json snapshot, then the log."""
+        yield from _snapshot_events(load_json_file(self.swipes_file))
+        yield from self._log_events()
+
+    def get_swipes(self, email):
+        return self.all_swipes().get(email, _empty_swipes())
+
+    def all_swipes(self):
+        return _fold_swipes(load_json_file(self.swipes_file), self._log_events())
+
+    def add_swipe(self, email, target_id, direction) -> bool:
+        """Append a swipe to the log. Duplicates are dropped when the log is replayed."""
+        direction = "right" if direction == "right" else "left"
+        line = json.dumps({"user": email, "target": target_id, "direction": direction}) + "\n"
+        with self._locked():
+            with open(self.swipe_log_file, "a") as f:
+                f.write(line)
+        return True
+
+    def _read_log(self, offset):
+        """Complete lines of swipes.log after byte `offset`, and the offset just past them."""
+        if not os.path.exists(self.swipe_log_file):
+            return [], offset
+        with open(self.swipe_log_file, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # a line still being appended is read next time
+        events = []
+        for line in data[:end].splitlines():
+            try:
+                event = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            events.append((event["user"], event["target"], event["direction"]))
+        return events, offset + end
+
+    def swipes_since(self, cursor):
+        """(swipes recorded after `cursor`, new cursor); every swipe if cursor is None or the log was compacted since."""
+        compactions = self._versions().get("swipes", 0)
+        if cursor is not None and cursor[0] == compactions:
+            events, offset = self._read_log(cursor[1])
+            return events, (compactions, offset)
+        with self._locked():
+            compactions = self._versions().get("swipes", 0)
+            events, offset = self._read_log(0)
+            return list(_snapshot_events(load_json_file(self.swipes_file))) + events, (compactions, offset)
+
+    def compact_swipes(self):
+        """Fold swipes.log into swipes.json and truncate the log."""
+        with self._locked():
+            save_json_file(self.swipes_file, self.all_swipes())
+            if os.path.exists(self.swipe_log_file):
+                os.remove(self.swipe_log_file)
+            self._bump("swipes")
+
+    # --- Matches ---
+    def get_match(self, match_key):
+        return load_json_file(self.matches_file).get(match_key)
+
+    def put_match(self, match_key, data):
+        with self._locked():
+            matches = load_json_file(self.matches_file)
+            matches[match_key] = data
+            save_json_file(self.matches_file, matches)
+
+    def create_match(self, match_key, data) -> bool:
+        """Store a new match. Returns False if the pair already has one."""
+        with self._locked():
+            matches = load_json_file(self.matches_file)
+            if match_key in matches:
+                return False
+            matches[match_key] = data
+            save_json_file(self.matches_file, matches)
+            return True
+
+    def put_matches(self, updates):
+        """Write several matches with one rewrite of matches.json."""
+        with self._locked():
+            matches = load_json_file(self.matches_file)
+            matches.update(updates)
+            save_json_file(self.matches_file, matches)
+
+    def get_matches(self, match_keys):
+        matches = load_json_file(self.matches_file)
+        return {key: matches[key] for key in match_keys if key in matches}
+
+    def all_matches(self):
+        return load_json_file(self.matches_file)
+
+    # --- Rooms ---
+    def get_rooms(self):
+        return load_json_file(self.rooms_file)
+
+    def get_room(self, room_id):
+        for room in self.get_rooms():
+            if room["room_id"] == room_id:
+                return room
+        return None
+
+    def put_room(self, room):
+        with self._locked():
+            rooms = load_json_file(self.rooms_file)
+            for i, existing in enumerate(rooms):
+                if existing["room_id"] == room["room_id"]:
+                    rooms[i] = room
+                    break
+            else:
+                rooms.append(room)
+            save_json_file(self.rooms_file, rooms)
+            self._bump("rooms")
+
+    def put_rooms(self, updates):
+        """Write several rooms with one rewrite of rooms.json."""
+        updates = {room["room_id"]: room for room in updates}
+        with self._locked():
+            rooms = load_json_file(self.rooms_file)
+            for i, existing in enumerate(rooms):
+                rooms[i] = updates.pop(existing["room_id"], existing)
+            rooms.extend(updates.values())
+            save_json_file(self.rooms_file, rooms)
+            self._bump("rooms")
+
+    def rooms_version(self):
+        return self._versions().get("rooms", 0)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    email TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS swipes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    target TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    UNIQUE (user, target, direction)
+);
+CREATE INDEX IF NOT EXISTS swipes_by_target ON swipes (target, direction);
+CREATE TABLE IF NOT EXISTS matches (
+    match_key TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rooms (
+    room_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Every write to a user or room stamps it with the table's next version, so
+# workers can fetch just the rows written since they last looked
+VERSIONED_TABLES = ("users", "rooms")
+NEXT_USER_VERSION = "(SELECT COALESCE(MAX(version), 0) + 1 FROM users)"
+
+
+class SqliteStorage:
+    """SQLite store in WAL mode with keyed row-level reads and writes."""
+
+    def __init__(self, db_path: str = SQLITE_PATH, personas_file: str = PERSONAS_FILE):
+        self.db_path = db_path
+        self.personas_file = personas_file
+        self._local = threading.local()
+        self._named_locks = {}
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        for table in VERSIONED_TABLES:
+            # Databases created before the version column
+            if "version" not in {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_by_version ON {table} (version)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: we issue BEGIN/COMMIT ourselves
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self._conn()
+        if self._local.depth == 0:
+            conn.execute("BEGIN IMMEDIATE")
+        self._local.depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                conn.execute("ROLLBACK")
+            raise
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            conn.execute("COMMIT")
+
+    def lock(self, name) -> FileLock:
+        """A cross-process lock for a multi-step section, e.g. picking and saving rooms."""
+        return self._named_locks.setdefault(name, FileLock(f"{self.db_path}.{name}.lock"))
+
+    def close(self):
+        """Close this thread's connection; the last one to close folds the WAL back into the database."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _one(self, sql, params):
+        row = self._conn().execute(sql, params).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # --- Users ---
+    def get_user(self, email):
+        return self._one("SELECT data FROM users WHERE email = ?", (email,))
+
+    def put_user(self, email, data):
+        self.put_users({email: data})
+
+    def create_user(self, email, data) -> bool:
+        cur = self._conn().execute(
+            f"INSERT OR IGNORE INTO users (email, data, version) VALUES (?, ?, {NEXT_USER_VERSION})",
+            (email, json.dumps(data)),
+        )
+        return cur.rowcount > 0
+
+    def get_users(self, emails):
+        emails = list(emails)
+        users = {}
+        for i in range(0, len(emails), 500):
+            chunk = emails[i:i + 500]
+            rows = self._conn().execute(
+                f"SELECT email, data FROM users WHERE email IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            users.update((email, json.loads(data)) for email, data in rows)
+        return users
+
+    def put_users(self, updates):
+        self._conn().executemany(
+            f"INSERT INTO users (email, data, version) VALUES (?, ?, {NEXT_USER_VERSION}) "
+            "ON CONFLICT(email) DO UPDATE SET data = excluded.data, version = excluded.version",
+            [(email, json.dumps(data)) for email, data in updates.items()],
+        )
+
+    def all_users(self):
+        rows = self._conn().execute("SELECT email, data FROM users ORDER BY rowid")
+        return {email: json.loads(data) for email, data in rows}
+
+    def users_since(self, version):
+        """(users written after `version`, current version), in signup order; everyone if version is None."""
+        rows = self._conn().execute(
+            "SELECT email, data, version FROM users WHERE version > ? ORDER BY rowid",
+            (-1 if version is None else version,),
+        )
+        users = {}
+        latest = version or 0
+        for email, data, row_version in rows:
+            users[email] = json.loads(data)
+            latest = max(latest, row_version)
+        return users, latest
+
+    # --- Personas (read-only seed data) ---
+    def get_personas(self):
+        return load_json_file(self.personas_file)
+
+    # --- Swipes ---
+    def iter_swipes(self):
+        """Every swipe in the order it happened (the swipes table is append-only)."""
+        yield from self._conn().execute("SELECT user, target, direction FROM swipes ORDER BY seq")
+
+    def swipes_since(self, cursor):
+        """(swipes recorded after `cursor`, new cursor); every swipe if cursor is None."""
+        rows = self._conn().execute(
+            "SELECT seq, user, target, direction FROM swipes WHERE seq > ? ORDER BY seq", (cursor or 0,)
+        ).fetchall()
+        return [row[1:] for row in rows], rows[-1][0] if rows else cursor or 0
+
+    def get_swipes(self, email):
+        swipes = _empty_swipes()
+        rows = self._conn().execute(
+            "SELECT target, direction FROM swipes WHERE user = ? ORDER BY seq", (email,)
+        )
+        for target, direction in rows:
+            swipes["liked" if direction == "right" else "disliked"].append(target)
+        return swipes
+
+    def all_swipes(self):
+        return _fold_swipes({}, self.iter_swipes())
+
+    def add_swipe(self, email, target_id, direction) -> bool:
+        """Record a swipe. Returns False if it was already recorded."""
+        direction = "right" if direction == "right" else "left"
+        cur = self._conn().execute(
+            "INSERT OR IGNORE INTO swipes (user, target, direction) VALUES (?, ?, ?)",
+            (email, target_id, direction),
+        )
+        return cur.rowcount > 0
+
+    # --- Matches ---
+    def get_match(self, match_key):
+        return self._one("SELECT data FROM matches WHERE match_key = ?", (match_key,))
+
+    def put_match(self, match_key, data):
+        self.put_matches({match_key: data})
+
+    def put_matches(self, updates):
+        self._conn().executemany(
+            "INSERT INTO matches (match_key, data) VALUES (?, ?) "
+            "ON CONFLICT(match_key) DO UPDATE SET data = excluded.data",
+            [(match_key, json.dumps(data)) for match_key, data in updates.items()],
+        )
+
+    def create_match(self, match_key, data) -> bool:
+        """Store a new match. Returns False if the pair already has one."""
+        cur = self._conn().execute(
+            "INSERT OR IGNORE INTO matches (match_key, data) VALUES (?, ?)", (match_key, json.dumps(data))
+        )
+        return cur.rowcount > 0
+
+    def get_matches(self, match_keys):
+        match_keys = list(match_keys)
+        matches = {}
+        for i in range(0, len(match_keys), 500):
+            chunk = match_keys[i:i + 500]
+            rows = self._conn().execute(
+                f"SELECT match_key, data FROM matches WHERE match_key IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            matches.update((key, json.loads(data)) for key, data in rows)
+        return matches
+
+    def all_matches(self):
+        rows = self._conn().execute("SELECT match_key, data FROM matches ORDER BY rowid")
+        return {key: json.loads(data) for key, data in rows}
+
+    # --- Rooms ---
+    def get_rooms(self):
+        rows = self._conn().execute("SELECT data FROM rooms ORDER BY position")
+        return [json.loads(data) for (data,) in rows]
+
+    def get_room(self, room_id):
+        return self._one("SELECT data FROM rooms WHERE room_id = ?", (room_id,))
+
+    def put_room(self, room):
+        self.put_rooms([room])
+
+    def put_rooms(self, updates):
+        self._conn().executemany(
+            "INSERT INTO rooms (room_id, position, data, version) "
+            "VALUES (?, (SELECT COUNT(*) FROM rooms), ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM rooms)) "
+            "ON CONFLICT(room_id) DO UPDATE SET data = excluded.data, version = excluded.version",
+            [(room["room_id"], json.dumps(room)) for room in updates],
+        )
+
+    def rooms_version(self):
+        return self._conn().execute("SELECT COALESCE(MAX(version), 0) FROM rooms").fetchone()[0]
+
+
+def migrate_json_to_sqlite(data_dir: str = DATA_DIR, db_path: str = SQLITE_PATH):
+    """One-shot import of the JSON files into a SQLite database."""
+    source = JsonStorage(data_dir)
+    target = SqliteStorage(db_path, personas_file=source.personas_file)
+    counts = {"users": 0, "swipes": 0, "matches": 0, "rooms": 0}
+    with closing(target), target.transaction():
+        for email, data in source.all_users().items():
+            target.put_user(email, data)
+            counts["users"] += 1
+        for email, target_id, direction in source.iter_swipes():
+            counts["swipes"] += target.add_swipe(email, target_id, direction)
+        for key, data in source.all_matches().items():
+            target.put_match(key, data)
+            counts["matches"] += 1
+        for room in source.get_rooms():
+            target.put_room(room)
+            counts["rooms"] += 1
+    return counts
+
+
+def import_json_once(data_dir, db_path):
+    """Build `db_path` from the JSON files, moving it into place only once the import succeeded.
+
+    A failed import leaves no database behind, so the next start tries again
+    instead of serving an empty one.
+    """
+    tmp_path = db_path + ".importing"
+    for path in (tmp_path, tmp_path + "-wal", tmp_path + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)  # left by an import that was killed
+    try:
+        migrate_json_to_sqlite(data_dir, tmp_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, db_path)
+
+
+_storage = None
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "sqlite":
+            # The first start on a data directory imports its JSON files, so switching to
+            # the default keeps existing users; one worker imports while the others wait
+            with FileLock(SQLITE_PATH + ".migrate.lock"):
+                if not os.path.exists(SQLITE_PATH):
+                    import_json_once(DATA_DIR, SQLITE_PATH)
+            _storage = SqliteStorage(SQLITE_PATH)
+        elif STORAGE_BACKEND == "json":
+            _storage = JsonStorage(DATA_DIR)
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+    return _storage
+
+
+if __name__ == "__main__":
+    # Usage: python -m backend.storage migrate [data_dir] [db_path]
+    #        python -m backend.storage compact [data_dir]
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    data_dir = sys.argv[2] if len(sys.argv) > 2 else DATA_DIR
+    if command == "migrate":
+        db_path = sys.argv[3] if len(sys.argv) > 3 else SQLITE_PATH
+        print(migrate_json_to_sqlite(data_dir, db_path))
+    elif command == "compact":
+        JsonStorage(data_dir).compact_swipes()
+    else:
+        print("usage: python -m backend.storage migrate [data_dir] [db_path] | compact [data_dir]")
+        sys.exit(1)
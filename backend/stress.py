@@ -0,0 +1,261 @@
+# stress.py
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+
+from backend.match_events import PENDING, match_key
+from backend.storage import JsonStorage, SqliteStorage, migrate_json_to_sqlite
+from backend.synthetic import PASSWORD, TRAIT_VALUES, generate, write_dataset
+from backend.trait_queue import TraitQueue
+
+CALL_CODE = re.compile(r'data-call-code="(\d+)"')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_plan(dataset, active, swipes, pairs, clients, seed):
+    """Per-client scripts of sessions: traits for each user, random swipes, and mutual likes split across clients.
+
+    User i is driven by client i % clients and paired with user i + 1, so the
+    two halves of every new pair arrive through different client processes
+    (and, usually, different server workers).
+    """
+    rng = random.Random(seed)
+    emails = list(dataset["users"])[:active]
+    seen = {email: set(s["liked"]) | set(s["disliked"]) | {email} for email, s in dataset["swipes"].items()}
+    candidate_ids = [persona["id"] for persona in dataset["personas"]] + list(dataset["users"])
+    partners = {}
+    for i in range(0, min(2 * pairs, active - 1), 2):
+        a, b = emails[i], emails[i + 1]
+        if b not in seen[a] and a not in seen[b]:
+            partners[a], partners[b] = b, a
+
+    scripts = [[] for _ in range(clients)]
+    for i, email in enumerate(emails):
+        # Random swipes are all left, so the planned pairs are the only new mutual likes
+        targets = [t for t in rng.sample(candidate_ids, swipes + len(seen[email]) + 2) if t not in seen[email] and t not in partners.values()]
+        moves = [(target, "left") for target in targets[:swipes]]
+        if email in partners:
+            # Both halves of a pair open with the like, so the two arrive at about the same time
+            moves.insert(0, (partners[email], "right"))
+        # Retry a few swipes, as a client would after a timeout
+        moves += rng.sample(moves, min(3, len(moves)))
+        traits = {trait: rng.choice(values) for trait, values in TRAIT_VALUES.items()}
+        scripts[i % clients].append({"email": email, "moves": moves, "traits": traits, "call_id": f"stress-{seed}-{i}"})
+    return scripts, partners
+
+
+async def run_session(client, session, sent, errors):
+    email = session["email"]
+    await client.post("/login", data={"email": email, "password": PASSWORD})
+    # Traits arrive the way the voice agent sends them: no user, only the call code the user read out
+    found = CALL_CODE.search((await client.get("/traits")).text)
+    if not found:
+        errors.append(f"{email}: /traits has no call code")
+        return
+    variables = {**session["traits"], "call_code": found.group(1)}
+    payload = {"call_id": session["call_id"],
+               "extracted_variables": [{"key": key, "value": value} for key, value in variables.items()]}
+    for _ in range(2):  # the second delivery must be ignored
+        response = await client.post("/receive_traits", json=payload)
+        if response.status_code not in (200, 202):
+            errors.append(f"{email}: /receive_traits {response.status_code}")
+    for n, (target, direction) in enumerate(session["moves"]):
+        response = await client.post("/swipe", json={"target": target, "direction": direction})
+        if response.status_code == 200:
+            sent.append((email, target, direction))
+        else:
+            errors.append(f"{email}: /swipe {response.status_code}")
+        if n % 5 == 0:
+            response = await client.get("/ranked-matches", params={"limit": 10})
+            if response.status_code != 200:
+                errors.append(f"{email}: /ranked-matches {response.status_code}")
+
+
+async def run_script(base_url, script):
+    sent, errors = [], []
+    clients = [httpx.AsyncClient(base_url=base_url, timeout=120) for _ in script]
+    await asyncio.gather(*(run_session(client, session, sent, errors) for client, session in zip(clients, script)))
+    for client in clients:
+        await client.aclose()
+    return sent, errors
+
+
+def client_process(args):
+    base_url, script = args
+    return asyncio.run(run_script(base_url, script))
+
+
+def open_storage(data_dir, backend):
+    if backend == "sqlite":
+        return SqliteStorage(os.path.join(data_dir, "matchmyvibe.db"), personas_file=os.path.join(data_dir, "personas.json"))
+    return JsonStorage(data_dir)
+
+
+def start_server(data_dir, backend, workers, port, log):
+    env = dict(os.environ, DATA_DIR=data_dir, STORAGE_BACKEND=backend, LOG_LEVEL="WARNING",
+               SQLITE_PATH=os.path.join(data_dir, "matchmyvibe.db"), TRAIT_QUEUE_PATH=os.path.join(data_dir, "trait_queue.db"))
+    # uvicorn reports a worker it had to restart only at info level
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "info", "--no-access-log"],
+        env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    # Every worker builds its indexes before accepting connections; wait until a run of requests succeeds
+    deadline = time.monotonic() + 120
+    ok = 0
+    while ok < 4 * workers:
+        if time.monotonic() > deadline or server.poll() is not None:
+            server.kill()
+            raise RuntimeError("server did not start")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/login", timeout=5).raise_for_status()
+            ok += 1
+        except httpx.HTTPError:
+            ok = 0
+            time.sleep(0.2)
+    return server
+
+
+def server_failures(log_path):
+    """Worker restarts and tracebacks in the server's log; a worker that died may have been replaced without a failed request."""
+    with open(log_path) as f:
+        lines = f.read().splitlines()
+    died = [line for line in lines if "died" in line or "failed to start" in line]
+    # The exception itself is the first unindented line after each traceback header
+    errors = [next((l for l in lines[i + 1:] if not l.startswith(" ")), line) for i, line in enumerate(lines) if line.startswith("Traceback")]
+    return [f"server: {line.strip()}" for line in died + errors]
+
+
+def wait_until_settled(storage, queue, timeout=120):
+    """Wait for the trait queue to drain and every match to leave "pending"."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        pending = [key for key, match in storage.all_matches().items() if match.get("status") == PENDING]
+        if not pending and queue.depth() == 0:
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def verify(storage, queue, dataset, partners, scripts, sent):
+    """Everything the clients did, checked against storage directly."""
+    problems = []
+    swipes = storage.all_swipes()
+    stored = {(user, target, "right" if key == "liked" else "left") for user, s in swipes.items() for key in ("liked", "disliked") for target in s[key]}
+    lost = set(sent) - stored
+    if lost:
+        problems.append(f"{len(lost)} acknowledged swipes were lost, e.g. {sorted(lost)[:3]}")
+
+    matches = storage.all_matches()
+    missing = {match_key(a, b) for a, b in partners.items()} - set(matches)
+    if missing:
+        problems.append(f"{len(missing)} mutual likes have no match, e.g. {sorted(missing)[:3]}")
+    pending = [key for key, match in matches.items() if match.get("status") == PENDING]
+    if pending:
+        problems.append(f"{len(pending)} matches still pending")
+    unexpected = set(matches) - set(dataset["matches"]) - {match_key(a, b) for a, b in partners.items()}
+    if unexpected:
+        problems.append(f"{len(unexpected)} matches without a mutual like, e.g. {sorted(unexpected)[:3]}")
+
+    users = storage.all_users()
+    placed = Counter()
+    for room in storage.get_rooms():
+        emails = [occupant["email"] for occupant in room.get("occupants", []) if occupant.get("email")]
+        if len(room.get("occupants", [])) > room.get("capacity", 1):
+            problems.append(f"room {room['room_id']} holds {len(room['occupants'])} of {room.get('capacity', 1)}")
+        for email in emails:
+            placed[email] += 1
+            if users.get(email, {}).get("assigned_room") != room["room_id"]:
+                problems.append(f"{email} sits in {room['room_id']} but is assigned to {users.get(email, {}).get('assigned_room')}")
+    problems += [f"{email} sits in {count} rooms" for email, count in placed.items() if count > 1]
+    problems += [f"{email} is assigned to {user['assigned_room']} but not in it" for email, user in users.items() if user.get("assigned_room") and not placed[email]]
+    for a, b in partners.items():
+        room_id = matches.get(match_key(a, b), {}).get("room")
+        if room_id and users[a].get("assigned_room") != room_id:
+            problems.append(f"match {match_key(a, b)} is in {room_id} but {a} is not")
+
+    sessions = [session for script in scripts for session in script]
+    wrong = [s["email"] for s in sessions if any(users[s["email"]]["traits"].get(k) != v for k, v in s["traits"].items())]
+    if wrong:
+        problems.append(f"{len(wrong)} users did not get the traits from their own call, e.g. {wrong[:3]}")
+    applied = queue._conn().execute("SELECT COUNT(*) FROM deliveries WHERE outcome = 'applied'").fetchone()[0]
+    if applied != len(sessions):
+        problems.append(f"{applied} trait deliveries applied for {len(sessions)} calls")
+
+    assigned = sum(1 for key in {match_key(a, b) for a, b in partners.items()} if matches.get(key, {}).get("room"))
+    return problems, {"swipes_sent": len(sent), "new_pairs": len(partners) // 2, "pairs_placed": assigned, "matches": len(matches)}
+
+
+def run(args):
+    dataset = generate(args.users, args.rooms, args.personas, args.history, args.seed)
+    scripts, partners = make_plan(dataset, args.active, args.swipes, args.pairs, args.clients, args.seed)
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_dataset(data_dir, dataset)
+        if args.backend == "sqlite":
+            migrate_json_to_sqlite(data_dir, os.path.join(data_dir, "matchmyvibe.db"))
+        port = free_port()
+        log_path = os.path.join(data_dir, "server.log")
+        log = open(log_path, "w")
+        server = start_server(data_dir, args.backend, args.workers, port, log)
+        start = time.perf_counter()
+        try:
+            with multiprocessing.Pool(args.clients) as pool:
+                results = pool.map(client_process, [(f"http://127.0.0.1:{port}", script) for script in scripts])
+            storage, queue = open_storage(data_dir, args.backend), TraitQueue(os.path.join(data_dir, "trait_queue.db"))
+            settled = wait_until_settled(storage, queue)
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait(timeout=60)
+            log.close()
+
+        sent = [swipe for script_sent, _ in results for swipe in script_sent]
+        errors = [error for _, script_errors in results for error in script_errors]
+        problems, counts = verify(storage, queue, dataset, partners, scripts, sent)
+        if not settled:
+            problems.append("trait queue or match assignment did not settle")
+        problems += server_failures(log_path)
+        return {"backend": args.backend, "workers": args.workers, "clients": args.clients, **counts,
+                "seconds": round(elapsed, 2), "errors": errors[:10], "problems": problems[:20], "ok": not errors and not problems}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive a multi-worker server from several client processes and check nothing was lost.")
+    parser.add_argument("--workers", type=int, default=4, help="uvicorn worker processes")
+    parser.add_argument("--clients", type=int, default=4, help="client processes")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="sqlite")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--rooms", type=int, default=40, help="few rooms, so workers compete for the last beds")
+    parser.add_argument("--personas", type=int, default=10)
+    parser.add_argument("--history", type=int, default=5, help="swipes per user already in the dataset")
+    parser.add_argument("--active", type=int, default=120, help="users driving traffic")
+    parser.add_argument("--swipes", type=int, default=15, help="swipes per active user")
+    parser.add_argument("--pairs", type=int, default=50, help="new mutual likes, sent from different clients")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# swipe_index.py
+
+EMPTY = frozenset()
+
+
+class SwipeIndex:
+    """In-memory liked/disliked sets per user plus a reverse "who liked me" index.
+
+    Built once by replaying the swipe log from storage, then kept up to date on
+    every /swipe, so seen-profile and mutual-like checks are set lookups.
+    """
+
+    def __init__(self):
+        self.liked = {}
+        self.disliked = {}
+        self.liked_by = {}
+
+    @classmethod
+    def replay(cls, swipe_events):
+        index = cls()
+        for user, target, direction in swipe_events:
+            index.record(user, target, direction)
+        return index
+
+    def record(self, user, target, direction) -> bool:
+        """Add a swipe. Returns False if it was already recorded."""
+        if direction == "right":
+            liked = self.liked.setdefault(user, set())
+            if target in liked:
+                return False
+            liked.add(target)
+            self.liked_by.setdefault(target, set()).add(user)
+            return True
+        if direction == "left":
+            disliked = self.disliked.setdefault(user, set())
+            if target in disliked:
+                return False
+            disliked.add(target)
+            return True
+        return False
+
+    def seen(self, user):
+        return self.liked.get(user, EMPTY) | self.disliked.get(user, EMPTY)
+
+    def likes(self, user, target) -> bool:
+        return target in self.liked.get(user, EMPTY)
+
+    def is_mutual(self, user, target) -> bool:
+        return self.likes(user, target) and target in self.liked_by.get(user, EMPTY)
@@ -0,0 +1,117 @@
+# synthetic.py
+
+import argparse
+import hashlib
+import json
+import os
+import random
+
+from backend.match_events import NO_ROOM, match_key
+from backend.matcher import calculate_life_path_number
+from backend.storage import save_json_file
+
+TRAIT_VALUES = {
+    "daily_rhythm": ["morning", "night"],
+    "lifestyle": ["social", "chill"],
+    "study_habits": ["quiet", "collab"],
+    "room_vibe": ["cozy", "minimal", "maximal"],
+    "conflict_style": ["direct", "avoidant"],
+}
+VIBES = ["Night owl, plays guitar", "Gym rat, early riser", "Bookworm, tea over coffee", "Gamer, chill weekends", "Plant mom, neat freak", ""]
+PASSWORD = "password"  # every generated user logs in with this
+FILLER = "honestly i think it depends but mostly i would say that on most days yeah".split()
+
+
+def generate(n_users, n_rooms, n_personas=10, swipes_per_user=20, seed=0):
+    """Seeded users, personas, rooms, swipes and matches in the backend/data schemas.
+
+    A fifth of the users come in mutually-liked pairs; those pairs are also
+    returned in `pairs` and stored as matches with status NO_ROOM, which the
+    allocator places like any other match without a room.
+    """
+    rng = random.Random(seed)
+    password_hash = hashlib.sha256(PASSWORD.encode()).hexdigest()
+
+    def profile(name):
+        dob = f"{rng.randint(1995, 2007)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        return {
+            "name": name,
+            "dob": dob,
+            "life_path": calculate_life_path_number(dob),
+            "vibe": rng.choice(VIBES),
+            "traits": {trait: rng.choice(values) for trait, values in TRAIT_VALUES.items()},
+            "room_preferences": {"room_type": rng.choice(["single", "twin", "triple"]), "floor": rng.randint(0, 3), "has_window": rng.random() < 0.5},
+        }
+
+    users = {}
+    for i in range(n_users):
+        user = profile(f"User {i}")
+        user["password"] = password_hash
+        user["assigned_room"] = None
+        users[f"user{i}@example.com"] = user
+    personas = [{"id": f"persona_{i}", **profile(f"Persona {i}")} for i in range(n_personas)]
+
+    rooms = []
+    for r in range(n_rooms):
+        capacity = rng.choice([1, 2, 2, 3, 4])
+        room_type = {1: "single", 2: "twin"}.get(capacity, "triple")
+        occupants = [profile(f"Occupant {r}-{o}") for o in range(rng.randint(0, capacity - 1))]
+        rooms.append({"room_id": f"R{r}", "type": room_type, "room_type": room_type, "capacity": capacity, "floor": rng.randint(0, 3), "has_window": rng.random() < 0.5, "occupants": occupants})
+
+    emails = list(users)
+    rng.shuffle(emails)
+    pairs = [(emails[i], emails[i + 1]) for i in range(0, n_users // 5, 2)]
+    swipes = {email: {"liked": [], "disliked": []} for email in users}
+    for a, b in pairs:
+        swipes[a]["liked"].append(b)
+        swipes[b]["liked"].append(a)
+
+    # Random swipes never like a user back, so the pairs above are the only mutual likes
+    candidate_ids = [persona["id"] for persona in personas] + emails
+    for email in users:
+        seen = set(swipes[email]["liked"]) | {email}
+        targets = rng.sample(candidate_ids, min(swipes_per_user + len(seen), len(candidate_ids)))
+        for target in [t for t in targets if t not in seen][:swipes_per_user]:
+            liked = target.startswith("persona_") and rng.random() < 0.5
+            swipes[email]["liked" if liked else "disliked"].append(target)
+
+    matches = {match_key(a, b): {"room": None, "score": None, "status": NO_ROOM} for a, b in pairs}
+    return {"users": users, "personas": personas, "rooms": rooms, "swipes": swipes, "matches": matches, "pairs": pairs}
+
+
+def transcript(rng, traits, questions):
+    """A made-up voice-call transcript: two keywords per trait value in `traits`, shuffled into filler words."""
+    words = []
+    for question in questions:
+        value = traits.get(question["trait"])
+        if value in question["keywords"]:
+            words += rng.sample(question["keywords"][value], 2)
+    words += rng.choices(FILLER, k=3 * len(words) + 5)
+    rng.shuffle(words)
+    return " ".join(words)
+
+
+def write_dataset(data_dir, dataset):
+    """Write a generated dataset as the JSON files the app reads from `data_dir`."""
+    os.makedirs(data_dir, exist_ok=True)
+    for name in ("users", "personas", "rooms", "swipes", "matches"):
+        save_json_file(os.path.join(data_dir, f"{name}.json"), dataset[name])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a seeded synthetic dataset in the backend/data format.")
+    parser.add_argument("data_dir")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rooms", type=int, default=300)
+    parser.add_argument("--personas", type=int, default=10)
+    parser.add_argument("--swipes", type=int, default=20, help="swipes per user")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    dataset = generate(args.users, args.rooms, args.personas, args.swipes, args.seed)
+    write_dataset(args.data_dir, dataset)
+    print(json.dumps({name: len(dataset[name]) for name in ("users", "personas", "rooms", "swipes", "matches")}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# trait_classifier.py
+
+import argparse
+import hashlib
+import json
+import os
+from collections import Counter, deque
+
+from backend.storage import DATA_DIR, load_json_file
+
+QUESTIONS_FILE = os.path.join(DATA_DIR, "questions.json")
+
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton over a fixed set of keywords.
+
+    Built once; `find` then reports every whole-word, case-insensitive
+    occurrence of every keyword in one pass over the text, however many
+    keywords there are. Transitions are precomputed for every state, so the
+    scan is a single dict lookup per character.
+    """
+
+    def __init__(self, keywords):
+        """`keywords` maps each keyword to the payload `find` reports for it."""
+        goto, outputs = [{}], [[]]
+        for keyword, payload in keywords.items():
+            state = 0
+            for char in keyword.lower():
+                if char not in goto[state]:
+                    goto[state][char] = len(goto)
+                    goto.append({})
+                    outputs.append([])
+                state = goto[state][char]
+            outputs[state].append((len(keyword), payload))
+
+        # Breadth-first, so a state's failure link (its longest proper suffix that is
+        # also a keyword prefix) is complete before its children need it
+        self._delta = [dict(goto[0])]
+        self._delta.extend({} for _ in range(len(goto) - 1))
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            outputs[state] = outputs[state] + outputs[fail[state]]
+            # Missing transitions follow the failure link's (already complete) row
+            self._delta[state] = {**self._delta[fail[state]], **goto[state]}
+            for char, child in goto[state].items():
+                fail[child] = self._delta[fail[state]].get(char, 0)
+                queue.append(child)
+        self._outputs = [tuple(out) for out in outputs]
+        self._steps = [row.get for row in self._delta]
+
+    def __len__(self):
+        return len(self._delta)
+
+    def find(self, text):
+        """[(start, end, payload)] for each whole-word keyword occurrence, in order of `end`."""
+        text = text.lower()
+        steps, outputs = self._steps, self._outputs
+        found = []
+        state = 0
+        for end, char in enumerate(text, 1):
+            state = steps[state](char, 0)
+            if outputs[state]:
+                if end < len(text) and text[end].isalnum():
+                    continue
+                for length, payload in outputs[state]:
+                    start = end - length
+                    if start == 0 or not text[start - 1].isalnum():
+                        found.append((start, end, payload))
+        return found
+
+
+class TraitClassifier:
+    """Maps free-text answers to trait values using the keyword lists in questions.json.
+
+    Each keyword occurrence is a vote for the trait values it is listed
+    under; a trait gets the value with the most votes, and is left out when
+    nothing matched or the top values tie.
+    """
+
+    def __init__(self, questions):
+        self.questions = questions
+        self.values = {}
+        self._question_traits = {}
+        keywords = {}
+        for question in questions:
+            trait = question["trait"]
+            self.values[trait] = list(question["keywords"])
+            self._question_traits[str(question.get("id"))] = trait
+            for value, words in question["keywords"].items():
+                for word in words:
+                    keywords.setdefault(word.lower(), []).append((trait, value))
+        # "friends" or "talk" vote in more than one trait
+        self.automaton = KeywordAutomaton({word: tuple(votes) for word, votes in keywords.items()})
+
+    @classmethod
+    def from_file(cls, path=QUESTIONS_FILE):
+        return cls(load_json_file(path))
+
+    def votes(self, text, trait=None) -> Counter:
+        """Keyword hits per (trait, value) in `text`, only for `trait` if given."""
+        votes = Counter()
+        for _, _, payload in self.automaton.find(text):
+            for vote in payload:
+                if trait is None or vote[0] == trait:
+                    votes[vote] += 1
+        return votes
+
+    def classify(self, text, trait=None):
+        """{trait: value} for the traits `text` clearly points at."""
+        by_trait = {}
+        for (vote_trait, value), count in self.votes(text, trait).items():
+            by_trait.setdefault(vote_trait, []).append((count, value))
+        traits = {}
+        for vote_trait, counts in by_trait.items():
+            counts.sort(reverse=True)
+            if len(counts) == 1 or counts[0][0] > counts[1][0]:
+                traits[vote_trait] = counts[0][1]
+        return traits
+
+    def classify_answers(self, answers):
+        """Classify {trait or question id: answer}; each answer only decides its own trait."""
+        traits = {}
+        for key, text in answers.items():
+            trait = self._question_traits.get(str(key), key)
+            if trait not in self.values:
+                raise ValueError(f"unknown trait or question: {key}")
+            if not isinstance(text, str):
+                raise ValueError(f"answer to {key} is not text")
+            traits.update(self.classify(text, trait))
+        return traits
+
+    def classify_batch(self, transcripts):
+        """Classify each transcript: a whole-call string, or a dict of answers per trait or question id."""
+        results = []
+        for transcript in transcripts:
+            if isinstance(transcript, str):
+                results.append(self.classify(transcript))
+            elif isinstance(transcript, dict):
+                results.append(self.classify_answers(transcript))
+            else:
+                raise ValueError("each transcript must be a string or an object of answers")
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify transcripts offline, e.g. to backfill or re-classify users' traits.")
+    parser.add_argument("transcripts", help='JSON lines of {"email": ..., "transcript": text or {trait: answer}}')
+    parser.add_argument("--questions", default=QUESTIONS_FILE)
+    parser.add_argument("--enqueue", action="store_true", help="queue the traits for the app's trait worker to apply")
+    args = parser.parse_args()
+
+    classifier = TraitClassifier.from_file(args.questions)
+    if args.enqueue:
+        from backend.trait_queue import TraitQueue
+        queue = TraitQueue()
+    with open(args.transcripts) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            traits = classifier.classify_batch([record["transcript"]])[0]
+            if args.enqueue and traits:
+                # Keyed by content, so re-running the same file queues nothing new
+                delivery = "classifier:" + hashlib.sha256(line.strip().encode()).hexdigest()
+                queue.enqueue(delivery, record["email"], traits)
+            print(json.dumps({"email": record.get("email"), "traits": traits}))
+
+
+if __name__ == "__main__":
+    main()
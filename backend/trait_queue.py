@@ -0,0 +1,190 @@
+# trait_queue.py
+
+import hashlib
+import json
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+
+from backend.concurrency import FileLock
+from backend.storage import DATA_DIR
+
+TRAIT_QUEUE_PATH = os.getenv("TRAIT_QUEUE_PATH", os.path.join(DATA_DIR, "trait_queue.db"))
+QUEUE_RETENTION = 7 * 24 * 3600  # seconds an applied delivery is remembered for redelivery checks
+CALL_WINDOW = 30 * 60  # seconds a voice call opened from /traits can be matched to a webhook without its ref
+CALL_CODE_DIGITS = 6  # length of the code the user reads out to the voice agent
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    delivery_id TEXT NOT NULL UNIQUE,
+    email TEXT NOT NULL,
+    traits TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    applied_at REAL,
+    outcome TEXT
+);
+CREATE INDEX IF NOT EXISTS deliveries_pending ON deliveries (applied_at, seq);
+CREATE TABLE IF NOT EXISTS calls (
+    ref TEXT PRIMARY KEY,
+    email TEXT NOT NULL,
+    opened_at REAL NOT NULL,
+    closed_at REAL,
+    code TEXT
+);
+CREATE INDEX IF NOT EXISTS calls_open ON calls (closed_at, opened_at);
+"""
+
+
+def normalize_call_code(value):
+    """The digits of a call code as transcribed ("482 913", "482-913"), or None if it is not one."""
+    digits = re.sub(r"\D", "", str(value or ""))
+    return digits if len(digits) == CALL_CODE_DIGITS else None
+
+
+def call_id(payload):
+    """The id the voice agent sends with each webhook, or None if it sent none."""
+    for key in ("call_id", "id", "delivery_id"):
+        if payload.get(key):
+            return str(payload[key])
+    return None
+
+def delivery_id(payload, email):
+    """The webhook's call id, or else a hash of its body and the user it was resolved to.
+
+    The agent may send nothing but the extracted answers, and two users can
+    give the same ones; without the user in the hash the second would be
+    dropped as a redelivery of the first.
+    """
+    return call_id(payload) or hashlib.sha256(json.dumps([email, payload], sort_keys=True).encode()).hexdigest()
+
+def coalesce(deliveries):
+    """Merge queued (seq, email, traits) in arrival order into {email: traits}; later values win."""
+    merged = {}
+    for _, email, traits in deliveries:
+        merged.setdefault(email, {}).update(traits)
+    return merged
+
+
+class TraitQueue:
+    """Durable SQLite queue of trait webhooks waiting to be written to user records.
+
+    A delivery is stored once per delivery_id, so a redelivered webhook is
+    acknowledged without being applied twice. It also records the voice calls
+    opened from /traits, which is how a webhook is traced back to its user.
+    Every worker process shares the database; `lock` keeps two of them from
+    applying the same deliveries.
+    """
+
+    def __init__(self, db_path: str = TRAIT_QUEUE_PATH):
+        self.db_path = db_path
+        self.lock = FileLock(db_path + ".lock")
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        # Queues created before calls had a spoken code. Every worker opens the queue at
+        # startup, so check and alter under one write lock or two of them add the column
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if "code" not in {row[1] for row in conn.execute("PRAGMA table_info(calls)")}:
+                conn.execute("ALTER TABLE calls ADD COLUMN code TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS calls_by_code ON calls (code, opened_at)")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, delivery_id, email, traits) -> bool:
+        """Store a delivery. Returns False if this delivery_id was already received."""
+        cur = self._conn().execute(
+            "INSERT OR IGNORE INTO deliveries (delivery_id, email, traits, received_at) VALUES (?, ?, ?, ?)",
+            (delivery_id, email, json.dumps(traits), time.time()),
+        )
+        return cur.rowcount > 0
+
+    def known(self, delivery_id) -> bool:
+        return self._conn().execute("SELECT 1 FROM deliveries WHERE delivery_id = ?", (delivery_id,)).fetchone() is not None
+
+    def pending(self, limit=500):
+        """Oldest unapplied deliveries as (seq, email, traits)."""
+        rows = self._conn().execute(
+            "SELECT seq, email, traits FROM deliveries WHERE applied_at IS NULL ORDER BY seq LIMIT ?", (limit,)
+        )
+        return [(seq, email, json.loads(traits)) for seq, email, traits in rows]
+
+    def mark_applied(self, outcomes):
+        """Record {seq: outcome} for applied deliveries and forget ones past QUEUE_RETENTION."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "UPDATE deliveries SET applied_at = ?, outcome = ? WHERE seq = ?",
+            [(now, outcome, seq) for seq, outcome in outcomes.items()],
+        )
+        conn.execute("DELETE FROM deliveries WHERE applied_at < ?", (now - QUEUE_RETENTION,))
+        conn.execute("COMMIT")
+
+    def depth(self):
+        return self._conn().execute("SELECT COUNT(*) FROM deliveries WHERE applied_at IS NULL").fetchone()[0]
+
+    # --- Calls ---
+    def open_call(self, email, window=CALL_WINDOW):
+        """Record a voice call about to start for `email`; returns (ref, code).
+
+        The ref is for integrations that can pass it to the webhook. The code
+        is short enough for the user to read out, and is unique among the
+        calls opened in the last `window` seconds.
+        """
+        ref = secrets.token_urlsafe(16)
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            while True:
+                code = f"{secrets.randbelow(10 ** CALL_CODE_DIGITS):0{CALL_CODE_DIGITS}d}"
+                if not conn.execute("SELECT 1 FROM calls WHERE code = ? AND opened_at > ?", (code, now - window)).fetchone():
+                    break
+            conn.execute("INSERT INTO calls (ref, email, opened_at, code) VALUES (?, ?, ?, ?)", (ref, email, now, code))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return ref, code
+
+    def resolve_call(self, ref):
+        row = self._conn().execute("SELECT email FROM calls WHERE ref = ?", (ref,)).fetchone()
+        return row[0] if row else None
+
+    def resolve_code(self, code, window=CALL_WINDOW):
+        """The user of the call opened with `code` in the last `window` seconds; codes are reused after that."""
+        row = self._conn().execute(
+            "SELECT email FROM calls WHERE code = ? AND opened_at > ? ORDER BY opened_at DESC LIMIT 1", (code, time.time() - window)
+        ).fetchone()
+        return row[0] if row else None
+
+    def sole_open_call(self, window=CALL_WINDOW):
+        """The user of the open calls from the last `window` seconds, or None unless they all belong to one user."""
+        rows = self._conn().execute(
+            "SELECT DISTINCT email FROM calls WHERE closed_at IS NULL AND opened_at > ? LIMIT 2", (time.time() - window,)
+        ).fetchall()
+        return rows[0][0] if len(rows) == 1 else None
+
+    def close_calls(self, email):
+        """Close `email`'s open calls once its webhook arrived, and forget calls past QUEUE_RETENTION."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("UPDATE calls SET closed_at = ? WHERE email = ? AND closed_at IS NULL", (now, email))
+        conn.execute("DELETE FROM calls WHERE opened_at < ?", (now - QUEUE_RETENTION,))
+        conn.execute("COMMIT")
@@ -16,6 +16,8 @@ response = client.agent.create(
     context_breakdown=[
                 {"title": "Introduction and Purpose Statement", "body": """ Hi! I'm Misha, your Gen-Z friendly onboarding assistant at MatchMyVibe. I'll be asking you a few quick questions to help find you the perfect roommate and living space. Let's dive in, shall we? """ , 
                 "is_enabled" : True},
+                {"title": "Call Code", "body": """ Before the questions, ask the user to read out the 6-digit call code shown on their screen, and repeat it back to confirm. It tells us whose answers these are. """ , 
+                "is_enabled" : True},
                 {"title": "Understanding Daily Rhythms", "body": """ When do you feel most productive – early in the morning or late at night? Your answer will help us understand your daily rhythm. Feel free to use words like 'sunrise' or 'after dark'. """ , 
                 "is_enabled" : True},
                 {"title": "Lifestyle Preferences", "body": """ How do you prefer to spend your weekends? Are you all about the party life, or do you enjoy a chill weekend binge-watching your favorite shows? This helps us capture your lifestyle preference. """ , 
@@ -60,6 +62,7 @@ response = client.agent.create(
             {"key": "lifestyle", "prompt": "Classify and extract the trait based on weekend preferences using keywords like 'social' or 'chill'."},
             {"key": "study_habits", "prompt": "Classify and extract the trait regarding study setup preferences using keywords like 'quiet' or 'collab'."},
             {"key": "room_vibe", "prompt": "Classify and extract the trait based on room environment preferences using keywords like 'minimal', 'cozy', or 'maximal'."},
+            {"key": "call_code", "prompt": "Extract the 6-digit call code the user read out from their screen, digits only."},
             {"key": "conflict_style", "prompt": "Classify and extract the trait from conflict handling strategies using keywords like 'direct' or 'avoidant'."},
             ]
         }
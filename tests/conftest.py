@@ -0,0 +1,28 @@
+import atexit
+import glob
+import os
+import shutil
+import tempfile
+
+import pytest
+
+# The backend reads DATA_DIR when it is first imported, so this has to run before any test
+# module imports it: the app then serves a scratch copy of backend/data and never writes there
+DATA_DIR = tempfile.mkdtemp(prefix="mmv-tests-")
+for path in glob.glob(os.path.join(os.path.dirname(__file__), "..", "backend", "data", "*.json")):
+    shutil.copy(path, DATA_DIR)
+os.environ.update(DATA_DIR=DATA_DIR, STORAGE_BACKEND="sqlite", LOG_LEVEL="WARNING")
+for name in ("SQLITE_PATH", "TRAIT_QUEUE_PATH", "RECIPROCAL_DIR", "PROFILING"):
+    os.environ.pop(name, None)
+atexit.register(shutil.rmtree, DATA_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def client():
+    """A TestClient on the app, with its lifespan (index builds and queue workers) running."""
+    from fastapi.testclient import TestClient
+
+    from backend.main import app
+
+    with TestClient(app) as client:
+        yield client
@@ -0,0 +1,62 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from backend.allocator import EPSILON, allocate, assign
+from backend.synthetic import generate
+
+
+def best_total(benefit, person_class, capacity):
+    """The best total benefit over every placement that fills as many beds as possible."""
+    placed = min(len(person_class), int(sum(capacity)))
+    best = None
+    for choice in itertools.product(range(-1, benefit.shape[1]), repeat=len(person_class)):
+        groups = [g for g in choice if g >= 0]
+        if len(groups) != placed or (np.bincount(groups, minlength=benefit.shape[1]) > capacity).any():
+            continue
+        total = sum(benefit[person_class[i], g] for i, g in enumerate(choice) if g >= 0)
+        best = total if best is None else max(best, total)
+    return best
+
+
+def check(benefit, person_class, capacity):
+    result = assign(benefit, person_class, capacity)
+    placed = result[result >= 0]
+    assert len(placed) == min(len(person_class), int(sum(capacity)))
+    assert (np.bincount(placed, minlength=benefit.shape[1]) <= capacity).all()
+    total = sum(benefit[person_class[i], g] for i, g in enumerate(result) if g >= 0)
+    assert total >= best_total(benefit, person_class, capacity) - len(person_class) * EPSILON - 1e-9
+    return result
+
+
+def test_prices_from_an_earlier_round_do_not_stick():
+    benefit = np.array([[0.9, 6.3, 9.8], [4.2, 1.1, 9.6], [6.8, 2.0, 6.7]])
+    assert check(benefit, np.array([1, 2]), [1, 1, 1]).tolist() == [2, 0]
+
+
+def test_identical_people_share_a_group_with_room():
+    benefit = np.array([[1.1, 6.2, 4.1]])
+    assert sorted(check(benefit, np.array([0, 0]), [2, 1, 1]).tolist()) == [1, 2]
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_matches_brute_force(seed):
+    # Both directions: people bidding when beds are plentiful, beds bidding when they are scarce
+    rng = np.random.default_rng(seed)
+    for _ in range(300):
+        n_classes, n_groups, n_people = rng.integers(1, 4), rng.integers(1, 4), rng.integers(1, 7)
+        benefit = np.round(rng.random((n_classes, n_groups)) * 10, 1)
+        check(benefit, rng.integers(0, n_classes, n_people), rng.integers(0, 3, n_groups))
+
+
+def test_allocate_places_pairs_together_within_capacity():
+    dataset = generate(300, 60, swipes_per_user=0)
+    assignment = allocate(dataset["users"], dataset["rooms"], dataset["pairs"])
+    rooms = {room["room_id"]: room for room in dataset["rooms"]}
+    taken = {}
+    for room_id in assignment.values():
+        taken[room_id] = taken.get(room_id, 0) + 1
+    assert all(count <= rooms[room_id]["capacity"] - len(rooms[room_id]["occupants"]) for room_id, count in taken.items())
+    for a, b in dataset["pairs"]:
+        assert assignment.get(a) == assignment.get(b)
@@ -0,0 +1,70 @@
+import random
+
+import pytest
+
+from backend.scoring import CandidateMatrix, SignatureBuckets
+from backend.synthetic import generate
+
+
+def swiped(dataset, email):
+    swipes = dataset["swipes"].get(email, {})
+    return set(swipes.get("liked", [])) | set(swipes.get("disliked", [])) | {email}
+
+
+def pages(rank, user, seen, k, limit=None):
+    """Every page of `rank` for `user`, following the keyset cursor."""
+    result, after = [], None
+    while limit is None or len(result) < limit:
+        page = rank(user["traits"], user["dob"], exclude=seen, k=k, after=after)
+        if not page:
+            break
+        result.append(page)
+        after = (page[-1][1], page[-1][0])
+    return result
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_bucketed_pages_equal_exact_pages(seed):
+    dataset = generate(500, 0, swipes_per_user=20, seed=seed)
+    matrix = CandidateMatrix.from_sources(dataset["personas"], dataset["users"])
+    buckets = SignatureBuckets(matrix)
+    for email in random.Random(seed).sample(list(dataset["users"]), 20):
+        user = dataset["users"][email]
+        seen = swiped(dataset, email)
+        assert pages(buckets.top_k, user, seen, 20) == pages(matrix.top_k, user, seen, 20)
+        assert buckets.top_k(user["traits"], user["dob"], exclude=seen) == matrix.top_k(user["traits"], user["dob"], exclude=seen)
+
+
+def test_bucketed_recall_at_20():
+    dataset = generate(2000, 0, swipes_per_user=20, seed=0)
+    matrix = CandidateMatrix.from_sources(dataset["personas"], dataset["users"])
+    buckets = SignatureBuckets(matrix)
+    recalls = []
+    for email in random.Random(0).sample(list(dataset["users"]), 50):
+        user = dataset["users"][email]
+        seen = swiped(dataset, email)
+        for exact, got in zip(pages(matrix.top_k, user, seen, 20, limit=3), pages(buckets.top_k, user, seen, 20, limit=3)):
+            recalls.append(len(set(exact) & set(got)) / len(exact))
+    assert sum(recalls) / len(recalls) == 1.0
+
+
+def test_buckets_follow_matrix_changes():
+    dataset = generate(300, 0, swipes_per_user=0, seed=2)
+    matrix = CandidateMatrix.from_sources(dataset["personas"], dataset["users"])
+    buckets = SignatureBuckets(matrix)
+    emails = list(dataset["users"])
+    user = dataset["users"][emails[0]]
+
+    def same():
+        return pages(buckets.top_k, user, {emails[0]}, 25) == pages(matrix.top_k, user, {emails[0]}, 25)
+
+    assert same()
+    # Re-encoded rows move bucket
+    for email in emails[1:6]:
+        matrix.upsert(email, {**dataset["users"][email], "traits": dict(user["traits"])})
+    assert same()
+    # New rows, then a trait column nobody had before
+    matrix.upsert("new@example.com", {"dob": "2002-03-04", "traits": {"lifestyle": "chill"}})
+    assert same()
+    matrix.upsert("pets@example.com", {"dob": "2002-03-04", "traits": {**user["traits"], "pets": "cat"}})
+    assert same()
@@ -0,0 +1,69 @@
+import sys
+import threading
+import time
+
+import pytest
+
+from backend.profiling import SamplingProfiler
+
+
+@pytest.fixture
+def switch_interval():
+    original = sys.getswitchinterval()
+    sys.setswitchinterval(0.005)
+    yield 0.005
+    sys.setswitchinterval(original)
+
+
+def test_switch_interval_is_restored(switch_interval):
+    with SamplingProfiler(0.001):
+        assert sys.getswitchinterval() == pytest.approx(0.0005)
+    assert sys.getswitchinterval() == pytest.approx(switch_interval)
+
+
+def test_overlapping_profilers_restore_the_original_interval(switch_interval):
+    # Requests finish in any order: the first one out must not restore, and the last one out
+    # must not restore what the second one saw while the first was still running
+    first, second = SamplingProfiler(0.001), SamplingProfiler(0.004)
+    first.__enter__()
+    second.__enter__()
+    assert sys.getswitchinterval() == pytest.approx(0.0005)
+    first.__exit__(None, None, None)
+    assert sys.getswitchinterval() == pytest.approx(0.002)
+    second.__exit__(None, None, None)
+    assert sys.getswitchinterval() == pytest.approx(switch_interval)
+
+
+def test_concurrent_profilers_restore_the_original_interval(switch_interval):
+    barrier = threading.Barrier(8)
+
+    def profile(i):
+        barrier.wait()
+        with SamplingProfiler(0.001 * (i % 3 + 1)):
+            time.sleep(0.001 * (i % 4))
+
+    threads = [threading.Thread(target=profile, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sys.getswitchinterval() == pytest.approx(switch_interval)
+
+
+def test_samples_busy_threads(switch_interval):
+    stop = threading.Event()
+
+    def spin():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=spin, name="busy worker")
+    worker.start()
+    try:
+        with SamplingProfiler(0.001) as profiler:
+            time.sleep(0.1)
+    finally:
+        stop.set()
+        worker.join()
+    assert profiler.samples > 0
+    assert any(line.startswith("busy_worker;") and "test_profiling.py:spin" in line for line in profiler.folded().splitlines())
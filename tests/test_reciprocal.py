@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+from backend import reciprocal
+from backend.reciprocal import ReciprocalIndex
+from backend.scoring import CandidateMatrix
+from backend.synthetic import generate
+
+
+def live(matrix, user, seen, k, after):
+    return matrix.top_k(user["traits"], user["dob"], exclude=seen, k=k, after=after, raw=matrix.reciprocal_scores(user["traits"], user["dob"]))
+
+
+def assert_pages_equal_live(matrix, index, email, user, seen, k=20, pages=6):
+    """Page past the end of the stored list; every page must equal the live one at the same cursor."""
+    after = None
+    for _ in range(pages):
+        page = reciprocal.top_k(matrix, index, email, user, seen, k, after)
+        assert page == live(matrix, user, seen, k, after)
+        if not page:
+            break
+        after = (page[-1][1], page[-1][0])
+
+
+@pytest.fixture
+def built(tmp_path):
+    dataset = generate(300, 0, swipes_per_user=10, seed=0)
+    matrix = CandidateMatrix.from_sources(dataset["personas"], dataset["users"])
+    # A short list, so paging runs past it into the live continuation
+    reciprocal.build(matrix, dataset["users"], k=50, directory=str(tmp_path), processes=1)
+    return dataset, matrix, ReciprocalIndex.load(str(tmp_path))
+
+
+def seen_by(dataset, email):
+    swipes = dataset["swipes"].get(email, {})
+    return set(swipes.get("liked", [])) | set(swipes.get("disliked", [])) | {email}
+
+
+def test_precomputed_pages_equal_live_pages(built):
+    dataset, matrix, index = built
+    for email in random.Random(0).sample(list(dataset["users"]), 100):
+        assert_pages_equal_live(matrix, index, email, dataset["users"][email], seen_by(dataset, email))
+    assert index.hits > 0 and index.misses == 0
+
+
+def test_changed_and_new_candidates_after_the_build(built):
+    dataset, matrix, index = built
+    rng = random.Random(1)
+    emails = list(dataset["users"])
+    paged = rng.sample(emails, 100)
+    rest = [email for email in emails if email not in paged]
+    profiles = [(p["id"], p) for p in dataset["personas"]] + [(email, dataset["users"][email]) for email in rest]
+
+    # 40 changed candidates: half take a paged user's traits and climb lists, half lose theirs and drop out
+    for i, (candidate_id, profile) in enumerate(rng.sample(profiles, 40)):
+        traits = dict(dataset["users"][rng.choice(paged)]["traits"]) if i % 2 else {}
+        matrix.upsert(candidate_id, {**profile, "traits": traits})
+    # 20 new candidates the build never saw
+    for i in range(20):
+        template = dataset["users"][rng.choice(paged)]
+        matrix.upsert(f"new{i}@example.com", {"dob": template["dob"], "traits": dict(template["traits"])})
+
+    for email in paged:
+        assert_pages_equal_live(matrix, index, email, dataset["users"][email], seen_by(dataset, email))
+    assert index.stats()["stale_candidates"] == 40
+    assert index.hits > 0 and index.misses == 0
+
+
+def test_users_who_changed_are_ranked_live(built):
+    dataset, matrix, index = built
+    email = next(iter(dataset["users"]))
+    user = {**dataset["users"][email], "traits": {"lifestyle": "social"}}
+    matrix.upsert(email, user)
+    assert_pages_equal_live(matrix, index, email, user, {email})
+    late = {"dob": "1999-09-09", "traits": {"lifestyle": "chill"}}
+    matrix.upsert("late@example.com", late)
+    assert_pages_equal_live(matrix, index, "late@example.com", late, {"late@example.com"})
+    assert index.hits == 0 and index.misses > 0
@@ -0,0 +1,80 @@
+import copy
+import random
+
+import pytest
+
+from backend.matcher import match_user_to_rooms, rank_rooms_for_user
+from backend.room_index import RoomIndex
+from backend.synthetic import generate
+
+
+def with_space(rooms, min_free):
+    return [room for room in rooms if room["capacity"] - len(room["occupants"]) >= min_free]
+
+
+def card_scores(cards):
+    return [(card["id"], card["score"]) for card in cards]
+
+
+def rooms_and_users(seed, n_users=100, n_rooms=60):
+    """Seeded rooms, some emptied and some with occupants who never gave a DOB."""
+    dataset = generate(n_users, n_rooms, swipes_per_user=0, seed=seed)
+    rng = random.Random(seed)
+    for i, room in enumerate(dataset["rooms"]):
+        if i % 6 == 0:
+            room["occupants"] = []
+        for occupant in room["occupants"]:
+            if rng.random() < 0.3:
+                del occupant["dob"]
+    return dataset["rooms"], dataset["users"]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_best_room_matches_the_loop(seed):
+    rooms, users = rooms_and_users(seed)
+    index = RoomIndex(copy.deepcopy(rooms))
+    for user in users.values():
+        assert index.best_room(user) == match_user_to_rooms(user, rooms)
+        assert index.best_room(user, min_free=2) == match_user_to_rooms(user, with_space(rooms, 2))
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_rank_matches_the_loop(seed):
+    rooms, users = rooms_and_users(seed)
+    index = RoomIndex(copy.deepcopy(rooms))
+    for user in users.values():
+        assert card_scores(index.rank(user)) == card_scores(rank_rooms_for_user(user, rooms))
+
+
+def test_no_room_with_space():
+    rooms, users = rooms_and_users(3, n_users=5, n_rooms=10)
+    for room in rooms:
+        room["capacity"] = max(len(room["occupants"]), 1)
+        room["occupants"] = room["occupants"] or [{"name": "Sitting tenant", "traits": {}}]
+    index = RoomIndex(copy.deepcopy(rooms))
+    for user in users.values():
+        assert index.best_room(user) == match_user_to_rooms(user, rooms)
+        assert index.rank(user) == rank_rooms_for_user(user, rooms) == []
+
+
+def test_occupants_moving_in_and_out():
+    rooms, users = rooms_and_users(4, n_users=40, n_rooms=20)
+    index = RoomIndex(copy.deepcopy(rooms))
+    emails = list(users)
+    for email in emails[:30]:
+        room_id, _ = index.best_room(users[email])
+        if room_id is None:
+            break
+        occupant = {"name": email, "traits": users[email]["traits"]}
+        if emails.index(email) % 2:
+            occupant["dob"] = users[email]["dob"]
+        index.add_occupant(room_id, occupant)
+        next(room for room in rooms if room["room_id"] == room_id)["occupants"].append(occupant)
+    moved_out = rooms[1]["occupants"][:1]
+    for occupant in moved_out:
+        index.remove_occupant(rooms[1]["room_id"], occupant)
+        rooms[1]["occupants"].remove(occupant)
+    for email in emails[30:]:
+        user = users[email]
+        assert index.best_room(user, min_free=2) == match_user_to_rooms(user, with_space(rooms, 2))
+        assert card_scores(index.rank(user)) == card_scores(rank_rooms_for_user(user, rooms))
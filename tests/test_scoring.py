@@ -0,0 +1,107 @@
+import random
+
+import pytest
+
+from backend.matcher import calculate_life_path_number, chart_numerology_score, compute_compatibility
+from backend.scoring import CandidateMatrix, rank_profiles
+from backend.synthetic import generate
+
+
+def pool(seed, n_users=300):
+    """Seeded personas and users, some with no traits and some with only a few."""
+    dataset = generate(n_users, 0, swipes_per_user=0, seed=seed)
+    rng = random.Random(seed)
+    for i, user in enumerate(dataset["users"].values()):
+        if i % 7 == 0:
+            user["traits"] = {}
+        elif i % 5 == 0:
+            user["traits"] = dict(rng.sample(sorted(user["traits"].items()), 2))
+    return dataset
+
+
+def profile_records(dataset):
+    return dataset["personas"] + [{**user, "id": email} for email, user in dataset["users"].items()]
+
+
+def reference(user, candidates, seen):
+    """The original /ranked-matches loop, on the matcher's scalar functions rather than any encoding."""
+    scored = []
+    user_life_path = calculate_life_path_number(user.get("dob", ""))
+    for profile in candidates:
+        if profile["id"] in seen:
+            continue
+        trait_score = compute_compatibility(user.get("traits", {}), profile.get("traits", {}))
+        numerology = chart_numerology_score(user_life_path, calculate_life_path_number(profile.get("dob", ""))) * 2
+        scored.append((profile["id"], round((0.8 * trait_score + 0.2 * numerology) * 10, 2)))
+    scored.sort(key=lambda entry: entry[1], reverse=True)
+    return scored
+
+
+def ranked(matrix, user, seen, k=None, after=None):
+    return [(matrix.ids[row], score) for row, score in matrix.top_k(user.get("traits", {}), user.get("dob"), exclude=seen, k=k, after=after)]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_top_k_matches_the_scalar_loop(seed):
+    dataset = pool(seed)
+    matrix = CandidateMatrix.from_sources(dataset["personas"], dataset["users"])
+    candidates = profile_records(dataset)
+    for email in random.Random(seed).sample(list(dataset["users"]), 30):
+        user = dataset["users"][email]
+        assert ranked(matrix, user, {email}) == reference(user, candidates, {email})
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_pages_concatenate_to_the_full_ranking(seed):
+    dataset = pool(seed)
+    matrix = CandidateMatrix.from_sources(dataset["personas"], dataset["users"])
+    candidates = profile_records(dataset)
+    for email in random.Random(seed).sample(list(dataset["users"]), 10):
+        user = dataset["users"][email]
+        seen = {email} | set(random.Random(email).sample(list(dataset["users"]), 20))
+        paged, after = [], None
+        while page := matrix.top_k(user["traits"], user["dob"], exclude=seen, k=25, after=after):
+            paged += [(matrix.ids[row], score) for row, score in page]
+            after = (page[-1][1], page[-1][0])
+        assert paged == reference(user, candidates, seen)
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_rank_profiles_is_the_original_loop(seed):
+    dataset = pool(seed, n_users=100)
+    candidates = profile_records(dataset)
+    for email in list(dataset["users"])[:10]:
+        user = dataset["users"][email]
+        assert [(p["id"], p["score"]) for p in rank_profiles(user, candidates, {email})] == reference(user, candidates, {email})
+
+
+def test_ties_keep_candidate_order():
+    traits = {"lifestyle": "chill", "room_vibe": "cozy"}
+    personas = [{"id": f"persona_{i}", "dob": "2000-01-01", "traits": dict(traits)} for i in range(5)]
+    users = {f"user{i}@example.com": {"dob": "2000-01-01", "traits": dict(traits)} for i in range(5)}
+    matrix = CandidateMatrix.from_sources(personas, users)
+    user = {"dob": "2000-01-01", "traits": traits}
+    got = ranked(matrix, user, {"user2@example.com"})
+    assert got == reference(user, profile_records({"personas": personas, "users": users}), {"user2@example.com"})
+    assert len({score for _, score in got}) == 1
+    assert [candidate_id for candidate_id, _ in got] == [p["id"] for p in personas] + [e for e in users if e != "user2@example.com"]
+
+
+def test_empty_and_unknown_traits():
+    dataset = pool(3, n_users=50)
+    matrix = CandidateMatrix.from_sources(dataset["personas"], dataset["users"])
+    candidates = profile_records(dataset)
+    for user in ({"dob": "2001-02-03", "traits": {}}, {"dob": "2001-02-03"}, {"dob": "2001-02-03", "traits": {"lifestyle": "unheard-of"}}):
+        assert ranked(matrix, user, set()) == reference(user, candidates, set())
+
+
+def test_top_k_follows_upserts():
+    dataset = pool(4, n_users=100)
+    matrix = CandidateMatrix.from_sources(dataset["personas"], dataset["users"])
+    emails = list(dataset["users"])
+    dataset["users"][emails[3]]["traits"] = {}
+    dataset["users"][emails[8]]["traits"] = {"lifestyle": "social", "daily_rhythm": "night"}
+    for email in (emails[3], emails[8]):
+        matrix.upsert(email, dataset["users"][email])
+    user = dataset["users"][emails[0]]
+    assert ranked(matrix, user, {emails[0]}) == reference(user, profile_records(dataset), {emails[0]})
@@ -0,0 +1,133 @@
+import random
+
+import pytest
+
+from backend.scoring import CandidateMatrix
+from backend.session_deck import DeckCache
+from backend.synthetic import generate
+
+
+def setup(seed, n_users=300, **kwargs):
+    dataset = generate(n_users, 0, swipes_per_user=0, seed=seed)
+    matrix = CandidateMatrix.from_sources(dataset["personas"], dataset["users"])
+    return dataset, matrix, DeckCache(matrix, **kwargs)
+
+
+def ranker(matrix, user):
+    return lambda exclude, k, after: matrix.top_k(user["traits"], user["dob"], exclude=exclude, k=k, after=after)
+
+
+def swipe_through(cache, matrix, email, user, seen, pages=8, limit=20):
+    """Page through the deck with a cursor, swiping the first card of every page; each page must equal the uncached one."""
+    rank, after = ranker(matrix, user), None
+    for _ in range(pages):
+        page = cache.page(email, user["traits"], user["dob"], seen, limit, after, rank)
+        assert page == rank(seen, limit, after)
+        if not page:
+            break
+        seen.add(matrix.ids[page[0][0]])
+        cache.discard(email, matrix.ids[page[0][0]])
+        after = (page[-1][1], page[-1][0])
+    return after
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_pages_equal_uncached_pages_while_swiping(seed):
+    # A small deck so paging runs past it and refills
+    dataset, matrix, cache = setup(seed, deck_size=30)
+    for email in random.Random(seed).sample(list(dataset["users"]), 15):
+        swipe_through(cache, matrix, email, dataset["users"][email], {email})
+    assert cache.refills > 0 and cache.popped > 0
+
+
+def test_deck_runs_to_the_end():
+    dataset, matrix, cache = setup(2, n_users=40, deck_size=10)
+    email = next(iter(dataset["users"]))
+    swipe_through(cache, matrix, email, dataset["users"][email], {email}, pages=100, limit=7)
+
+
+def test_new_and_re_encoded_candidates_are_patched_in():
+    dataset, matrix, cache = setup(3, deck_size=50)
+    emails = list(dataset["users"])
+    email, user = emails[0], dataset["users"][emails[0]]
+    seen = {email}
+    after = swipe_through(cache, matrix, email, user, seen, pages=2)
+
+    # Candidates taking this user's traits jump ahead of the cursor; ones losing them drop out of the deck
+    for other in emails[100:110]:
+        matrix.upsert(other, {**dataset["users"][other], "traits": dict(user["traits"])})
+    for other in emails[1:20]:
+        matrix.upsert(other, {**dataset["users"][other], "traits": {}})
+    matrix.upsert("new@example.com", {"dob": user["dob"], "traits": dict(user["traits"])})
+    matrix.upsert("late@example.com", {"dob": "1990-01-01", "traits": {"lifestyle": "unheard-of"}})
+
+    rank = ranker(matrix, user)
+    hits = cache.hits
+    for cursor in (None, after):
+        assert cache.page(email, user["traits"], user["dob"], seen, 20, cursor, rank) == rank(seen, 20, cursor)
+    assert cache.hits == hits + 2 and cache.patched > 0
+    swipe_through(cache, matrix, email, user, seen)
+
+
+def test_owner_changing_traits_rebuilds_the_deck():
+    dataset, matrix, cache = setup(4)
+    email = next(iter(dataset["users"]))
+    user = dataset["users"][email]
+    swipe_through(cache, matrix, email, user, {email}, pages=1)
+    user = {**user, "traits": {"lifestyle": "social"}}
+    matrix.upsert(email, user)
+    misses = cache.misses
+    swipe_through(cache, matrix, email, user, {email}, pages=2)
+    assert cache.misses == misses + 1
+
+
+def test_discard_pops_the_card():
+    dataset, matrix, cache = setup(5)
+    email = next(iter(dataset["users"]))
+    user = dataset["users"][email]
+    rank = ranker(matrix, user)
+    first = cache.page(email, user["traits"], user["dob"], {email}, 5, None, rank)
+    swiped = matrix.ids[first[0][0]]
+    cards = cache.stats()["cards"]
+
+    cache.discard(email, swiped)
+    cache.discard("nobody@example.com", swiped)  # no deck, nothing queued
+    page = cache.page(email, user["traits"], user["dob"], {email, swiped}, 5, None, rank)
+    assert page[:4] == first[1:] and page == rank({email, swiped}, 5, None)
+    assert cache.popped == 1 and cache.stats()["cards"] == cards - 1
+
+
+def test_idle_decks_expire():
+    now = [0.0]
+    dataset, matrix, cache = setup(6, n_users=60, ttl=10.0, clock=lambda: now[0])
+    a, b = list(dataset["users"])[:2]
+
+    def page(email):
+        user = dataset["users"][email]
+        return cache.page(email, user["traits"], user["dob"], {email}, 5, None, ranker(matrix, user))
+
+    page(a)
+    now[0] = 8.0
+    page(b)
+    now[0] = 15.0
+    page(b)  # a has been idle for 15s and is dropped; b only for 7s
+    assert (cache.expired, cache.hits, cache.stats()["entries"]) == (1, 1, 1)
+    page(a)
+    assert (cache.misses, cache.stats()["entries"]) == (3, 2)
+
+
+def test_least_recently_used_deck_is_evicted():
+    dataset, matrix, cache = setup(7, n_users=60, maxsize=2)
+    a, b, c = list(dataset["users"])[:3]
+
+    def page(email):
+        user = dataset["users"][email]
+        return cache.page(email, user["traits"], user["dob"], {email}, 5, None, ranker(matrix, user))
+
+    for email in (a, b, a, c):
+        page(email)
+    assert (cache.evictions, cache.stats()["entries"]) == (1, 2)
+    page(a)
+    assert cache.hits == 2
+    page(b)
+    assert (cache.misses, cache.evictions) == (4, 2)
@@ -0,0 +1,51 @@
+import pytest
+
+from backend.synthetic import PASSWORD
+
+
+@pytest.fixture(scope="module")
+def swiper(client):
+    """A freshly signed-up user, logged in on the shared client."""
+    email = "swiper@example.com"
+    response = client.post("/signup", data={"name": "Swiper", "email": email, "password": PASSWORD, "dob": "2001-02-03"}, follow_redirects=False)
+    assert response.status_code == 302
+    return email
+
+
+@pytest.mark.parametrize("body", [
+    {"direction": "right"},
+    {"target": None, "direction": "right"},
+    {"target": "", "direction": "left"},
+    {"target": ["persona_1"], "direction": "right"},
+    {"target": {"id": "persona_1"}, "direction": "left"},
+    {"target": "persona_1"},
+    {"target": "persona_1", "direction": "up"},
+    {"target": "persona_1", "direction": "RIGHT"},
+    {"target": "persona_1", "direction": 1},
+    ["persona_1", "right"],
+])
+def test_bad_swipes_are_rejected_before_anything_is_stored(client, swiper, body):
+    import backend.main
+
+    response = client.post("/swipe", json=body)
+    assert response.status_code == 400
+    assert "error" in response.json()
+    assert backend.main.get_swipe_index().seen(swiper) == set()
+    assert backend.main.storage.get_swipes(swiper) == {"liked": [], "disliked": []}
+
+
+def test_valid_swipe_is_recorded(client, swiper):
+    import backend.main
+
+    response = client.post("/swipe", json={"target": "persona_1", "direction": "left"})
+    assert response.status_code == 200
+    assert response.json() == {"status": "swipe recorded", "match": False}
+    assert backend.main.get_swipe_index().seen(swiper) == {"persona_1"}
+
+
+def test_swipe_needs_a_login():
+    from fastapi.testclient import TestClient
+
+    from backend.main import app
+
+    assert TestClient(app).post("/swipe", json={"target": "persona_1", "direction": "left"}).status_code == 401
@@ -0,0 +1,113 @@
+import random
+
+import pytest
+
+from backend.benchmark import keyword_spans
+from backend.synthetic import generate, transcript
+from backend.trait_classifier import KeywordAutomaton, TraitClassifier
+
+
+@pytest.fixture(scope="module")
+def classifier():
+    return TraitClassifier.from_file()
+
+
+def spans(automaton, text):
+    return [(start, end, payload) for start, end, payload in automaton.find(text)]
+
+
+def test_find_matches_whole_words_only():
+    automaton = KeywordAutomaton({"read": "read", "late": "late"})
+    assert spans(automaton, "I read. Reading is already late-ish, but I READ") == [
+        (2, 6, "read"), (27, 31, "late"), (43, 47, "read"),
+    ]
+    assert spans(automaton, "bread, plates, relate") == []
+
+
+def test_find_reports_overlapping_keywords():
+    automaton = KeywordAutomaton({word: word for word in ("he", "she", "her", "hers")})
+    # "he" sits inside "she" and "her" inside "hers", but neither is a word of its own there
+    assert spans(automaton, "she hers her he") == [(0, 3, "she"), (4, 8, "hers"), (9, 12, "her"), (13, 15, "he")]
+
+
+def test_find_multi_word_keywords():
+    automaton = KeywordAutomaton({word: word for word in ("after", "dark", "after dark", "stay in")})
+    found = spans(automaton, "Only after dark, I stay in.")
+    assert sorted(found) == [(5, 10, "after"), (5, 15, "after dark"), (11, 15, "dark"), (19, 26, "stay in")]
+    assert [end for _, end, _ in found] == sorted(end for _, end, _ in found)
+    assert spans(automaton, "afterdark, after  dark, stay inside") == [(11, 16, "after"), (18, 22, "dark")]
+
+
+def test_find_matches_a_regex_scan_per_keyword(classifier):
+    rng = random.Random(0)
+    for user in generate(200, 0, swipes_per_user=0, seed=0)["users"].values():
+        call = transcript(rng, user["traits"], classifier.questions)
+        found = sorted((start, end, call.lower()[start:end]) for start, end, _ in classifier.automaton.find(call))
+        assert found == keyword_spans(classifier.questions, call)
+
+
+def test_classify_takes_the_value_with_most_votes(classifier):
+    assert classifier.classify("early morning person, sunrise runs, sometimes late") == {"daily_rhythm": "morning"}
+    # "friends" votes in lifestyle and study_habits
+    assert classifier.classify("friends") == {"lifestyle": "social", "study_habits": "collab"}
+    assert classifier.classify("friends", trait="lifestyle") == {"lifestyle": "social"}
+    assert classifier.classify("nothing to go on") == {}
+
+
+def test_classify_leaves_out_ties(classifier):
+    assert classifier.classify("morning or night, I never know") == {"daily_rhythm": "night"}
+    assert classifier.classify("morning or night") == {}
+    # A tie in one trait does not hold back the others
+    assert classifier.classify("morning or night, music and a group") == {"study_habits": "collab"}
+    assert classifier.classify("warm, clean, loud") == {}
+
+
+def test_classify_answers_decides_each_answer_only_for_its_trait(classifier):
+    answers = {"daily_rhythm": "party until late", "2": "stay in and read", 5: "we talk it through"}
+    assert classifier.classify_answers(answers) == {"daily_rhythm": "night", "lifestyle": "chill", "conflict_style": "direct"}
+
+
+@pytest.mark.parametrize("answers, message", [
+    ({"star_sign": "leo"}, "unknown trait or question: star_sign"),
+    ({"99": "early"}, "unknown trait or question: 99"),
+    ({"daily_rhythm": ["early"]}, "answer to daily_rhythm is not text"),
+    ({"1": None}, "answer to 1 is not text"),
+])
+def test_classify_answers_rejects_bad_answers(classifier, answers, message):
+    with pytest.raises(ValueError, match=message):
+        classifier.classify_answers(answers)
+
+
+def test_classify_batch(classifier):
+    assert classifier.classify_batch(["sunrise and daylight", {"lifestyle": "clubbing"}]) == [{"daily_rhythm": "morning"}, {"lifestyle": "social"}]
+    with pytest.raises(ValueError):
+        classifier.classify_batch(["early", 7])
+
+
+def test_classify_traits_endpoint(client):
+    response = client.post("/classify-traits", json={"transcripts": ["sunrise and daylight", {"3": "library, alone"}]})
+    assert response.status_code == 200
+    assert response.json() == {"traits": [{"daily_rhythm": "morning"}, {"study_habits": "quiet"}]}
+
+
+@pytest.mark.parametrize("body", [
+    [],
+    {},
+    {"transcripts": "early"},
+    {"transcripts": ["early", 7]},
+    {"transcripts": [{"star_sign": "leo"}]},
+])
+def test_classify_traits_rejects_bad_batches(client, body):
+    response = client.post("/classify-traits", json=body)
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def test_classify_traits_limits_the_batch_size(client, monkeypatch):
+    import backend.main
+
+    monkeypatch.setattr(backend.main, "MAX_CLASSIFY_BATCH", 3)
+    assert client.post("/classify-traits", json={"transcripts": ["early"] * 3}).status_code == 200
+    response = client.post("/classify-traits", json={"transcripts": ["early"] * 4})
+    assert response.status_code == 413
+    assert response.json() == {"error": "at most 3 transcripts per request"}